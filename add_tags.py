@@ -1,138 +1,61 @@
 #!/usr/bin/env python3
 
-import re
+from fortune_entries import add_tagger_arguments, message_stream, rewrite_file
+from tag_rules import load_profile
+from tag_stats import TagStats
+
+# Compiled from rules/add_tags.json
+RULES = load_profile('add_tags')
 
 def get_tags(content, author):
     """Determine appropriate tags based on content and author."""
-    tags = set()
-    content_lower = content.lower()
-    
-    # Common tags based on content
-    if any(word in content_lower for word in ['leadership', 'leader', 'manage', 'team']):
-        tags.add('#leadership')
-    if any(word in content_lower for word in ['success', 'achieve', 'succeed']):
-        tags.add('#success')
-    if any(word in content_lower for word in ['business', 'company', 'startup', 'entrepreneur']):
-        tags.add('#business')
-    if any(word in content_lower for word in ['learn', 'knowledge', 'wisdom', 'understand']):
-        tags.add('#wisdom')
-    if any(word in content_lower for word in ['work', 'effort', 'hard work']):
-        tags.add('#work')
-    if any(word in content_lower for word in ['dream', 'vision', 'goal']):
-        tags.add('#goals')
-    if any(word in content_lower for word in ['life', 'live', 'experience']):
-        tags.add('#life')
-    if any(word in content_lower for word in ['think', 'thought', 'mind']):
-        tags.add('#thinking')
-    if any(word in content_lower for word in ['science', 'technology', 'tech', 'computer']):
-        tags.add('#tech')
-    if any(word in content_lower for word in ['art', 'creative', 'create', 'imagination']):
-        tags.add('#creativity')
+    return RULES.tags(content, author)
+
+def tag_entry(entry):
+    """Return the output lines for an entry with its tag line added."""
+    if not entry.lines:
+        return ['%']
     
-    # Special case for known authors
-    if 'edison' in author.lower():
-        tags.add('#invention')
-        tags.add('#perseverance')
-    if 'einstein' in author.lower():
-        tags.add('#science')
-        tags.add('#genius')
-    if 'jobs' in author.lower():
-        tags.add('#innovation')
-        tags.add('#design')
+    # Author and content lines, as split once for every step below
+    parts = entry.parts
     
-    # If no tags matched, add a general one
-    if not tags:
-        tags.add('#quote')
+    # Get content (everything except author line and empty lines)
+    content = ' '.join(l for l in parts.content_lines if l.strip())
     
-    return ' '.join(sorted(tags))
-
-def process_file(input_file, output_file):
-    """Process the input file and write tagged output to output file."""
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = [line.rstrip() for line in f]
+    # Get tags
+    tags = get_tags(content, parts.author or 'Unknown')
     
-    output = []
-    current_entry = []
+    # Rebuild the entry with original structure plus tags
+    output_entry = parts.content_lines.copy()
     
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        
-        if line == '%':
-            if current_entry:
-                # Process the completed entry
-                entry_text = '\n'.join(current_entry)
-                # Find the last line that starts with a tab (author line)
-                author_line = next((line for line in reversed(current_entry) if line.startswith('\t- ')), '')
-                author = author_line[3:] if author_line else 'Unknown'
-                
-                # Get content (everything except author line and empty lines)
-                content_lines = [l for l in current_entry if l.strip() and not l.startswith('\t- ')]
-                content = ' '.join(content_lines)
-                
-                # Get tags
-                tags = get_tags(content, author)
-                
-                # Rebuild the entry with original structure plus tags
-                output_entry = []
-                # Add all lines except the author line
-                output_entry = [line for line in current_entry if not line.startswith('\t- ')]
-                
-                # Add author line if it exists
-                if author_line:
-                    output_entry.append(author_line)
-                
-                # Add tags
-                output_entry.append(f'\t{tags}')
-                
-                # Add to output
-                output.extend(output_entry)
-                output.append('%')
-                current_entry = []
-            else:
-                output.append('%')
-        else:
-            current_entry.append(line)
-            
-        i += 1
+    # Add author line if it exists
+    if parts.author_line:
+        output_entry.append(parts.author_line)
     
-    # Process any remaining entry
-    if current_entry:
-        author_line = next((line for line in reversed(current_entry) if line.startswith('\t- ')), '')
-        author = author_line[3:] if author_line else 'Unknown'
-        
-        # Get content (everything except author line and empty lines)
-        content_lines = [l for l in current_entry if l.strip() and not l.startswith('\t- ')]
-        content = ' '.join(content_lines)
-        
-        # Get tags
-        tags = get_tags(content, author)
-        
-        # Rebuild the entry with original structure plus tags
-        output_entry = [line for line in current_entry if not line.startswith('\t- ')]
-        
-        # Add author line if it exists
-        if author_line:
-            output_entry.append(author_line)
-        
-        # Add tags
-        output_entry.append(f'\t{tags}')
-        
-        # Add to output
-        output.extend(output_entry)
-        output.append('%')
+    # Add tags
+    output_entry.append(f'\t{tags}')
+    output_entry.append('%')
+    return output_entry
+
+def process_file(input_file, output_file, jobs=1, stats=None):
+    """Process the input file and write tagged output to output file.
     
-    # Write the output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(output))
+    With a TagStats, rule hits and phase timings are recorded in it.
+    """
+    with RULES.collect_stats(stats):
+        rewrite_file(input_file, output_file, tag_entry, jobs, stats)
 
 if __name__ == '__main__':
+    import argparse
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python add_tags.py input_file output_file")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Add tags to a fortune file.')
+    add_tagger_arguments(parser)
+    args = parser.parse_args()
+    
+    out = message_stream(args.output_file)
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    process_file(input_file, output_file)
-    print(f"Tags added successfully. Output written to {output_file}")
+    stats = TagStats() if args.stats else None
+    process_file(args.input_file, args.output_file, jobs=args.jobs, stats=stats)
+    print(f"Tags added successfully. Output written to {args.output_file}", file=out)
+    if stats is not None:
+        print(stats.report(args.stats_format), file=sys.stderr)
@@ -1,65 +1,59 @@
 #!/usr/bin/env python3
 
-def should_tag(entry_lines):
+from fortune_entries import add_tagger_arguments, message_stream, rewrite_file
+from tag_rules import load_profile
+from tag_stats import TagStats
+
+# Compiled from rules/add_tags_safely.json
+RULES = load_profile('add_tags_safely')
+
+def should_tag(entry):
     """Check if we should add tags to this entry."""
-    has_author = any(line.startswith('\t- ') for line in entry_lines)
-    has_content = any(not line.startswith('\t') and line.strip() and line != '%' 
-                     for line in entry_lines)
-    return has_author and has_content
+    parts = entry.parts
+    return bool(parts.author_line) and parts.has_content
 
 def get_tag(content):
     """Return a simple tag based on content."""
-    content_lower = content.lower()
-    if any(word in content_lower for word in ['lead', 'leader', 'manage', 'team']):
-        return '#leadership'
-    if any(word in content_lower for word in ['business', 'company', 'market']):
-        return '#business'
-    if any(word in content_lower for word in ['learn', 'knowledge', 'wisdom']):
-        return '#wisdom'
-    return '#quote'
+    return RULES.tags(content)
 
-def process_file(input_file, output_file):
-    """Process the input file and write tagged output to output file."""
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+def tag_entry(entry):
+    """Return the output lines for an entry, tagged if it is complete."""
+    # Lines after the last % are dropped
+    if not entry.terminated:
+        return []
     
-    output = []
-    current_entry = []
-    
-    for line in lines:
-        line = line.rstrip()
-        current_entry.append(line)
+    output_entry = entry.lines + ['%']
+    if should_tag(entry):
+        # Get content (all non-author, non-empty lines)
+        content = ' '.join(l for l in entry.parts.content_lines if l.strip())
+        
+        # Get simple tag
+        tag = get_tag(content)
         
-        if line == '%':
-            if should_tag(current_entry):
-                # Get content (all non-author, non-empty lines)
-                content_lines = [l for l in current_entry 
-                               if not l.startswith('\t- ') 
-                               and l.strip() 
-                               and l != '%']
-                content = ' '.join(content_lines)
-                
-                # Get simple tag
-                tag = get_tag(content)
-                
-                # Insert tag before the closing %
-                current_entry.insert(-1, f'\t{tag}')
-            
-            # Add all lines of the entry to output
-            output.append('\n'.join(current_entry))
-            current_entry = []
+        # Insert tag before the closing %
+        output_entry.insert(-1, f'\t{tag}')
     
-    # Write the output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(output))
+    return output_entry
+
+def process_file(input_file, output_file, jobs=1, stats=None):
+    """Process the input file and write tagged output to output file.
+    
+    With a TagStats, rule hits and phase timings are recorded in it.
+    """
+    with RULES.collect_stats(stats):
+        rewrite_file(input_file, output_file, tag_entry, jobs, stats)
 
 if __name__ == '__main__':
+    import argparse
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python add_tags_safely.py input_file output_file")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Add one tag to each complete entry of a fortune file.')
+    add_tagger_arguments(parser)
+    args = parser.parse_args()
+    
+    out = message_stream(args.output_file)
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    process_file(input_file, output_file)
-    print(f"Tags added successfully to {output_file}")
+    stats = TagStats() if args.stats else None
+    process_file(args.input_file, args.output_file, jobs=args.jobs, stats=stats)
+    print(f"Tags added successfully to {args.output_file}", file=out)
+    if stats is not None:
+        print(stats.report(args.stats_format), file=sys.stderr)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+import hashlib
+import importlib
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+# Every tagging script with a process_file(input_file, output_file)
+SCRIPTS = [
+    'fix_quotes',
+    'improved_tags',
+    'add_tags',
+    'safe_add_tags',
+    'simple_tag_adder',
+    'strict_tag_adder',
+    'add_tags_safely',
+    'add_tags_to_complete_entries',
+]
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Vocabulary for synthetic quotes, with the taggers' keywords mixed in
+# (including ones that only match inside other words, like 'art' in 'start')
+WORDS = '''
+the a of to and in is it you that he was for on are as with his they at be
+this have from or one had by word but not what all were we when your can
+said there use an each which she do how their if will up other about out
+many then them these so some her would make like him into time has look two
+more write go see number no way could people my than first been call who
+its now find long down day did get come made may part over new sound take
+only little work know place year live me back give most very after thing
+our just name good sentence man think say great where help through much
+before line right too mean old any same tell boy follow came want show also
+around form three small set put end does another well large must big even
+such because turn here why ask went men read need land different home us
+move try kind hand picture again change off play spell air away animal house
+point page letter mother answer found study still learn should world lead
+leader manage team vision inspire guide succeed achieve success company
+startup entrepreneur market customer product knowledge understand insight
+wise effort dedication persevere discipline dream goal aspire ambition
+experience journey purpose meaning thought mind intellect technology
+computer code software digital create imagination innovate design invent
+teach school truth existence ethics research discover experiment physics
+past war revolution government power democracy freedom rights love friend
+family partner feel emotion happy sad angry fear start art said again
+wonderful amazing best excellent hate terrible worst never cannot fail
+'''.split()
+
+AUTHORS = [
+    'Albert Einstein', 'Thomas Edison', 'Steve Jobs', 'Walt Disney',
+    'Martin Luther King, Jr.', 'Marcus Aurelius', 'Seneca', 'Unknown',
+    'Peter Thiel, Founder\'s Fund', 'Richard Dawkins', 'Levon K.',
+    'George Bernard Shaw, Man and Superman', 'Frank Herbert', 'Buddha',
+]
+
+TAGS = [
+    '#quote', '#wisdom', '#entrepreneur', '#ManyBetsThesis', '#science',
+    '#politics', '#debate', '#leadership', '#foresight', '#life', '#risk',
+    '#courage', '#patience', '#stoicism', '#success', '#business',
+]
+
+# How author lines are written in levonkquotes, most common first
+AUTHOR_FORMATS = [
+    (80, '\t- {}'), (8, '    - {}'), (5, '\t– {}'), (4, '\t― {}'), (3, None),
+]
+
+def _synthetic_entry(rng):
+    """Return the lines of one synthetic entry."""
+    lines = []
+    for _ in range(rng.choice((1, 1, 2, 2, 3, 4))):
+        words = rng.choices(WORDS, k=rng.randint(4, 14))
+        words[0] = words[0].capitalize()
+        lines.append(' '.join(words) + rng.choice('.,.?!;'))
+
+    (fmt,) = rng.choices([fmt for _, fmt in AUTHOR_FORMATS],
+                         weights=[weight for weight, _ in AUTHOR_FORMATS])
+    if fmt:
+        lines.append(fmt.format(rng.choice(AUTHORS)))
+
+    roll = rng.random()
+    if roll < 0.5:
+        lines.append(' '.join(rng.sample(TAGS, rng.randint(1, 6))))
+    elif roll < 0.7:
+        lines.append('\t' + ' '.join(rng.sample(TAGS, rng.randint(1, 3))))
+    return lines
+
+def generate_corpus(path, count, seed=0):
+    """Write a synthetic fortune file of count entries shaped like levonkquotes.
+
+    Entries have one to four body lines, tab or space indented author lines
+    with the '-', '–' and '―' dashes (a few have none), bare or indented
+    tag lines, and now and then an empty '%' record. The same seed always
+    gives the same file.
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write('%\n')
+        for _ in range(count):
+            if rng.random() < 0.02:
+                f.write('%\n')
+            f.write('\n'.join(_synthetic_entry(rng)))
+            f.write('\n%\n')
+
+def _file_digest(path):
+    """Return the sha256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _run_one(source_dir, script, input_file, output_file, options):
+    """Run script's process_file in this process and return its measurements."""
+    import resource
+    sys.path.insert(0, source_dir)
+    module = importlib.import_module(script)
+    # Drop options the script (or an older version of it) does not take
+    accepted = inspect.signature(module.process_file).parameters
+    options = {name: value for name, value in options.items() if name in accepted}
+    start = time.perf_counter()
+    module.process_file(input_file, output_file, **options)
+    wall = time.perf_counter() - start
+    # With --jobs the work happens in the worker processes, so take the
+    # larger of this process and its biggest (finished) worker
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {'wall_s': wall,
+            'peak_rss_kb': peak_rss,
+            'options': options}
+
+def measure(source_dir, script, input_file, output_file, options=None):
+    """Run script in a fresh interpreter and return its measurements.
+
+    A separate process per run keeps the peak RSS of one script from
+    hiding another's and keeps imports out of the timing.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '_run-one', source_dir,
+               script, input_file, output_file, json.dumps(options or {})]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=source_dir)
+    if result.returncode:
+        raise RuntimeError(f'{script} failed:\n{result.stderr}')
+    measurements = json.loads(result.stdout)
+    measurements['output_sha256'] = _file_digest(output_file)
+    return measurements
+
+def extract_revision(revision, directory):
+    """Extract the tree of a git revision of this repository into directory."""
+    archive = subprocess.run(['git', '-C', HERE, 'archive', '--format=tar', revision],
+                             capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+
+def _git_revision():
+    """Return the short hash of HEAD, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', '-C', HERE, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes, scripts, workdir, jobs=None, reference=None, log=print):
+    """Benchmark scripts on synthetic corpora and return the results.
+
+    Each script runs serially, with jobs worker processes if jobs > 1, and
+    with a warm tag cache if it supports one. Every variant's output must
+    match the serial output, and with a reference git revision the serial
+    output must also match that revision's script. Mismatches are listed
+    under 'mismatches' rather than raised, so one run reports them all.
+    """
+    variants = [('serial', {})]
+    if jobs and jobs > 1:
+        variants.append((f'jobs={jobs}', {'jobs': jobs}))
+
+    reference_dir = None
+    if reference:
+        reference_dir = os.path.join(workdir, 'reference')
+        extract_revision(reference, reference_dir)
+
+    results = []
+    mismatches = []
+    for size in sizes:
+        corpus = os.path.join(workdir, f'corpus-{size}')
+        if not os.path.exists(corpus):
+            log(f'Generating {size} entries...')
+            generate_corpus(corpus, size)
+        output_file = os.path.join(workdir, 'output')
+        for script in scripts:
+            module_variants = list(variants)
+            if 'cache_file' in inspect.signature(importlib.import_module(script).process_file).parameters:
+                cache_file = os.path.join(workdir, f'{script}-{size}.tagcache')
+                if os.path.exists(cache_file):
+                    os.unlink(cache_file)
+                # The first run fills the cache, the second reads it
+                measure(HERE, script, corpus, output_file, {'cache_file': cache_file})
+                module_variants.append(('cache-warm', {'cache_file': cache_file}))
+
+            serial_digest = None
+            for variant, options in module_variants:
+                m = measure(HERE, script, corpus, output_file, options)
+                if serial_digest is None:
+                    serial_digest = m['output_sha256']
+                elif m['output_sha256'] != serial_digest:
+                    mismatches.append(f'{script} {variant} on {size} entries differs from serial')
+                result = {'script': script, 'variant': variant, 'entries': size,
+                          'wall_s': round(m['wall_s'], 4), 'peak_rss_kb': m['peak_rss_kb'],
+                          'entries_per_s': round(size / m['wall_s']) if m['wall_s'] else None,
+                          'output_sha256': m['output_sha256']}
+                results.append(result)
+                log(f"{script:30} {variant:15} {size:>9} {result['wall_s']:9.3f}s "
+                    f"{result['peak_rss_kb']:>9} KB {result['entries_per_s']:>9}/s")
+
+            if reference_dir and os.path.exists(os.path.join(reference_dir, f'{script}.py')):
+                m = measure(reference_dir, script, corpus, output_file)
+                if m['output_sha256'] != serial_digest:
+                    mismatches.append(f'{script} on {size} entries differs from {reference}')
+                results.append({'script': script, 'variant': f'reference {reference}',
+                                'entries': size, 'wall_s': round(m['wall_s'], 4),
+                                'peak_rss_kb': m['peak_rss_kb'],
+                                'entries_per_s': round(size / m['wall_s']) if m['wall_s'] else None,
+                                'output_sha256': m['output_sha256']})
+
+    return {'revision': _git_revision(), 'python': platform.python_version(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results,
+            'mismatches': mismatches}
+
+# fortune-tools commands whose cold start is timed, with their targets in ms.
+# '{output}' is replaced by a scratch file.
+STARTUP_COMMANDS = {
+    'help': [],
+    'pick': ['pick'],
+    'pick --pair': ['pick', '--pair'],
+    'query': ['query', 'levonkquotes', '#wisdom', '--count'],
+    'search': ['search', 'levonkquotes', 'wisdom', '-k', '1'],
+    'contradictions': ['contradictions', 'great minds think alike'],
+    'lint': ['lint', '--jobs', '1', 'levonkquotes'],
+    'tag': ['tag', 'improved_tags', 'levonkquotes', '{output}'],
+}
+STARTUP_TARGETS_MS = {'pick': 50}
+
+def measure_startup(repeat=20, commands=STARTUP_COMMANDS, log=print):
+    """Time fresh interpreter runs of fortune-tools commands.
+
+    Each command runs once untimed so rule and index caches are warm, as
+    they are in everyday use, then repeat times. Returns a report with the
+    best and median milliseconds of each command and whether it met its
+    target in STARTUP_TARGETS_MS, judged by the median.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix='fortune-startup-') as directory:
+        output = os.path.join(directory, 'output')
+        baseline = [sys.executable, '-c', 'pass']
+        for name, args in [('python -c pass', None)] + list(commands.items()):
+            if args is None:
+                command = baseline
+            else:
+                command = [sys.executable, os.path.join(HERE, 'fortune_tools.py')] + \
+                    [output if arg == '{output}' else arg for arg in args]
+            # Exit statuses are not checked: lint fails on a corpus with problems
+            subprocess.run(command, cwd=HERE, stdout=subprocess.DEVNULL)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run(command, cwd=HERE, stdout=subprocess.DEVNULL)
+                times.append((time.perf_counter() - start) * 1000)
+            times.sort()
+            result = {'command': name, 'best_ms': round(times[0], 1),
+                      'median_ms': round(times[len(times) // 2], 1)}
+            target = STARTUP_TARGETS_MS.get(name)
+            if target is not None:
+                result['target_ms'] = target
+                result['met'] = result['median_ms'] <= target
+            results.append(result)
+            log(f"{name:16} best {result['best_ms']:7.1f} ms  median {result['median_ms']:7.1f} ms"
+                + (f"  target {target} ms: {'met' if result['met'] else 'MISSED'}"
+                   if target is not None else ''))
+    return {'revision': _git_revision(), 'python': platform.python_version(),
+            'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat, 'results': results}
+
+def compare(old, new):
+    """Return lines comparing two benchmark result sets."""
+    old_results = {(r['script'], r['variant'], r['entries']): r for r in old['results']}
+    lines = [f"{'script':30} {'variant':15} {'entries':>9} {'old s':>9} {'new s':>9} "
+             f"{'speedup':>8} {'old KB':>9} {'new KB':>9}  output"]
+    for r in new['results']:
+        o = old_results.get((r['script'], r['variant'], r['entries']))
+        if o is None:
+            continue
+        speedup = o['wall_s'] / r['wall_s'] if r['wall_s'] else float('inf')
+        same = 'same' if o['output_sha256'] == r['output_sha256'] else 'DIFFERS'
+        lines.append(f"{r['script']:30} {r['variant']:15} {r['entries']:>9} {o['wall_s']:9.3f} "
+                     f"{r['wall_s']:9.3f} {speedup:7.2f}x {o['peak_rss_kb']:>9} "
+                     f"{r['peak_rss_kb']:>9}  {same}")
+    return lines
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '_run-one':
+        source_dir, script, input_file, output_file, options = sys.argv[2:7]
+        print(json.dumps(_run_one(source_dir, script, input_file, output_file,
+                                  json.loads(options))))
+        sys.exit(0)
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the tagging scripts on synthetic corpora.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help='corpus sizes in entries (default: 10000 100000 1000000)')
+    run_parser.add_argument('--scripts', nargs='+', default=SCRIPTS, choices=SCRIPTS,
+                            metavar='SCRIPT', help='scripts to run (default: all)')
+    run_parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                            help='worker processes for the parallel variant (default: CPU count)')
+    run_parser.add_argument('--reference', metavar='REVISION',
+                            help='also check outputs against the scripts of this git revision')
+    run_parser.add_argument('--workdir', help='keep generated corpora here (default: a temporary directory)')
+    run_parser.add_argument('--output', '-o', default='benchmark.json',
+                            help='results file (default: benchmark.json)')
+
+    generate_parser = subparsers.add_parser('generate', help='write a synthetic corpus')
+    generate_parser.add_argument('entries', type=int)
+    generate_parser.add_argument('output_file')
+    generate_parser.add_argument('--seed', type=int, default=0)
+
+    startup_parser = subparsers.add_parser('startup', help='time the cold start of fortune-tools commands')
+    startup_parser.add_argument('--repeat', type=int, default=20,
+                                help='timed runs per command (default: 20)')
+    startup_parser.add_argument('--output', '-o', default='startup.json',
+                                help='results file (default: startup.json)')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate_corpus(args.output_file, args.entries, args.seed)
+    elif args.command == 'startup':
+        report = measure_startup(args.repeat)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print(f'Results written to {args.output}')
+        sys.exit(0 if all(r.get('met', True) for r in report['results']) else 1)
+    elif args.command == 'compare':
+        with open(args.old, encoding='utf-8') as f:
+            old = json.load(f)
+        with open(args.new, encoding='utf-8') as f:
+            new = json.load(f)
+        print('\n'.join(compare(old, new)))
+    else:
+        workdir = args.workdir or tempfile.mkdtemp(prefix='fortune-bench-')
+        os.makedirs(workdir, exist_ok=True)
+        try:
+            report = run_benchmarks(args.sizes, args.scripts, workdir, args.jobs, args.reference)
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print(f'Results written to {args.output}')
+        for mismatch in report['mismatches']:
+            print(f'MISMATCH: {mismatch}')
+        sys.exit(1 if report['mismatches'] else 0)
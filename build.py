@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from datfile import DAT_FORMAT, build_dat
+from fortune_entries import replace_file, source_state
+from length_index import open_length_index
+from search_index import open_search_index
+from tag_index import open_tag_index
+
+# Where the source digests of the last build are kept
+STATE_FILE = '.build-state.json'
+
+# Files that are never corpora, whatever they hold: our own artifacts
+SKIP_SUFFIXES = ('.dat', '.tags', '.search', '.lengths', '.suggest', '.pack', '.json', '.jsonl', '.py', '.sh', '.md')
+
+# Bytes read to decide whether a file is a corpus
+SNIFF_SIZE = 65536
+
+DELIMITER_LINE_RE = re.compile(rb'(?m)^%\r?$')
+
+def _build_dat(corpus_file):
+    build_dat(corpus_file, f'{corpus_file}.dat')
+
+def _build_tags(corpus_file):
+    open_tag_index(corpus_file)
+
+def _build_search(corpus_file):
+    open_search_index(corpus_file)
+
+def _build_lengths(corpus_file):
+    open_length_index(corpus_file)
+
+# Artifact name: (file suffix, builder taking the corpus path, format); the
+# format changes when a builder would write something else for the same
+# source, and artifacts built in another format are rebuilt
+ARTIFACTS = {
+    'dat': ('.dat', _build_dat, DAT_FORMAT),
+    'tags': ('.tags', _build_tags, 1),
+    'search': ('.search', _build_search, 1),
+    'lengths': ('.lengths', _build_lengths, 1),
+}
+
+def is_corpus(path):
+    """Return True if path looks like a '%'-delimited fortune file.
+
+    Only the start of the file is read: it must be UTF-8 text that is not
+    a script and has a line holding just '%'.
+    """
+    if os.path.basename(path).startswith('.') or path.endswith(SKIP_SUFFIXES):
+        return False
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError:
+        return False
+    if b'\0' in head or head.startswith(b'#!'):
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A character cut off at the end of the sample is fine
+        if e.start < len(head) - 3:
+            return False
+    return DELIMITER_LINE_RE.search(head) is not None
+
+def find_corpora(directory, known=None):
+    """Return the paths of the corpus files in directory, sorted.
+
+    known is a dict that remembers what is_corpus said of each file by its
+    size and mtime, so a file that did not change is not read again.
+    """
+    if known is None:
+        known = {}
+    corpora = []
+    for entry in os.scandir(directory):
+        if not entry.is_file():
+            continue
+        st = entry.stat()
+        stamp = (st.st_size, st.st_mtime_ns)
+        seen = known.get(entry.path)
+        if seen is None or seen[0] != stamp:
+            seen = known[entry.path] = (stamp, is_corpus(entry.path))
+        if seen[1]:
+            corpora.append(entry.path)
+    return sorted(corpora)
+
+def load_state(state_file):
+    """Return the state saved by the last build, or {} if there is none."""
+    try:
+        with open(state_file, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state, state_file):
+    """Write the build state, replacing state_file atomically."""
+    directory = os.path.dirname(os.path.abspath(state_file))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.build-')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        replace_file(temp_path, state_file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+# Artifacts built from another artifact of the same corpus, which must be
+# built first: the length index reads the strings through the .dat index
+DEPENDS = {'lengths': 'dat'}
+
+def _run(job):
+    """Build a list of (corpus_file, artifact) in order.
+
+    Returns the seconds each took, or the exception it raised.
+    """
+    results = []
+    for corpus_file, artifact in job:
+        start = time.perf_counter()
+        try:
+            ARTIFACTS[artifact][1](corpus_file)
+        except Exception as e:
+            results.append(e)
+            continue
+        results.append(time.perf_counter() - start)
+    return results
+
+def _jobs(tasks):
+    """Group tasks into jobs, putting each after the task it depends on."""
+    jobs = {}
+    for task in tasks:
+        corpus_file, artifact = task
+        jobs.setdefault((corpus_file, DEPENDS.get(artifact, artifact)), []).append(task)
+    # The task depended on goes first, whatever order the artifacts were given in
+    return [sorted(job, key=lambda task: task[1] in DEPENDS) for job in jobs.values()]
+
+def plan(directory, state, artifacts=tuple(ARTIFACTS), force=False, known=None):
+    """Return (tasks, new state) for the corpora of directory.
+
+    Each corpus is digested only if its size or mtime changed since the
+    last build, and an artifact is rebuilt only when it is missing or was
+    built from other content or in another format, so editing one corpus rebuilds nothing of
+    the others. tasks is a list of (corpus_file, artifact). known is
+    passed on to find_corpora.
+    """
+    tasks = []
+    new_state = {}
+    for corpus_file in find_corpora(directory, known):
+        name = os.path.basename(corpus_file)
+        known = state.get(name, {})
+        try:
+            _, source = source_state(corpus_file, known.get('source'))
+        except OSError:
+            continue
+        # Each artifact is recorded as [source digest, format]
+        built = {artifact: record for artifact, record in known.get('built', {}).items()
+                 if artifact in ARTIFACTS and record == [source['digest'], ARTIFACTS[artifact][2]]}
+        new_state[name] = {'source': source, 'built': built}
+        for artifact in artifacts:
+            if force or artifact not in built or \
+                    not os.path.exists(corpus_file + ARTIFACTS[artifact][0]):
+                tasks.append((corpus_file, artifact))
+    return tasks, new_state
+
+def build(directory='.', artifacts=tuple(ARTIFACTS), jobs=1, force=False, log=print,
+          known=None):
+    """Bring the artifacts of every corpus in directory up to date.
+
+    Stale artifacts are built in jobs worker processes; one that depends
+    on another is built after it, in the same process. Returns the number
+    of artifacts that failed to build; they are retried on the next build.
+    known is passed on to find_corpora.
+    """
+    state_file = os.path.join(directory, STATE_FILE)
+    old_state = load_state(state_file)
+    tasks, state = plan(directory, old_state, artifacts, force, known)
+    failed = 0
+    if tasks:
+        job_list = _jobs(tasks)
+        tasks = [task for job in job_list for task in job]
+        results = []
+        if jobs > 1 and len(job_list) > 1:
+            with ProcessPoolExecutor(min(jobs, len(job_list))) as pool:
+                futures = [pool.submit(_run, job) for job in job_list]
+                for job, future in zip(job_list, futures):
+                    try:
+                        results.extend(future.result())
+                    except Exception as e:
+                        results.extend([e] * len(job))
+        else:
+            for job in job_list:
+                results.extend(_run(job))
+        for (corpus_file, artifact), result in zip(tasks, results):
+            name = os.path.basename(corpus_file)
+            target = name + ARTIFACTS[artifact][0]
+            if isinstance(result, Exception):
+                failed += 1
+                log(f'FAILED {target}: {result}')
+                continue
+            entry = state[name]
+            entry['built'][artifact] = [entry['source']['digest'], ARTIFACTS[artifact][2]]
+            log(f'built {target} ({result:.2f}s)')
+    if tasks or state != old_state:
+        save_state(state, state_file)
+    return failed
+
+def watch(directory='.', artifacts=tuple(ARTIFACTS), jobs=1, interval=1.0, log=print):
+    """Build, then rebuild whatever changes, checking every interval seconds.
+
+    Checking is a stat of each file and one read of the build state; only
+    files whose size or mtime changed are read again.
+    """
+    known = {}
+    while True:
+        build(directory, artifacts, jobs, log=log, known=known)
+        time.sleep(interval)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the indexes of every fortune file in a directory.')
+    parser.add_argument('directory', nargs='?', default='.',
+                        help='directory holding the corpora (default: .)')
+    parser.add_argument('--artifacts', nargs='+', choices=list(ARTIFACTS), default=list(ARTIFACTS),
+                        help='what to build (default: all)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='worker processes (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='rebuild everything')
+    parser.add_argument('--watch', action='store_true', help='keep rebuilding as files change')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between checks with --watch (default: 1)')
+    parser.add_argument('--list', action='store_true', help='print the corpora found and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        for corpus_file in find_corpora(args.directory):
+            print(os.path.basename(corpus_file))
+        sys.exit(0)
+    if args.watch:
+        try:
+            watch(args.directory, args.artifacts, args.jobs, args.interval)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    sys.exit(1 if build(args.directory, args.artifacts, args.jobs, args.force) else 0)
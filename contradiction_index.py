@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import random
+import re
+import sys
+
+from fortune_entries import read_entries
+
+# Lines joining the proverbs of a record
+VERSUS_LINE = 'vs.'
+ALLY_LINE = '+'
+
+WORD_RE = re.compile(r'\w+')
+
+def normalize(text):
+    """Return the lookup key of a proverb: its lowercase words, space-joined."""
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+def parse_record(lines):
+    """Return the sides of a contradiction record as lists of proverbs.
+
+    Sides are separated by '\\tvs.' lines and the proverbs of one side by
+    '\\t+' lines; a proverb over several lines is joined with spaces.
+    """
+    sides = [[[]]]
+    for line in lines:
+        marker = line.strip()
+        if marker == VERSUS_LINE:
+            sides.append([[]])
+        elif marker == ALLY_LINE:
+            sides[-1].append([])
+        elif marker:
+            sides[-1][-1].append(marker)
+    return [[' '.join(proverb) for proverb in side if proverb]
+            for side in sides if any(side)]
+
+class ContradictionIndex:
+    """Proverbs of a contradiction corpus as a graph.
+
+    Each distinct proverb (by normalize()) is a node. Proverbs on opposite
+    sides of a record contradict each other, and proverbs on the same side
+    agree. The same proverb in several records is one node with the edges
+    of all of them. Lookups by text or normalized text are a dict get.
+    """
+
+    def __init__(self):
+        self.proverbs = []
+        self.ids = {}
+        self.contradicts = []
+        self.agrees = []
+        self.pairs = []
+        self.edges = set()
+
+    def _node(self, proverb):
+        key = normalize(proverb)
+        node = self.ids.get(key)
+        if node is None:
+            node = self.ids[key] = len(self.proverbs)
+            self.proverbs.append(proverb)
+            self.contradicts.append([])
+            self.agrees.append([])
+        return node
+
+    def add_record(self, lines):
+        """Add the proverbs and edges of one record."""
+        sides = [[self._node(proverb) for proverb in side] for side in parse_record(lines)]
+        for i, side in enumerate(sides):
+            for node in side:
+                agrees = self.agrees[node]
+                agrees.extend(other for other in side if other != node and other not in agrees)
+                for other_side in sides[i + 1:]:
+                    for other in other_side:
+                        edge = (min(node, other), max(node, other))
+                        if other != node and edge not in self.edges:
+                            self.edges.add(edge)
+                            self.contradicts[node].append(other)
+                            self.contradicts[other].append(node)
+                            self.pairs.append((node, other))
+
+    @classmethod
+    def build(cls, *corpus_files):
+        """Return the index of the records of corpus_files."""
+        index = cls()
+        for corpus_file in corpus_files:
+            for entry in read_entries(corpus_file):
+                index.add_record(entry.lines)
+        return index
+
+    def node(self, text):
+        """Return the node id of a proverb, or None if it is not in the index."""
+        return self.ids.get(normalize(text))
+
+    def opposing(self, text):
+        """Return the proverbs contradicting text, in the order they were indexed."""
+        node = self.node(text)
+        return [] if node is None else [self.proverbs[n] for n in self.contradicts[node]]
+
+    def allied(self, text):
+        """Return the proverbs agreeing with text, in the order they were indexed."""
+        node = self.node(text)
+        return [] if node is None else [self.proverbs[n] for n in self.agrees[node]]
+
+    def lookup(self, text):
+        """Return {'proverb', 'contradicts', 'agrees'} for text, or None."""
+        node = self.node(text)
+        if node is None:
+            return None
+        return {'proverb': self.proverbs[node],
+                'contradicts': [self.proverbs[n] for n in self.contradicts[node]],
+                'agrees': [self.proverbs[n] for n in self.agrees[node]]}
+
+    def lookup_many(self, texts):
+        """Return lookup(text) for each of texts, in order."""
+        return [self.lookup(text) for text in texts]
+
+    def random_pair(self, rng=random):
+        """Return a random (proverb, contradicting proverb), each pair equally likely."""
+        if not self.pairs:
+            raise ValueError('no contradictions indexed')
+        a, b = self.pairs[rng.randrange(len(self.pairs))]
+        return self.proverbs[a], self.proverbs[b]
+
+    def __len__(self):
+        return len(self.proverbs)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Look up contradicting and agreeing proverbs.')
+    parser.add_argument('proverbs', nargs='*', help='proverbs to look up')
+    parser.add_argument('--file', '-f', dest='files', action='append',
+                        help='contradiction corpus, may be repeated (default: contradiction)')
+    parser.add_argument('--batch', action='store_true',
+                        help='also read proverbs to look up from standard input, one per line')
+    parser.add_argument('--pairs', type=int, metavar='N',
+                        help='print N random contradicting pairs instead')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    parser.add_argument('--seed', type=int, help='seed the random generator')
+    args = parser.parse_args()
+
+    files = args.files or [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'contradiction')]
+    index = ContradictionIndex.build(*files)
+    if args.pairs is not None:
+        rng = random.Random(args.seed)
+        for _ in range(args.pairs):
+            a, b = index.random_pair(rng)
+            print(json.dumps([a, b]) if args.json else f'{a}\n\tvs.\n{b}\n%')
+        sys.exit(0)
+
+    queries = list(args.proverbs)
+    if args.batch:
+        queries.extend(line.rstrip('\n') for line in sys.stdin if line.strip())
+    if not queries:
+        parser.error('give proverbs to look up, --batch or --pairs')
+    missing = False
+    for query, result in zip(queries, index.lookup_many(queries)):
+        missing = missing or result is None
+        if args.json:
+            print(json.dumps({'query': query, 'result': result}))
+        elif result is None:
+            print(f'{query}\n\t(not found)')
+        else:
+            print(result['proverb'])
+            for proverb in result['contradicts']:
+                print(f'\tvs. {proverb}')
+            for proverb in result['agrees']:
+                print(f'\t+ {proverb}')
+    sys.exit(1 if missing else 0)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import codecs
+import mmap
+import os
+import struct
+
+# strfile's header: version, number of strings, longest and shortest
+# string length, flags, and the delimiter padded to four bytes. Like the
+# offsets that follow it, every field is a big-endian unsigned 32-bit int.
+HEADER = struct.Struct('>5I4s')
+OFFSET = struct.Struct('>I')
+VERSION = 2
+
+# str_flags bits
+STR_RANDOM = 0x1
+STR_ORDERED = 0x2
+STR_ROTATED = 0x4
+
+# Revision of how build_dat splits a corpus, kept in the last byte of the
+# delimiter field, which strfile leaves zero and fortune never reads. An
+# index of another revision is rebuilt. 1: '%\r\n' lines split as well.
+DAT_FORMAT = 1
+
+def build_dat(corpus_file, dat_file=None, delim='%'):
+    """Write the strfile index of corpus_file and return its header fields.
+
+    The .dat file has the layout of 'strfile -c delim', so fortune reads
+    it: a header followed by the offset of every string and a final offset
+    marking the end of the last one. Strings are separated by lines
+    holding only the delimiter, and empty strings are skipped just as
+    strfile does. It differs from strfile's in two ways: a delimiter line
+    may also end in '\r\n', as in files with CRLF line endings, which
+    strfile would leave inside the strings; and the last byte of the
+    delimiter field holds DAT_FORMAT. The corpus is read once, and offsets are written as
+    they are found, to a temporary file that then replaces dat_file, so
+    readers never see a half-written index. Returns (count, longest, shortest).
+    """
+    if len(delim.encode('utf-8')) != 1:
+        raise ValueError(f'delimiter must be a single byte, not {delim!r}')
+    if dat_file is None:
+        dat_file = f'{corpus_file}.dat'
+
+    # Only needed to rebuild, which a quick pick seldom does
+    import tempfile
+    from fortune_entries import replace_file
+    directory = os.path.dirname(os.path.abspath(dat_file))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.datfile-')
+    try:
+        with open(fd, 'wb') as outf:
+            header = _write_dat(corpus_file, outf, delim)
+        replace_file(temp_path, dat_file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return header
+
+def _write_dat(corpus_file, outf, delim):
+    """Write the strfile index of corpus_file to the open file outf."""
+    # Files with CRLF line endings have '%\r\n' lines, which read_entries
+    # splits on as well; the ids of every index must agree
+    delim_lines = (delim.encode('utf-8') + b'\n', delim.encode('utf-8') + b'\r\n')
+    count = longest = 0
+    shortest = 0xffffffff
+    with open(corpus_file, 'rb') as inf:
+        outf.seek(HEADER.size)
+        outf.write(OFFSET.pack(0))
+        last_off = pos = 0
+        for line in inf:
+            pos += len(line)
+            if line not in delim_lines:
+                continue
+            length = pos - last_off - len(line)
+            last_off = pos
+            if not length:
+                continue
+            outf.write(OFFSET.pack(pos))
+            count += 1
+            longest = max(longest, length)
+            shortest = min(shortest, length)
+
+        # The last string need not be followed by a delimiter
+        length = pos - last_off
+        if length:
+            outf.write(OFFSET.pack(pos))
+            count += 1
+            longest = max(longest, length)
+            shortest = min(shortest, length)
+
+        outf.seek(0)
+        outf.write(HEADER.pack(VERSION, count, longest, shortest, 0,
+                               delim.encode('utf-8').ljust(3, b'\0') + bytes([DAT_FORMAT])))
+    return count, longest, shortest
+
+def _map(f):
+    """Return a read-only mmap of f, or b'' for an empty file."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class FortuneFile:
+    """Random access to the strings of a corpus through its .dat index.
+
+    Both files are memory-mapped, so fetching string n reads one offset
+    pair and the bytes of that string, however large the corpus is.
+    """
+
+    def __init__(self, corpus_file, dat_file=None):
+        if dat_file is None:
+            dat_file = f'{corpus_file}.dat'
+        self.corpus_file = corpus_file
+        self.dat_file = dat_file
+        with open(corpus_file, 'rb') as f:
+            self.data = _map(f)
+        with open(dat_file, 'rb') as f:
+            self.index = _map(f)
+        if len(self.index) < HEADER.size:
+            raise ValueError(f'{dat_file}: not a strfile index')
+        (self.version, self.count, self.longest, self.shortest, self.flags,
+         stuff) = HEADER.unpack_from(self.index)
+        if self.version != VERSION:
+            raise ValueError(f'{dat_file}: unsupported strfile version {self.version}')
+        if len(self.index) < HEADER.size + (self.count + 1) * OFFSET.size:
+            raise ValueError(f'{dat_file}: offset table is truncated')
+        self.delim_lines = (stuff[:1] + b'\n', stuff[:1] + b'\r\n')
+        self.format = stuff[3]
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, n):
+        """Return the byte offset of string n in the corpus."""
+        return OFFSET.unpack_from(self.index, HEADER.size + n * OFFSET.size)[0]
+
+    def span(self, n):
+        """Return the (start, end) byte offsets of string n without delimiters."""
+        if not 0 <= n < self.count:
+            raise IndexError(f'string {n} out of range')
+        start = self.offset(n)
+        end = self.offset(n + 1)
+        data = self.data
+        # Like strfile, the first offset points at the start of the file,
+        # which may be a delimiter line. Files with CRLF line endings leave
+        # their '%\r\n' lines in the strings, so strip those as well.
+        while True:
+            delim_line = next((d for d in self.delim_lines if data[start:start + len(d)] == d), None)
+            if delim_line is None:
+                break
+            start += len(delim_line)
+        if self.flags & (STR_RANDOM | STR_ORDERED):
+            # Shuffled or sorted offsets; the string ends at the next delimiter
+            end = data.find(b'\n' + self.delim_lines[0], start)
+            return start, len(data) if end == -1 else end + 1
+        for delim_line in self.delim_lines:
+            if end - start >= len(delim_line) and data[end - len(delim_line):end] == delim_line:
+                end -= len(delim_line)
+                break
+        return start, max(start, end)
+
+    def length(self, n):
+        """Return the byte length of string n the way fortune measures it.
+
+        Besides the offset table, only the delimiter line ending the string
+        is read, to tell '%\r\n' from '%\n'.
+        """
+        if self.flags & (STR_RANDOM | STR_ORDERED):
+            start, end = self.span(n)
+            return end - start
+        end = self.offset(n + 1)
+        crlf = self.delim_lines[1]
+        delim_length = len(crlf if self.data[end - len(crlf):end] == crlf else self.delim_lines[0])
+        return end - self.offset(n) - delim_length
+
+    def get_bytes(self, n):
+        """Return the raw bytes of string n."""
+        start, end = self.span(n)
+        return self.data[start:end]
+
+    def get(self, n):
+        """Return string n as text, without its trailing line break."""
+        text = self.get_bytes(n).decode('utf-8').replace('\r\n', '\n').rstrip('\n')
+        if self.flags & STR_ROTATED:
+            text = codecs.decode(text, 'rot13')
+        return text
+
+    def close(self):
+        """Unmap the corpus and the index."""
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def open_fortune_file(corpus_file):
+    """Return a FortuneFile for corpus_file, building its .dat if needed.
+
+    The index is rebuilt when it is missing, older than the corpus, or of
+    another DAT_FORMAT, such as one strfile wrote.
+    """
+    dat_file = f'{corpus_file}.dat'
+    try:
+        stale = os.stat(dat_file).st_mtime < os.stat(corpus_file).st_mtime
+    except FileNotFoundError:
+        stale = True
+    if not stale:
+        f = FortuneFile(corpus_file, dat_file)
+        if f.format == DAT_FORMAT:
+            return f
+        f.close()
+    build_dat(corpus_file, dat_file)
+    return FortuneFile(corpus_file, dat_file)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build a strfile-compatible .dat index for a fortune file.')
+    parser.add_argument('source_file')
+    parser.add_argument('dat_file', nargs='?')
+    parser.add_argument('-c', dest='delim', default='%',
+                        help="delimiter character (default: '%%')")
+    parser.add_argument('-s', dest='silent', action='store_true',
+                        help='do not print a summary')
+    args = parser.parse_args()
+
+    dat_file = args.dat_file or f'{args.source_file}.dat'
+    count, longest, shortest = build_dat(args.source_file, dat_file, args.delim)
+    if not args.silent:
+        print(f'"{dat_file}" created')
+        print(f'There were {count} strings')
+        print(f'Longest string: {longest} bytes')
+        print(f'Shortest string: {shortest if count else 0} bytes')
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import zlib
+from array import array
+from collections import defaultdict, deque
+
+from fortune_entries import map_entries, read_entries, restore_sigpipe
+
+# Corpora checked when no files are given, rejects included
+DEFAULT_CORPORA = ['levonkquotes', 'levonkrejects', 'dadjokes', 'contradiction']
+
+# Signature length; must be a power of two up to 2 ** 16
+NUM_HASHES = 128
+
+# Characters per shingle
+SHINGLE_SIZE = 5
+
+PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+
+def normalize(text):
+    """Return text lowercased, without punctuation and with single spaces."""
+    return ' '.join(PUNCTUATION_RE.sub('', text.lower()).split())
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Return the set of character shingles of normalized text."""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def signature(shingle_set, num_hashes=NUM_HASHES):
+    """Return the MinHash signature of a set of shingles as an array.
+
+    Uses one-permutation hashing: each shingle is hashed once, the hash
+    picks one of num_hashes bins and each bin keeps its smallest value.
+    Empty bins borrow the value of the next non-empty bin to their right,
+    tagged with the distance, so the signature stays a Jaccard estimator
+    while costing one hash per shingle instead of num_hashes.
+    """
+    value_bits = 32 - (num_hashes.bit_length() - 1)
+    value_mask = (1 << value_bits) - 1
+    bins = [None] * num_hashes
+    for shingle in shingle_set:
+        # crc32 is stable across processes, unlike hash(); mix its bits
+        h = zlib.crc32(shingle.encode('utf-8')) * 0x9E3779B1 & 0xffffffff
+        i = h >> value_bits
+        value = h & value_mask
+        if bins[i] is None or value < bins[i]:
+            bins[i] = value
+
+    filled = list(bins)
+    if any(value is not None for value in bins):
+        for i in range(num_hashes):
+            distance = 0
+            while bins[(i + distance) % num_hashes] is None:
+                distance += 1
+            # Borrowed values sit above every real one
+            filled[i] = distance << value_bits | bins[(i + distance) % num_hashes]
+    return array('I', [0 if value is None else value for value in filled])
+
+def similarity(a, b):
+    """Return the estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def choose_bands(threshold, num_hashes=NUM_HASHES):
+    """Return (bands, rows) whose LSH S-curve crosses 1/2 nearest threshold."""
+    pairs = [(num_hashes // rows, rows) for rows in range(1, num_hashes + 1)
+             if num_hashes % rows == 0]
+    return min(pairs, key=lambda pair: abs((1 / pair[0]) ** (1 / pair[1]) - threshold))
+
+def entry_signature(entry):
+    """Return the MinHash signature of an entry's content, or None."""
+    shingle_set = shingles(normalize(entry.content))
+    return signature(shingle_set) if shingle_set else None
+
+class _Clusters:
+    """Union-find over member indexes."""
+
+    def __init__(self):
+        self.parent = []
+
+    def add(self):
+        self.parent.append(len(self.parent))
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        self.parent[self.find(i)] = self.find(j)
+
+def find_duplicates(corpus_files, threshold=0.7, jobs=1):
+    """Return clusters of near-duplicate entries across corpus_files.
+
+    Each cluster is a list of members (corpus_file, entry id, start, end,
+    similarity to the first member), in file and id order. Entries are
+    compared on their content only, so differing attribution does not
+    hide a duplicate. Signatures are computed in batches, in jobs worker
+    processes if jobs > 1, and candidate pairs come from LSH buckets, so
+    the cost is roughly linear in the number of entries. Candidates whose
+    estimated similarity is below threshold are dropped.
+    """
+    bands, rows = choose_bands(threshold)
+    pending = deque()
+
+    def entries():
+        for corpus_file in corpus_files:
+            entry_id = 0
+            for entry in read_entries(corpus_file):
+                if entry.lines:
+                    pending.append((corpus_file, entry_id, entry.start, entry.end))
+                    entry_id += 1
+                    yield entry
+
+    members = []
+    signatures = []
+    buckets = defaultdict(list)
+    for sig in map_entries(entry_signature, entries(), jobs):
+        member = pending.popleft()
+        if sig is None:
+            continue
+        index = len(members)
+        members.append(member)
+        signatures.append(sig)
+        for band in range(bands):
+            buckets[hash((band, sig[band * rows:(band + 1) * rows].tobytes()))].append(index)
+
+    clusters = _Clusters()
+    for _ in members:
+        clusters.add()
+    for bucket in buckets.values():
+        # Compare with one member of each cluster seen in the bucket, so
+        # a bucket of exact copies costs one comparison per member
+        representatives = []
+        for i in bucket:
+            for rep in representatives:
+                if clusters.find(rep) != clusters.find(i) and \
+                        similarity(signatures[rep], signatures[i]) >= threshold:
+                    clusters.union(rep, i)
+            root = clusters.find(i)
+            if all(clusters.find(rep) != root for rep in representatives):
+                representatives.append(i)
+
+    groups = defaultdict(list)
+    for i in range(len(members)):
+        groups[clusters.find(i)].append(i)
+    result = []
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        first = group[0]
+        result.append([members[i] + (similarity(signatures[first], signatures[i]),)
+                       for i in group])
+    result.sort(key=lambda cluster: cluster[0][:2])
+    return result
+
+def read_span(corpus_file, start, end):
+    """Return the text of corpus_file between two byte offsets."""
+    with open(corpus_file, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8').rstrip('\r\n')
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Report near-duplicate fortunes across corpora.')
+    parser.add_argument('files', nargs='*',
+                        help=f"corpus files (default: {' '.join(DEFAULT_CORPORA)})")
+    parser.add_argument('--threshold', '-t', type=float, default=0.7,
+                        help='estimated Jaccard similarity to report (default: 0.7)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of worker processes to hash with (default: 1)')
+    parser.add_argument('--json', action='store_true',
+                        help='print clusters as JSON')
+    args = parser.parse_args()
+    restore_sigpipe()
+
+    if args.files:
+        corpus_files = args.files
+    else:
+        here = os.path.dirname(os.path.abspath(__file__))
+        corpus_files = [os.path.join(here, name) for name in DEFAULT_CORPORA]
+        corpus_files = [path for path in corpus_files if os.path.exists(path)]
+
+    clusters = find_duplicates(corpus_files, args.threshold, args.jobs)
+    if args.json:
+        print(json.dumps([[{'file': corpus_file, 'id': entry_id, 'start': start,
+                            'end': end, 'similarity': round(score, 3)}
+                           for corpus_file, entry_id, start, end, score in cluster]
+                          for cluster in clusters], indent=1))
+    else:
+        for n, cluster in enumerate(clusters, 1):
+            print(f'== Cluster {n} ({len(cluster)} entries)')
+            for corpus_file, entry_id, start, end, score in cluster:
+                text = read_span(corpus_file, start, end)
+                print(f'-- {corpus_file}:{entry_id} (similarity {score:.2f})')
+                print(text)
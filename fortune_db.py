@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+from fortune_entries import (AUTHOR_RE, TAG_LINE_RE, map_entries, read_entries, restore_sigpipe,
+                             source_state)
+
+# Where sync writes when no database is given
+DEFAULT_DATABASE = 'fortunes.db'
+
+# Rows sent to SQLite per executemany call
+BATCH_SIZE = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS corpora (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    entries INTEGER NOT NULL,
+    synced REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS authors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+-- An entry is its text; dup tells apart identical entries of one corpus
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    corpus_id INTEGER NOT NULL REFERENCES corpora (id) ON DELETE CASCADE,
+    hash BLOB NOT NULL,
+    dup INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    content TEXT NOT NULL,
+    author_id INTEGER REFERENCES authors (id),
+    UNIQUE (corpus_id, hash, dup)
+);
+CREATE INDEX IF NOT EXISTS entries_author ON entries (author_id);
+CREATE TABLE IF NOT EXISTS entry_tags (
+    entry_id INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    tag_id INTEGER NOT NULL REFERENCES tags (id),
+    PRIMARY KEY (entry_id, tag_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entry_tags_tag ON entry_tags (tag_id, entry_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (
+    content, content='entries', content_rowid='id'
+);
+-- Entries are never updated, only added and removed
+CREATE TRIGGER IF NOT EXISTS entries_fts_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+'''
+
+# Everything parsed from the corpus being synced, by position in it
+STAGING = '''
+CREATE TEMP TABLE IF NOT EXISTS staged (
+    position INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL,
+    text TEXT NOT NULL,
+    content TEXT NOT NULL,
+    author TEXT NOT NULL
+);
+CREATE TEMP TABLE IF NOT EXISTS staged_tags (
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (position, tag)
+) WITHOUT ROWID;
+CREATE TEMP TABLE IF NOT EXISTS staged_keys (
+    hash BLOB NOT NULL,
+    dup INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (hash, dup)
+) WITHOUT ROWID;
+'''
+
+def connect(database):
+    """Return a connection to database, creating its tables if need be."""
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA foreign_keys = ON')
+    # Readers do not wait for a sync, and a crash loses at most the last one
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def entry_row(entry):
+    """Return (hash, text, content, author, tags) for an entry, or None if it is empty.
+
+    The hash is of the entry's lines, so any edit to its text, author
+    or tags gives it a new one. Tags are lowercase, as in the tag index.
+    Only lines that could be author or tag lines are matched against
+    their patterns.
+    """
+    lines = entry.lines
+    if not lines:
+        return None
+    text = '\n'.join(lines)
+    author = ''
+    tags = []
+    content = []
+    for line in lines:
+        if '#' in line and TAG_LINE_RE.match(line):
+            tags.extend(tag.lower() for tag in line.split() if tag != '#')
+            continue
+        if line[:1] in ' \t':
+            match = AUTHOR_RE.match(line)
+            if match:
+                author = match.group(1)
+                continue
+        line = line.strip()
+        if line:
+            content.append(line)
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    return digest, text, ' '.join(content), author, tags
+
+def _ends_record(corpus_file, size):
+    """Return True if the first size bytes of corpus_file end with a '%' line.
+
+    Text appended after such a line can only add entries, never change
+    the last one.
+    """
+    if size == 0:
+        return True
+    with open(corpus_file, 'rb') as f:
+        f.seek(max(0, size - 64))
+        tail = f.read(size - f.tell())
+    if not tail.endswith(b'\n'):
+        return False
+    before, newline, last = tail[:-1].rpartition(b'\n')
+    return (bool(newline) or size <= 64) and last.rstrip() == b'%'
+
+def _stage(conn, corpus_file, start=0, corpus_id=None, jobs=1):
+    """Load the entries of corpus_file from byte offset start into the staging tables.
+
+    Each entry is keyed by its hash and dup, the number of identical
+    entries before it in the corpus; with a corpus_id, those already
+    stored for the corpus count too. Returns the number of entries.
+    """
+    conn.execute('DELETE FROM staged')
+    conn.execute('DELETE FROM staged_tags')
+    conn.execute('DELETE FROM staged_keys')
+    rows = []
+    tag_rows = []
+    position = 0
+    for row in map_entries(entry_row, read_entries(corpus_file, start), jobs):
+        if row is None:
+            continue
+        digest, text, content, author, tags = row
+        rows.append((position, digest, text, content, author))
+        tag_rows.extend((position, tag) for tag in tags)
+        position += 1
+        if len(rows) == BATCH_SIZE:
+            conn.executemany('INSERT INTO staged VALUES (?, ?, ?, ?, ?)', rows)
+            conn.executemany('INSERT OR IGNORE INTO staged_tags VALUES (?, ?)', tag_rows)
+            rows.clear()
+            tag_rows.clear()
+    conn.executemany('INSERT INTO staged VALUES (?, ?, ?, ?, ?)', rows)
+    conn.executemany('INSERT OR IGNORE INTO staged_tags VALUES (?, ?)', tag_rows)
+    stored = '' if corpus_id is None else \
+        ' + (SELECT count(*) FROM entries e WHERE e.corpus_id = ? AND e.hash = staged.hash)'
+    conn.execute(f'''
+        INSERT INTO staged_keys
+        SELECT hash, row_number() OVER (PARTITION BY hash ORDER BY position) - 1{stored}, position
+        FROM staged''', () if corpus_id is None else (corpus_id,))
+    return position
+
+def sync_corpus(conn, corpus_file, name=None, jobs=1):
+    """Bring the rows of one corpus up to date and return (added, removed).
+
+    Nothing is read but a stat of the file if its size and mtime are
+    those of the last sync. Otherwise the file is parsed into staging
+    tables, and entries are matched to the stored ones by content hash:
+    entries whose hash went away are deleted, new hashes are inserted
+    with their author, tags and full-text row, and the rest are not
+    touched. If entries were only appended after a '%' line, only the
+    appended text is parsed. Entries are parsed in jobs worker
+    processes if jobs > 1. The caller commits.
+    """
+    name = name or os.path.basename(corpus_file)
+    row = conn.execute('SELECT id, size, mtime_ns, digest, entries FROM corpora WHERE name = ?',
+                       (name,)).fetchone()
+    known = None if row is None else {'size': row[1], 'mtime_ns': row[2], 'digest': row[3]}
+    status, state = source_state(corpus_file, known)
+    if status == 'unchanged':
+        if state != known:
+            conn.execute('UPDATE corpora SET mtime_ns = ? WHERE id = ?', (state['mtime_ns'], row[0]))
+        return 0, 0
+
+    appending = status == 'appended' and _ends_record(corpus_file, known['size'])
+    if appending:
+        count = row[4] + _stage(conn, corpus_file, known['size'], row[0], jobs)
+    else:
+        count = _stage(conn, corpus_file, jobs=jobs)
+    values = (name, os.path.abspath(corpus_file), state['size'], state['mtime_ns'],
+              state['digest'], count, time.time())
+    if row is None:
+        corpus_id = conn.execute('''
+            INSERT INTO corpora (name, path, size, mtime_ns, digest, entries, synced)
+            VALUES (?, ?, ?, ?, ?, ?, ?)''', values).lastrowid
+    else:
+        corpus_id = row[0]
+        conn.execute('''
+            UPDATE corpora SET name = ?, path = ?, size = ?, mtime_ns = ?, digest = ?,
+                               entries = ?, synced = ?
+            WHERE id = ?''', values + (corpus_id,))
+
+    removed = 0
+    if not appending:
+        removed = conn.execute('''
+            DELETE FROM entries
+            WHERE corpus_id = ? AND NOT EXISTS (
+                SELECT 1 FROM staged_keys k WHERE k.hash = entries.hash AND k.dup = entries.dup)''',
+            (corpus_id,)).rowcount
+    conn.execute("INSERT OR IGNORE INTO authors (name) SELECT author FROM staged WHERE author <> ''")
+    conn.execute('INSERT OR IGNORE INTO tags (name) SELECT tag FROM staged_tags')
+    (last_id,) = conn.execute('SELECT coalesce(max(id), 0) FROM entries').fetchone()
+    added = conn.execute('''
+        INSERT INTO entries (corpus_id, hash, dup, text, content, author_id)
+        SELECT ?, k.hash, k.dup, s.text, s.content, a.id
+        FROM staged_keys k
+        JOIN staged s ON s.position = k.position
+        LEFT JOIN authors a ON a.name = s.author AND s.author <> ''
+        WHERE true
+        ON CONFLICT (corpus_id, hash, dup) DO NOTHING''', (corpus_id,)).rowcount
+    if added:
+        # Entries that kept their hash kept their tags; only new ones need any
+        conn.execute('''
+            INSERT OR IGNORE INTO entry_tags (entry_id, tag_id)
+            SELECT e.id, t.id
+            FROM entries e
+            JOIN staged_keys k ON k.hash = e.hash AND k.dup = e.dup
+            JOIN staged_tags st ON st.position = k.position
+            JOIN tags t ON t.name = st.tag
+            WHERE e.corpus_id = ? AND e.id > ?''', (corpus_id, last_id))
+    return added, removed
+
+def prune(conn, keep):
+    """Delete the corpora whose names are not in keep; return how many."""
+    names = [name for (name,) in conn.execute('SELECT name FROM corpora') if name not in keep]
+    conn.executemany('DELETE FROM corpora WHERE name = ?', ((name,) for name in names))
+    return len(names)
+
+def _drop_orphans(conn):
+    """Delete the authors and tags no entry has any more."""
+    conn.execute('''
+        DELETE FROM authors WHERE NOT EXISTS (
+            SELECT 1 FROM entries WHERE entries.author_id = authors.id)''')
+    conn.execute('''
+        DELETE FROM tags WHERE NOT EXISTS (
+            SELECT 1 FROM entry_tags WHERE entry_tags.tag_id = tags.id)''')
+
+def sync(database, corpus_files, prune_others=False, jobs=1, log=None):
+    """Sync corpus_files into database in one transaction.
+
+    Returns {corpus name: (added, removed)}. With prune_others, corpora
+    synced earlier but not among corpus_files are deleted.
+    """
+    conn = connect(database)
+    try:
+        conn.executescript(STAGING)
+        results = {}
+        with conn:
+            for corpus_file in corpus_files:
+                name = os.path.basename(corpus_file)
+                results[name] = sync_corpus(conn, corpus_file, name, jobs)
+                if log is not None and any(results[name]):
+                    log(f'{name}: {results[name][0]} added, {results[name][1]} removed')
+            pruned = prune(conn, results) if prune_others else 0
+            if log is not None and pruned:
+                log(f'{pruned} corpora pruned')
+            if pruned or any(removed for _, removed in results.values()):
+                _drop_orphans(conn)
+        return results
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Keep a SQLite copy of the fortune files for SQL queries.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sync_parser = subparsers.add_parser('sync', help='add and remove the entries that changed')
+    sync_parser.add_argument('files', nargs='*',
+                             help='fortune files (default: every corpus in the current directory)')
+    sync_parser.add_argument('--database', '-d', default=DEFAULT_DATABASE,
+                             help=f'database file (default: {DEFAULT_DATABASE})')
+    sync_parser.add_argument('--prune', action='store_true',
+                             help='delete corpora that are not among the files')
+    sync_parser.add_argument('--jobs', '-j', type=int, default=1,
+                             help='worker processes to parse entries with (default: 1)')
+
+    query_parser = subparsers.add_parser('query', help='run SQL and print the rows tab-separated')
+    query_parser.add_argument('sql', help="e.g. 'SELECT name, count(*) FROM tags JOIN entry_tags "
+                                          "ON tag_id = id GROUP BY id ORDER BY 2 DESC LIMIT 10'")
+    query_parser.add_argument('params', nargs='*', help='values for ? placeholders')
+    query_parser.add_argument('--database', '-d', default=DEFAULT_DATABASE,
+                              help=f'database file (default: {DEFAULT_DATABASE})')
+    args = parser.parse_args()
+
+    if args.command == 'sync':
+        files = args.files
+        if not files:
+            from build import find_corpora
+            files = find_corpora('.')
+        start = time.perf_counter()
+        try:
+            results = sync(args.database, files, args.prune, args.jobs, log=print)
+        except OSError as e:
+            parser.error(str(e))
+        added = sum(a for a, _ in results.values())
+        removed = sum(r for _, r in results.values())
+        print(f'Synced {len(results)} corpora into {args.database}: {added} added, '
+              f'{removed} removed ({time.perf_counter() - start:.2f}s)')
+    else:
+        if not os.path.exists(args.database):
+            parser.error(f"{args.database} does not exist; run 'sync' first")
+        conn = sqlite3.connect(args.database)
+        try:
+            cursor = conn.execute(args.sql, args.params)
+        except sqlite3.Error as e:
+            print(f'error: {e}', file=sys.stderr)
+            sys.exit(1)
+        restore_sigpipe()
+        if cursor.description:
+            print('\t'.join(column[0] for column in cursor.description))
+        for row in cursor:
+            print('\t'.join('' if value is None else str(value) for value in row))
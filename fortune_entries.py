@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import stat
+import sys
+
+# hashlib, tempfile and the process pool are imported where they are used:
+# every tool imports this module, most never need them, and the process
+# pool alone takes longer to import than the interpreter takes to start
+
+# Author lines are indented with a tab or spaces and start with a dash.
+# levonkquotes mixes '-', the en dash and the horizontal bar ('―').
+AUTHOR_RE = re.compile(r'^(?:\t| {2,})\s*[-–—―]\s*(\S.*)$')
+
+# Tag lines hold nothing but '#tag' words, either bare or indented
+TAG_LINE_RE = re.compile(r'^\s*#\S*(?:\s+#\S*)*$')
+
+# Bytes read at a time when fingerprinting a file
+CHUNK_SIZE = 1 << 20
+
+# Entries sent to a worker process at a time when tagging in parallel
+BATCH_SIZE = 500
+
+
+# How the taggers tell an author line: it starts with a tab and a dash
+TAGGER_AUTHOR_PREFIX = '\t- '
+
+
+class EntryParts:
+    """The lines of an entry sorted out the way the taggers read them.
+    The author line is the last line starting with TAGGER_AUTHOR_PREFIX,
+    at author_index (None without one), and content_lines are the lines
+    that do not start with it. tag_lines, the lines holding only #tags,
+    and has_content, True if a non-blank line is not indented, are found
+    the first time they are asked for. Nothing is looked for twice.
+    Only the taggers use this; see Entry for the other tools.
+    """
+
+    __slots__ = ('author_index', 'author_line', 'content_lines', '_tag_lines', '_has_content')
+
+    def __init__(self, lines):
+        self.content_lines = [line for line in lines if not line.startswith(TAGGER_AUTHOR_PREFIX)]
+        self.author_index = None
+        self.author_line = ''
+        if len(self.content_lines) != len(lines):
+            for i in range(len(lines) - 1, -1, -1):
+                if lines[i].startswith(TAGGER_AUTHOR_PREFIX):
+                    self.author_index = i
+                    self.author_line = lines[i]
+                    break
+        self._tag_lines = None
+        self._has_content = None
+
+    @property
+    def author(self):
+        """Return the author line without its prefix, or ''."""
+        return self.author_line[len(TAGGER_AUTHOR_PREFIX):]
+
+    @property
+    def tag_lines(self):
+        """Return the lines holding only #tags."""
+        if self._tag_lines is None:
+            self._tag_lines = [line for line in self.content_lines if TAG_LINE_RE.match(line)]
+        return self._tag_lines
+
+    @property
+    def has_content(self):
+        """Return True if a non-blank line is not indented."""
+        if self._has_content is None:
+            self._has_content = any(line.strip() and not line.startswith('\t')
+                                    for line in self.content_lines)
+        return self._has_content
+
+
+class Entry:
+    """One record of a fortune file, the lines between two '%' separators.
+
+    There are two readings of the lines. author_line, author, tag_line,
+    tags, content_lines and content read the corpus as it is written:
+    any author line AUTHOR_RE matches and any tag line TAG_LINE_RE
+    matches. The indexes, the server and the other tools that read
+    corpora use these. parts reads the lines the way the taggers always
+    have, knowing only TAGGER_AUTHOR_PREFIX author lines, and is for the
+    taggers alone, whose output must not change. Each reading sorts the
+    lines once, the first time one of its values is asked for.
+    """
+
+    __slots__ = ('lines', 'start', 'end', 'terminated', '_parts', '_sorted')
+
+    def __init__(self, lines, start, end, terminated=True):
+        self.lines = lines
+        self.start = start
+        self.end = end
+        self.terminated = terminated
+        self._parts = None
+        self._sorted = None
+
+    def __repr__(self):
+        return f'Entry({self.lines!r}, {self.start}, {self.end}, {self.terminated})'
+
+    @property
+    def parts(self):
+        """Return the EntryParts of the lines, found the first time they are asked for."""
+        if self._parts is None:
+            self._parts = EntryParts(self.lines)
+        return self._parts
+
+    def _sort_lines(self):
+        """Return (author lines, tag lines, content lines), sorting them out once."""
+        if self._sorted is None:
+            author_lines, tag_lines, content_lines = [], [], []
+            for line in self.lines:
+                if AUTHOR_RE.match(line):
+                    author_lines.append(line)
+                elif TAG_LINE_RE.match(line):
+                    tag_lines.append(line)
+                else:
+                    content_lines.append(line)
+            self._sorted = author_lines, tag_lines, content_lines
+        return self._sorted
+
+    @property
+    def author_line(self):
+        """Return the last author line, or '' if there is none."""
+        author_lines = self._sort_lines()[0]
+        return author_lines[-1] if author_lines else ''
+
+    @property
+    def author(self):
+        """Return the author text without indent and dash, or ''."""
+        match = AUTHOR_RE.match(self.author_line)
+        return match.group(1) if match else ''
+
+    @property
+    def tag_line(self):
+        """Return the last tag line, or '' if there is none."""
+        tag_lines = self._sort_lines()[1]
+        return tag_lines[-1] if tag_lines else ''
+
+    @property
+    def tags(self):
+        """Return the tags of all tag lines, e.g. ['#quote', '#wisdom']."""
+        return [tag for line in self._sort_lines()[1] for tag in line.split() if tag != '#']
+
+    @property
+    def content_lines(self):
+        """Return the lines that are neither author nor tag lines."""
+        return self._sort_lines()[2]
+
+    @property
+    def content(self):
+        """Return the non-blank content lines joined by spaces."""
+        return ' '.join(line.strip() for line in self.content_lines if line.strip())
+
+
+def source_state(path, known=None):
+    """Compare a file with a state recorded earlier and return (status, state).
+
+    The state holds the size, mtime and content digest of the file. status
+    is 'unchanged' if the content is the same, 'appended' if the file only
+    grew at the end, and 'changed' otherwise (or when known is None).
+    The file is only read when its size or mtime differ.
+    """
+    st = os.stat(path)
+    if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+        return 'unchanged', known
+
+    # Digest the file, noting the digest of the part that was there before
+    prefix_size = known['size'] if known and known['size'] <= st.st_size else -1
+    prefix_digest = None
+    import hashlib
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            if size <= prefix_size < size + len(chunk):
+                digest.update(chunk[:prefix_size - size])
+                prefix_digest = digest.hexdigest()
+                digest.update(chunk[prefix_size - size:])
+            else:
+                digest.update(chunk)
+            size += len(chunk)
+    if size == prefix_size:
+        prefix_digest = digest.hexdigest()
+
+    state = {'size': size, 'mtime_ns': st.st_mtime_ns, 'digest': digest.hexdigest()}
+    if known is None:
+        return 'changed', state
+    if state['digest'] == known['digest']:
+        return 'unchanged', state
+    if prefix_digest == known['digest']:
+        return 'appended', state
+    return 'changed', state
+
+
+def _open_input(source):
+    """Return (binary file, should_close) for a path, '-' or a file object."""
+    if source == '-':
+        return sys.stdin.buffer, False
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return open(source, 'rb'), True
+    return getattr(source, 'buffer', source), False
+
+
+def read_entries(source, start=0):
+    """Yield the entries of a fortune file one at a time.
+
+    source is a path, '-' for stdin, or an open file. Lines are stripped of
+    trailing whitespace, and start/end are the byte offsets of the record in
+    the source. Records are separated by lines consisting of '%'; a record
+    before the first '%' is yielded too (usually empty), and a trailing
+    record that is not followed by '%' is yielded with terminated=False
+    only if it has any lines. A seekable source can be read from byte
+    offset start on, which should be the start of a record.
+    """
+    f, should_close = _open_input(source)
+    try:
+        if start:
+            f.seek(start)
+        lines = []
+        offset = start
+        for raw in f:
+            line = raw.decode('utf-8').rstrip()
+            if line == '%':
+                yield Entry(lines, start, offset)
+                lines = []
+                offset += len(raw)
+                start = offset
+            else:
+                lines.append(line)
+                offset += len(raw)
+        if lines:
+            yield Entry(lines, start, offset, terminated=False)
+    finally:
+        if should_close:
+            f.close()
+
+
+class EntryWriter:
+    """Stream lines to a fortune file, joining them with newlines.
+
+    Like the old '\\n'.join(output) writes, no newline follows the last
+    line. Output to a path goes to a temporary file that replaces the path
+    on close, so a file can be rewritten in place while it is being read.
+    '-' writes to stdout. With flush, each write() is passed on at once
+    rather than when the buffer fills, so the next stage of a pipeline
+    gets whole entries as they are made; by default only stdout that is
+    not a regular file is flushed.
+    """
+
+    def __init__(self, target, flush=None):
+        self.target = target
+        self.temp_path = None
+        self.first = True
+        if flush is None:
+            flush = target == '-' and not is_regular_file(sys.stdout)
+        self.flush = flush
+        if target == '-':
+            self.f = sys.stdout
+        elif isinstance(target, (str, bytes, os.PathLike)):
+            directory = os.path.dirname(os.path.abspath(target))
+            import tempfile
+            fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix='.fortune-')
+            self.f = open(fd, 'w', encoding='utf-8', newline='\n')
+        else:
+            self.f = target
+
+    def write(self, lines):
+        """Write lines, each on its own line."""
+        if not lines:
+            return
+        text = '\n'.join(lines)
+        if self.first:
+            self.first = False
+            self.f.write(text)
+        else:
+            self.f.write('\n' + text)
+        if self.flush:
+            self.f.flush()
+
+    def close(self):
+        """Finish the output, replacing the target path if there is one."""
+        if self.temp_path is None:
+            self.f.flush()
+            return
+        self.f.close()
+        replace_file(self.temp_path, self.target)
+        self.temp_path = None
+
+    def abort(self):
+        """Discard the output, leaving the target untouched."""
+        if self.temp_path is None:
+            return
+        self.f.close()
+        os.unlink(self.temp_path)
+        self.temp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def is_regular_file(f):
+    """Return True if the open file f is a regular file on disk."""
+    try:
+        return stat.S_ISREG(os.fstat(f.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def restore_sigpipe():
+    """End the process quietly when the reader of its stdout goes away.
+
+    Python turns SIGPIPE into a BrokenPipeError and a traceback; a filter
+    writing to a pipeline should stop the way other Unix tools do when,
+    say, 'head' has read all it wants.
+    """
+    import signal
+    if hasattr(signal, 'SIGPIPE'):
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def _umask():
+    """Return the process umask."""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def _fsync_path(path, flags=os.O_RDONLY):
+    """Flush a file or directory to disk."""
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_file(temp_path, target, sync=False):
+    """Move temp_path over target, keeping target's permissions.
+
+    A new target gets the permissions open() would have given it, rather
+    than the owner-only ones of a temporary file. With sync, the new
+    content is on disk before it replaces target, and the rename is on
+    disk before returning, so a crash leaves either the old or the new
+    file whole.
+    """
+    if os.path.exists(target):
+        os.chmod(temp_path, os.stat(target).st_mode & 0o7777)
+    else:
+        os.chmod(temp_path, 0o666 & ~_umask())
+    if sync:
+        _fsync_path(temp_path)
+    os.replace(temp_path, target)
+    if sync and hasattr(os, 'O_DIRECTORY'):
+        _fsync_path(os.path.dirname(os.path.abspath(target)), os.O_RDONLY | os.O_DIRECTORY)
+
+
+def _batches(entries, size):
+    """Yield lists of up to size entries."""
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _transform_batch(transform, batch):
+    """Return transform(entry) for each entry of batch."""
+    return [transform(entry) for entry in batch]
+
+
+def map_entries(transform, entries, jobs=1, batch_size=BATCH_SIZE):
+    """Yield transform(entry) for each entry, in order.
+
+    With jobs > 1 the entries are sent in batches to a pool of jobs worker
+    processes, so transform must be picklable (a module-level function or a
+    functools.partial of one). At most two batches per worker are in
+    flight, which keeps memory bounded however long entries is.
+    """
+    if jobs <= 1:
+        for entry in entries:
+            yield transform(entry)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+        for batch in _batches(entries, batch_size):
+            pending.append(pool.submit(_transform_batch, transform, batch))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def rewrite_file(input_file, output_file, transform, jobs=1, stats=None):
+    """Stream input_file through transform(entry) into output_file.
+
+    transform returns the list of output lines for an entry, including
+    its closing '%' if it should have one. With jobs > 1 entries are
+    transformed in parallel (see map_entries); the output is the same.
+    With a TagStats, the parse, tag and write phases are timed into it;
+    that needs every phase in this process, so jobs is ignored.
+    """
+    entries = read_entries(input_file)
+    if stats is not None:
+        jobs = 1
+        entries = stats.timed_iter('parse', entries)
+        transform = stats.timed('tag', transform)
+    with EntryWriter(output_file) as writer:
+        write = writer.write if stats is None else stats.timed('write', writer.write)
+        for lines in map_entries(transform, entries, jobs):
+            write(lines)
+
+
+def split_entry(entry):
+    """Return the (content, author) a tagger tags an entry by, or None.
+
+    The content is the lines that are not author lines joined by spaces,
+    and an entry without an author line is by 'Unknown' (see EntryParts).
+    """
+    if not entry.lines:
+        return None
+    parts = entry.parts
+    return ' '.join(parts.content_lines), parts.author or 'Unknown'
+
+
+def move_author_last(entry, tags):
+    """Return the output lines of an entry with its author line moved last.
+
+    A tag line of tags and the closing '%' follow. An entry without an
+    author line loses its first blank line instead, as it always has.
+    """
+    lines = entry.lines
+    i = entry.parts.author_index
+    if i is not None:
+        output_entry = lines[:i] + lines[i + 1:] + [lines[i]]
+    elif '' in lines:
+        i = lines.index('')
+        output_entry = lines[:i] + lines[i + 1:]
+    else:
+        output_entry = lines.copy()
+    output_entry.append(f'\t{tags}')
+    output_entry.append('%')
+    return output_entry
+
+
+def add_tagger_arguments(parser):
+    """Add the arguments every tagger takes to an argparse parser."""
+    parser.add_argument('input_file', help="fortune file, or '-' for standard input")
+    parser.add_argument('output_file', help="file to write, or '-' for standard output")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of worker processes to tag with (default: 1)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print rule hit counts and phase timings to stderr; '
+                             'tags in one process')
+    parser.add_argument('--stats-format', choices=['table', 'json'], default='table',
+                        help='format of --stats (default: table)')
+
+
+def message_stream(output_file):
+    """Return the stream a command writing output_file prints its messages to.
+
+    With the fortunes on stdout ('-') that is stderr, and SIGPIPE is
+    restored so a reader that stops early ends the command quietly.
+    """
+    if output_file == '-':
+        restore_sigpipe()
+        return sys.stderr
+    return sys.stdout
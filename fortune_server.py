@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+from array import array
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from fortune_entries import read_entries
+from picker import DEFAULT_CORPORA, SHORT_MAX
+from tag_index import normalize_tag
+
+DEFAULT_HTTP = '127.0.0.1:8017'
+
+# Seconds between checks of the corpus files for changes
+RELOAD_INTERVAL = 1.0
+
+# Longest request head the HTTP server reads
+MAX_HEAD = 16384
+
+# Where the name in an author line ends: 'Albert Einstein, a letter to ...'
+AUTHOR_NAME_END_RE = re.compile(r'[,(\["]')
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           431: 'Request Header Fields Too Large'}
+
+def author_keys(author):
+    """Return the lookup keys of an author: the whole line and the name alone.
+
+    Both are lowercased with the dash and surrounding space removed, so
+    'Albert Einstein, a letter to his son' is found as 'albert einstein'.
+    """
+    author = ' '.join(author.lower().lstrip('-–—― ').split())
+    if not author:
+        return set()
+    name = AUTHOR_NAME_END_RE.split(author, 1)[0].strip(' .')
+    return {author, name} if name else {author}
+
+def wants_json(target):
+    """Return True if a request path asks for JSON with ?format=json."""
+    return parse_qs(urlsplit(target).query).get('format', [None])[-1] == 'json'
+
+class Corpus:
+    """A fortune file held in memory with its lookup tables.
+
+    The file is read once, and every entry with any lines gets an id in
+    file order (the ids of the tag index) and a byte span. Entries are
+    listed by tag, by author and by length, so every lookup is a dict get
+    and a random index. A Corpus never changes after it is built: a reload
+    builds a new one, and requests holding the old one finish with it.
+    """
+
+    def __init__(self, name, path, data, stamp):
+        self.name = name
+        self.path = path
+        self.data = data
+        self.stamp = stamp
+        self.loaded = time.time()
+        self.spans = array('Q')
+        self.tags = {}
+        self.authors = {}
+        self.lengths = {'short': array('I'), 'long': array('I')}
+        count = 0
+        for entry in read_entries(io.BytesIO(data)):
+            if not entry.lines:
+                continue
+            self.spans.extend((entry.start, entry.end))
+            for tag in set(normalize_tag(tag) for tag in entry.tags):
+                self.tags.setdefault(tag, array('I')).append(count)
+            for key in author_keys(entry.author):
+                self.authors.setdefault(key, array('I')).append(count)
+            length = 'short' if entry.end - entry.start <= SHORT_MAX else 'long'
+            self.lengths[length].append(count)
+            count += 1
+        self.count = count
+
+    @classmethod
+    def load(cls, path, name=None):
+        """Return the Corpus of the fortune file at path."""
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        return cls(name or os.path.basename(path), path, data, (st.st_mtime_ns, st.st_size))
+
+    def __len__(self):
+        return self.count
+
+    def text(self, n):
+        """Return the text of entry n without its trailing line break."""
+        text = self.data[self.spans[2 * n]:self.spans[2 * n + 1]].decode('utf-8')
+        return text.replace('\r\n', '\n').rstrip('\n')
+
+    def record(self, n):
+        """Return entry n as the server sends it."""
+        return {'corpus': self.name, 'id': n, 'text': self.text(n)}
+
+class FortuneServer:
+    """Serve fortunes from corpora loaded once, over HTTP and a Unix socket.
+
+    Requests are paths, the same over both transports:
+
+        /random[?corpus=a,b][&length=short|long]
+        /tag/<tag>[?corpus=...]
+        /author/<name>[?corpus=...]
+        /fortune/<corpus>/<id>
+        /corpora
+
+    Random picks are uniform over the matching entries of the chosen
+    corpora (all of them by default). HTTP answers with the fortune as
+    plain text, or JSON with ?format=json or an Accept header asking for
+    it, and keeps connections alive. The Unix socket reads one path per
+    line and answers each with a line of JSON.
+    """
+
+    def __init__(self, paths, reload_interval=RELOAD_INTERVAL, rng=None):
+        self.corpora = {}
+        for path in paths:
+            corpus = Corpus.load(path)
+            if corpus.name in self.corpora:
+                raise ValueError(f'two corpora are named {corpus.name}')
+            self.corpora[corpus.name] = corpus
+        self.reload_interval = reload_interval
+        self.rng = rng or random.Random()
+        self.reloads = 0
+        self.requests = 0
+
+    def _selected(self, query):
+        """Return the corpora named in the corpus parameter, or all of them."""
+        names = query.get('corpus')
+        if not names:
+            return list(self.corpora.values())
+        selected = []
+        for name in ','.join(names).split(','):
+            corpus = self.corpora.get(name)
+            if corpus is None:
+                raise LookupError(f'no corpus named {name!r}')
+            selected.append(corpus)
+        return selected
+
+    def _pick(self, pools):
+        """Return a random entry from [(corpus, ids or None for all)], or None."""
+        total = sum(len(corpus if ids is None else ids) for corpus, ids in pools)
+        if not total:
+            return None
+        r = self.rng.randrange(total)
+        for corpus, ids in pools:
+            size = len(corpus if ids is None else ids)
+            if r < size:
+                return corpus.record(r if ids is None else ids[r])
+            r -= size
+
+    def respond(self, target):
+        """Return (status, body object) for a request path."""
+        self.requests += 1
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        try:
+            route = parts[0]
+            if route == 'random' and len(parts) == 1:
+                length = query.get('length', [None])[0]
+                if length not in (None, 'short', 'long'):
+                    return 400, {'error': f"length must be 'short' or 'long', not {length!r}"}
+                pools = [(corpus, None if length is None else corpus.lengths[length])
+                         for corpus in self._selected(query)]
+            elif route == 'tag' and len(parts) == 2:
+                tag = normalize_tag(parts[1])
+                pools = [(corpus, corpus.tags.get(tag, ())) for corpus in self._selected(query)]
+            elif route == 'author' and len(parts) == 2:
+                key = ' '.join(parts[1].lower().split())
+                pools = [(corpus, corpus.authors.get(key, ())) for corpus in self._selected(query)]
+            elif route == 'fortune' and len(parts) == 3:
+                corpus = self.corpora.get(parts[1])
+                if corpus is None:
+                    return 404, {'error': f'no corpus named {parts[1]!r}'}
+                if not (parts[2].isascii() and parts[2].isdecimal()) or int(parts[2]) >= len(corpus):
+                    return 404, {'error': f'no fortune {parts[2]!r} in {parts[1]}'}
+                return 200, corpus.record(int(parts[2]))
+            elif route == 'corpora' and len(parts) == 1:
+                return 200, {'corpora': [
+                    {'name': c.name, 'path': c.path, 'entries': len(c), 'tags': len(c.tags),
+                     'authors': len(c.authors), 'loaded': c.loaded}
+                    for c in self.corpora.values()],
+                    'reloads': self.reloads, 'requests': self.requests}
+            else:
+                return 404, {'error': f'unknown request {url.path!r}'}
+        except LookupError as e:
+            return 404, {'error': e.args[0]}
+        record = self._pick(pools)
+        if record is None:
+            return 404, {'error': 'no fortunes match'}
+        return 200, record
+
+    async def _handle_http(self, reader, writer):
+        """Answer HTTP/1.x requests on one connection until it closes."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(self._http_response(431, {'error': 'request head too long'},
+                                                     True, False))
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                request = lines[0].split()
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip().lower()
+                keep_alive = (len(request) == 3 and request[2] == 'HTTP/1.1'
+                              and headers.get('connection') != 'close')
+                if len(request) != 3:
+                    status, body = 400, {'error': 'malformed request line'}
+                elif request[0] != 'GET':
+                    status, body = 405, {'error': f'{request[0]} is not supported'}
+                else:
+                    status, body = self.respond(request[1])
+                as_json = (len(request) != 3 or wants_json(request[1])
+                           or 'application/json' in headers.get('accept', ''))
+                writer.write(self._http_response(status, body, as_json, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _http_response(status, body, as_json, keep_alive):
+        """Return the bytes of an HTTP response."""
+        headers = [f'HTTP/1.1 {status} {REASONS[status]}']
+        if as_json:
+            payload = json.dumps(body).encode('utf-8')
+            headers.append('Content-Type: application/json')
+        else:
+            payload = (body.get('text') or body.get('error') or json.dumps(body)).encode('utf-8') + b'\n'
+            headers.append('Content-Type: text/plain; charset=utf-8')
+            if 'id' in body:
+                headers.append(f"X-Fortune-Id: {body['corpus']}/{body['id']}")
+        headers.append(f'Content-Length: {len(payload)}')
+        headers.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + payload
+
+    async def _handle_unix(self, reader, writer):
+        """Answer one request path per line with a line of JSON."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                target = line.decode('utf-8').strip()
+                if not target:
+                    continue
+                status, body = self.respond(target)
+                writer.write(json.dumps(dict(body, status=status)).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _watch(self):
+        """Reload each corpus whose file changed, without pausing the server.
+
+        The new Corpus is built in a thread and swapped in as a whole, so
+        requests see either the old corpus or the new one. A file that
+        cannot be read keeps its old corpus until it can.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            for name, corpus in list(self.corpora.items()):
+                try:
+                    st = os.stat(corpus.path)
+                    if (st.st_mtime_ns, st.st_size) == corpus.stamp:
+                        continue
+                    new = await loop.run_in_executor(None, Corpus.load, corpus.path, name)
+                except (OSError, UnicodeDecodeError) as e:
+                    print(f'Could not reload {name}: {e}', file=sys.stderr)
+                    continue
+                self.corpora[name] = new
+                self.reloads += 1
+                print(f'Reloaded {name}: {len(new)} entries', file=sys.stderr)
+
+    async def serve(self, http=DEFAULT_HTTP, unix_path=None):
+        """Serve on http ('host:port') and unix_path until cancelled."""
+        servers = []
+        if http:
+            host, _, port = http.rpartition(':')
+            servers.append(await asyncio.start_server(
+                self._handle_http, host or None, int(port), limit=MAX_HEAD))
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            servers.append(await asyncio.start_unix_server(self._handle_unix, unix_path))
+        if not servers:
+            raise ValueError('nothing to serve on')
+        watcher = asyncio.create_task(self._watch()) if self.reload_interval else None
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if unix_path and os.path.exists(unix_path):
+                os.unlink(unix_path)
+
+async def _http_request(reader, writer, path):
+    """Send one keep-alive GET and return the status code.
+
+    An answer to a ?format=json request that is not JSON gets status
+    None, so the load test counts it as an error.
+    """
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode('latin-1'))
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    content_type = b''
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'content-type':
+            content_type = value.strip()
+    body = await reader.readexactly(length)
+    if wants_json(path):
+        try:
+            json.loads(body)
+        except ValueError:
+            return None
+        if content_type != b'application/json':
+            return None
+    return int(head.split(None, 2)[1])
+
+async def _unix_request(reader, writer, path):
+    """Send one request line and return the status of its answer."""
+    writer.write(path.encode('utf-8') + b'\n')
+    return json.loads(await reader.readline())['status']
+
+async def load_test(target, paths, requests=10000, concurrency=50):
+    """Send requests spread over concurrency connections and time each one.
+
+    target is 'http://host:port' or the path of a Unix socket; each
+    request is the next of paths in turn. Returns a report with the rate
+    and latency percentiles in milliseconds.
+    """
+    if target.startswith('http://'):
+        host, _, port = target[len('http://'):].rstrip('/').rpartition(':')
+        connect = lambda: asyncio.open_connection(host, int(port))
+        send = _http_request
+    else:
+        connect = lambda: asyncio.open_unix_connection(target)
+        send = _unix_request
+
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+    perf_counter = time.perf_counter
+
+    async def client():
+        nonlocal errors
+        reader, writer = await connect()
+        try:
+            for i in counter:
+                start = perf_counter()
+                status = await send(reader, writer, paths[i % len(paths)])
+                latencies.append(perf_counter() - start)
+                if status != 200:
+                    errors += 1
+        finally:
+            writer.close()
+
+    start = perf_counter()
+    await asyncio.gather(*(client() for _ in range(min(concurrency, requests))))
+    seconds = perf_counter() - start
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+    return {'target': target, 'requests': len(latencies), 'errors': errors,
+            'concurrency': concurrency, 'seconds': round(seconds, 3),
+            'requests_per_s': round(len(latencies) / seconds) if seconds else None,
+            'latency_ms': {'p50': percentile(0.5), 'p90': percentile(0.9),
+                           'p99': percentile(0.99), 'max': percentile(1.0)}}
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve fortunes over HTTP and a Unix socket.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='run the server')
+    serve_parser.add_argument('files', nargs='*',
+                              help='fortune files (default: levonkquotes dadjokes contradiction)')
+    serve_parser.add_argument('--http', default=DEFAULT_HTTP, metavar='HOST:PORT',
+                              help=f"HTTP address, or '' for none (default: {DEFAULT_HTTP})")
+    serve_parser.add_argument('--unix', metavar='PATH', help='also listen on this Unix socket')
+    serve_parser.add_argument('--reload-interval', type=float, default=RELOAD_INTERVAL,
+                              metavar='SECONDS',
+                              help=f'how often to check files for changes, 0 for never '
+                                   f'(default: {RELOAD_INTERVAL})')
+    serve_parser.add_argument('--seed', type=int, help='seed the random generator')
+
+    load_parser = subparsers.add_parser('loadtest', help='measure a running server')
+    load_parser.add_argument('target', help="'http://host:port' or a Unix socket path")
+    load_parser.add_argument('--requests', '-n', type=int, default=10000,
+                             help='number of requests (default: 10000)')
+    load_parser.add_argument('--concurrency', '-c', type=int, default=50,
+                             help='number of connections (default: 50)')
+    load_parser.add_argument('--path', dest='paths', action='append', metavar='PATH',
+                             help='request path to send, repeatable (default: a mix of '
+                                  'random, tag, author, id and JSON requests)')
+    load_parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'loadtest':
+        paths = args.paths or ['/random', '/random?length=short', '/tag/quote',
+                               '/author/albert%20einstein', '/fortune/levonkquotes/0',
+                               '/random?format=json']
+        report = asyncio.run(load_test(args.target, paths, args.requests, args.concurrency))
+        if args.json:
+            print(json.dumps(report, indent=1))
+        else:
+            latency = report['latency_ms']
+            print(f"{report['requests']} requests, {report['errors']} errors in "
+                  f"{report['seconds']}s: {report['requests_per_s']} requests/s")
+            print(f"latency ms: p50 {latency['p50']}  p90 {latency['p90']}  "
+                  f"p99 {latency['p99']}  max {latency['max']}")
+        sys.exit(1 if report['errors'] else 0)
+
+    files = args.files
+    if not files:
+        here = os.path.dirname(os.path.abspath(__file__))
+        files = [os.path.join(here, name) for name in DEFAULT_CORPORA]
+    server = FortuneServer(files, args.reload_interval, random.Random(args.seed))
+    listening = ([f'http://{args.http}'] if args.http else []) + ([args.unix] if args.unix else [])
+    loaded = ', '.join(f'{corpus.name} ({len(corpus)})' for corpus in server.corpora.values())
+    print(f"Serving {loaded} on {' and '.join(listening)}", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.http, args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""One entry point for the fortune tools: fortune-tools COMMAND [ARGS...].
+
+Each command runs the command line of its own module, which is imported
+only then, so 'pick' pays for the picker and nothing else.
+"""
+
+import sys
+
+# Command: (module, summary); 'tag' takes the tagger module as its first argument
+COMMANDS = {
+    'tag': (None, 'add tags to a fortune file with one of the taggers'),
+    'lint': ('lint', 'check fortune files for damaged entries'),
+    'index': ('build', 'build the .dat, tag, search and length indexes of changed corpora'),
+    'query': ('tag_index', 'find fortunes by a boolean tag query'),
+    'search': ('search_index', 'search fortunes by their words'),
+    'suggest': ('suggest_tags', 'suggest tags from those of similar tagged fortunes'),
+    'pick': ('picker', 'print a random fortune'),
+    'dedup': ('dedup', 'find near-duplicate fortunes across files'),
+    'relocate-tags': ('relocate_tags', 'move inline #tags onto tag lines'),
+    'contradictions': ('contradiction_index', 'look up contradicting proverbs'),
+    'strfile': ('datfile', 'build a strfile-compatible .dat index'),
+    'pack': ('packfile', 'block-compressed fortune files'),
+    'serve': ('fortune_server', 'serve fortunes over HTTP and a Unix socket'),
+    'db': ('fortune_db', 'sync fortune files into SQLite and query them'),
+}
+
+TAGGERS = ('fix_quotes', 'improved_tags', 'add_tags', 'safe_add_tags', 'simple_tag_adder',
+           'strict_tag_adder', 'add_tags_safely', 'add_tags_to_complete_entries')
+
+def usage():
+    """Return the help text."""
+    lines = ['usage: fortune-tools COMMAND [ARGS...]', '', 'commands:']
+    lines.extend(f'  {name:16} {summary}' for name, (_, summary) in COMMANDS.items())
+    lines.append('')
+    lines.append(f"taggers for 'tag': {', '.join(TAGGERS)}")
+    lines.append("Run 'fortune-tools COMMAND --help' for the arguments of a command.")
+    return '\n'.join(lines)
+
+def tag_usage():
+    """Return the help text of 'tag'."""
+    lines = ['usage: fortune-tools tag TAGGER [ARGS...]', '', 'taggers:']
+    lines.extend(f'  {name}' for name in TAGGERS)
+    lines.append('')
+    lines.append("Run 'fortune-tools tag TAGGER --help' for the arguments of a tagger.")
+    return '\n'.join(lines)
+
+def main(argv):
+    """Run the command in argv as its module's command line would."""
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    command, args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"fortune-tools: unknown command {command!r}\n\n{usage()}", file=sys.stderr)
+        return 2
+    module = COMMANDS[command][0]
+    if module is None:
+        # As at the top level, no tagger or -h prints the list
+        if not args or args[0] in ('-h', '--help'):
+            print(tag_usage())
+            return 0
+        tagger = args[0].replace('-', '_')
+        if tagger not in TAGGERS:
+            print(f"fortune-tools: unknown tagger {args[0]!r}\n\n{tag_usage()}", file=sys.stderr)
+            return 2
+        module, args = tagger, args[1:]
+
+    run_as_main(module, [f'fortune-tools {command}'] + args)
+    return 0
+
+def run_as_main(module, argv):
+    """Run a module of this directory as the __main__ script with argv.
+
+    This is what runpy does, minus the imports that would take a fifth of
+    the start-up time of a quick command. The module really is __main__,
+    so worker processes find the functions it hands them, and its code
+    comes from the usual __pycache__.
+    """
+    import os
+    from importlib.machinery import SourceFileLoader
+    from types import ModuleType
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f'{module}.py')
+    code = SourceFileLoader('__main__', path).get_code('__main__')
+    main_module = ModuleType('__main__')
+    main_module.__file__ = path
+    main_module.__builtins__ = __builtins__
+    sys.modules['__main__'] = main_module
+    sys.argv = argv
+    exec(code, main_module.__dict__)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
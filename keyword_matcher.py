@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import re
+
+def _is_word_char(ch):
+    """Return True if ch counts as a word character for \\b."""
+    return ch.isalnum() or ch == '_'
+
+def _trie_pattern(keywords):
+    """Return a regex matching any of keywords, shaped like a trie.
+
+    Shared prefixes are only tried once, and optional suffixes are greedy,
+    so the longest keyword at a position is matched first.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        alternatives = [re.escape(ch) + build(child)
+                        for ch, child in sorted(node.items()) if ch]
+        if not alternatives:
+            return ''
+        if len(alternatives) == 1:
+            body = alternatives[0]
+        else:
+            body = '(?:' + '|'.join(alternatives) + ')'
+        if '' in node:
+            return '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+class KeywordMatcher:
+    """Find which groups of keywords occur in a text in a single pass.
+
+    groups maps a name to a list of keywords. All keywords are compiled
+    into one regex that is tried once per position of the text, instead of
+    scanning the text once per keyword. By default keywords match anywhere
+    like the 'keyword in text' checks they replace; with whole_words=True
+    they only match whole words, so 'art' no longer matches 'start'.
+    Keywords and text are compared as given, so lowercase both.
+    """
+
+    def __init__(self, groups, whole_words=False):
+        self.whole_words = whole_words
+        keyword_groups = {}
+        for name, keywords in groups.items():
+            for keyword in keywords:
+                keyword_groups.setdefault(keyword, set()).add(name)
+
+        # The regex reports the longest keyword at each position; every
+        # shorter keyword matching there is one of its prefixes
+        self.groups = {}
+        for keyword in keyword_groups:
+            names = set()
+            for prefix, prefix_names in keyword_groups.items():
+                if keyword.startswith(prefix) and (
+                        not whole_words or len(prefix) == len(keyword)
+                        or _is_word_char(keyword[len(prefix) - 1])
+                        != _is_word_char(keyword[len(prefix)])):
+                    names |= prefix_names
+            self.groups[keyword] = frozenset(names)
+
+        pattern = _trie_pattern(keyword_groups)
+        if whole_words:
+            pattern = r'\b' + pattern + r'\b'
+        # No lookahead around the pattern, so the regex engine can skip
+        # ahead to the next possible first character by itself
+        self.regex = re.compile(pattern) if keyword_groups else None
+        self.group_count = len(groups)
+
+    def find(self, text):
+        """Return the set of group names with a keyword in text."""
+        found = set()
+        if self.regex is None:
+            return found
+        groups = self.groups
+        search = self.regex.search
+        match = search(text)
+        while match is not None:
+            found |= groups[match.group()]
+            if len(found) == self.group_count:
+                break
+            # Keywords may overlap, so look again from the next character
+            match = search(text, match.start() + 1)
+        return found
+
+    def search(self, text):
+        """Return True if any keyword occurs in text."""
+        return self.regex is not None and self.regex.search(text) is not None
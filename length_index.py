@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+from datfile import open_fortune_file
+from fortune_entries import replace_file, source_state
+
+MAGIC = b'FORTUNE-LENGTHS 1\n'
+LENGTH = struct.Struct('>I')
+
+# How an entry is measured; 'bytes' is the length fortune -n compares
+METRICS = ('bytes', 'chars', 'words', 'lines')
+
+def measure(text, size):
+    """Return the METRICS of a fortune's text, given its size in bytes."""
+    return size, len(text), len(text.split()), (text.count('\n') + 1 if text else 0)
+
+class LengthIndex:
+    """Lengths of the strings of a corpus, sorted for range queries.
+
+    Entry ids are those of the corpus's .dat index, which the picker
+    draws by. For each metric the index holds every entry's value, the
+    entry ids sorted by value, and the sorted values; the entries in a
+    range of values are then a slice of the sorted ids, found by two
+    binary searches.
+    """
+
+    def __init__(self):
+        self.values = {metric: array('I') for metric in METRICS}
+        self.order = {metric: array('I') for metric in METRICS}
+        self.sorted_values = {metric: array('I') for metric in METRICS}
+        self.state = None
+
+    @property
+    def count(self):
+        return len(self.values['bytes'])
+
+    @classmethod
+    def build(cls, corpus_file):
+        """Return a new index of the strings of corpus_file."""
+        index = cls()
+        index.state = source_state(corpus_file)[1]
+        with open_fortune_file(corpus_file) as f:
+            for n in range(len(f)):
+                for metric, value in zip(METRICS, measure(f.get(n), f.length(n))):
+                    index.values[metric].append(value)
+        for metric in METRICS:
+            values = index.values[metric]
+            index.order[metric] = array('I', sorted(range(len(values)), key=values.__getitem__))
+            index.sorted_values[metric] = array('I', (values[n] for n in index.order[metric]))
+        return index
+
+    def save(self, index_file):
+        """Write the index to index_file, replacing it atomically."""
+        meta = json.dumps({'state': self.state, 'count': self.count, 'byteorder': sys.byteorder,
+                           'metrics': METRICS}).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(index_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.lengthindex-')
+        try:
+            with open(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(LENGTH.pack(len(meta)))
+                f.write(meta)
+                for metric in METRICS:
+                    for values in (self.values, self.order, self.sorted_values):
+                        f.write(values[metric].tobytes())
+            replace_file(temp_path, index_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, index_file):
+        """Return the index stored in index_file."""
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f'{index_file}: not a length index')
+        pos = len(MAGIC)
+        (meta_length,) = LENGTH.unpack_from(data, pos)
+        pos += LENGTH.size
+        meta = json.loads(data[pos:pos + meta_length])
+        pos += meta_length
+        if tuple(meta['metrics']) != METRICS:
+            raise ValueError(f'{index_file}: other metrics than {METRICS}')
+
+        index = cls()
+        index.state = meta['state']
+        size = 4 * meta['count']
+        for metric in METRICS:
+            for values in (index.values, index.order, index.sorted_values):
+                values[metric].frombytes(data[pos:pos + size])
+                if meta['byteorder'] != sys.byteorder:
+                    values[metric].byteswap()
+                pos += size
+        return index
+
+    def length(self, n, metric='bytes'):
+        """Return the length of entry n by metric."""
+        return self.values[metric][n]
+
+    def select(self, metric, low=None, high=None):
+        """Return the ids of the entries with low <= length <= high, by length.
+
+        Either bound may be None for no bound. The result is a view into
+        the index, found in O(log n) and taking no copy.
+        """
+        if metric not in self.values:
+            raise ValueError(f'unknown metric {metric!r}; use one of {", ".join(METRICS)}')
+        lengths = self.sorted_values[metric]
+        start = 0 if low is None else bisect_left(lengths, low)
+        end = len(lengths) if high is None else bisect_right(lengths, high)
+        return memoryview(self.order[metric])[start:max(start, end)]
+
+def open_length_index(corpus_file, index_file=None, count=None):
+    """Return the length index of corpus_file, rebuilding its saved copy if stale.
+
+    count is the number of strings of the corpus's .dat index, if known;
+    a saved copy holding another number was built from another .dat.
+    """
+    if index_file is None:
+        index_file = f'{corpus_file}.lengths'
+    try:
+        index = LengthIndex.load(index_file)
+        status, state = source_state(corpus_file, index.state)
+    except (OSError, ValueError, KeyError):
+        index, status, state = None, 'changed', None
+    if status != 'unchanged' or count is not None and count != index.count:
+        index = LengthIndex.build(corpus_file)
+        index.save(index_file)
+    elif state != index.state:
+        index.state = state
+        index.save(index_file)
+    return index
+
+def parse_range(text):
+    """Parse 'N', 'N-M', 'N-' or '-M' into (low, high), None for no bound."""
+    low, dash, high = text.partition('-')
+    try:
+        low = int(low) if low else None
+        high = int(high) if high else None
+    except ValueError:
+        raise ValueError(f'bad range {text!r}; use N, N-M, N- or -M') from None
+    if not dash:
+        high = low
+    if low is not None and high is not None and low > high:
+        raise ValueError(f'empty range {text!r}')
+    return low, high
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Count or list the fortunes of a file in a length range.')
+    parser.add_argument('corpus_file')
+    parser.add_argument('metric', choices=METRICS)
+    parser.add_argument('range', help='N, N-M, N- or -M')
+    parser.add_argument('--ids', action='store_true',
+                        help='print the matching entry ids, shortest first')
+    parser.add_argument('--index', metavar='FILE',
+                        help='index file (default: corpus_file.lengths)')
+    args = parser.parse_args()
+
+    try:
+        low, high = parse_range(args.range)
+    except ValueError as e:
+        parser.error(str(e))
+    ids = open_length_index(args.corpus_file, args.index).select(args.metric, low, high)
+    if args.ids:
+        print('\n'.join(map(str, ids)))
+    else:
+        print(len(ids))
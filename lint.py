@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from fortune_entries import AUTHOR_RE, TAG_LINE_RE, read_entries
+
+# Rule: (severity, description)
+RULES = {
+    'conflict-marker': ('error', 'leftover merge conflict marker'),
+    'empty-entry': ('error', "record with no lines, as from '%%' or '%' twice"),
+    'truncated-entry': ('error', 'entry ends mid-sentence with no author'),
+    'missing-author': ('warning', 'entry has no author line'),
+    'author-indent': ('warning', "author line indented unlike the file's usual style"),
+    'duplicate-tag-line': ('warning', 'entry has more than one tag line'),
+    'untagged': ('warning', 'entry has no tags'),
+    'over-length': ('warning', 'entry is longer than the length limit'),
+}
+
+# Longest entry in bytes before over-length is reported
+MAX_LENGTH = 1024
+
+CONFLICT_RE = re.compile(r'^(?:<{7}|>{7}|\|{7})(?: |$)|^={7}$')
+
+# Endings that mean the rest of the entry went missing
+DANGLING_ENDINGS = (',', ';', ':', '-', '–', '—')
+
+def lint_file(path, max_length=MAX_LENGTH, ignore=()):
+    """Return the problems of one corpus file as (line, rule, message) tuples.
+
+    The file is read once, an entry at a time; line numbers are counted
+    as entries go by. Author indentation is checked against the style
+    most author lines of the file use, which needs only the line numbers
+    of each style until the end. Problems are in line order.
+    """
+    problems = []
+    styles = defaultdict(list)
+    line_number = 1
+
+    def report(line, rule, message):
+        if rule not in ignore:
+            problems.append((line, rule, message))
+
+    for entry in read_entries(path):
+        lines = entry.lines
+        first = line_number
+        line_number += len(lines) + entry.terminated
+        if not lines:
+            # A file may start with '%'; any other empty record is damage
+            if entry.start:
+                report(first, 'empty-entry', 'empty record')
+            continue
+
+        author = None
+        tag_lines = 0
+        last_content = ''
+        damaged = False
+        for offset, line in enumerate(lines):
+            if CONFLICT_RE.match(line):
+                report(first + offset, 'conflict-marker', line)
+                damaged = True
+                continue
+            if line.startswith('%%') and not line.strip('%'):
+                # Read as text, but meant as separators around nothing
+                report(first + offset, 'empty-entry', f'{line!r} line')
+                damaged = True
+                continue
+            match = AUTHOR_RE.match(line)
+            if match:
+                author = match
+                styles[line[:match.start(1)]].append(first + offset)
+            elif TAG_LINE_RE.match(line):
+                tag_lines += 1
+            elif line.strip():
+                last_content = line.strip()
+
+        # The author and tags of a damaged record are part of the same defect
+        if not damaged:
+            if author is None:
+                if last_content.endswith(DANGLING_ENDINGS):
+                    report(first, 'truncated-entry', f'ends with {last_content[-40:]!r}')
+                else:
+                    report(first, 'missing-author', 'no author line')
+            if tag_lines > 1:
+                report(first, 'duplicate-tag-line', f'{tag_lines} tag lines')
+            elif not tag_lines:
+                report(first, 'untagged', 'no tag line')
+        length = entry.end - entry.start
+        if length > max_length:
+            report(first, 'over-length', f'{length} bytes > {max_length}')
+
+    if len(styles) > 1:
+        usual = max(styles, key=lambda style: len(styles[style]))
+        for style, numbers in styles.items():
+            if style != usual:
+                for number in numbers:
+                    report(number, 'author-indent', f'author line starts {style!r}, not {usual!r}')
+        problems.sort(key=lambda problem: problem[0])
+    return problems
+
+def _lint(args):
+    path, max_length, ignore = args
+    return lint_file(path, max_length, ignore)
+
+def lint_files(paths, max_length=MAX_LENGTH, ignore=(), jobs=1):
+    """Yield (path, problems) for each file, in order, linting jobs files at a time."""
+    tasks = [(path, max_length, frozenset(ignore)) for path in paths]
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield task[0], _lint(task)
+        return
+    with ProcessPoolExecutor(min(jobs, len(tasks))) as pool:
+        yield from zip(paths, pool.map(_lint, tasks))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Check fortune files for conflict markers, damaged entries and style slips.',
+        epilog='rules: ' + ', '.join(f'{rule} ({severity})' for rule, (severity, _) in RULES.items()))
+    parser.add_argument('files', nargs='*',
+                        help='fortune files (default: every corpus in the current directory)')
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+                        help='json prints one object per problem and line')
+    parser.add_argument('--ignore', action='append', default=[], choices=list(RULES),
+                        metavar='RULE', help='a rule not to check; may be repeated')
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH,
+                        help=f'longest entry in bytes (default: {MAX_LENGTH})')
+    parser.add_argument('--strict', action='store_true',
+                        help='fail on warnings as well as errors')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='files to lint at once (default: CPU count)')
+    args = parser.parse_args()
+
+    files = args.files
+    if not files:
+        from build import find_corpora
+        files = find_corpora('.')
+
+    failing = {'error', 'warning'} if args.strict else {'error'}
+    failed = False
+    out = sys.stdout
+    for path, problems in lint_files(files, args.max_length, args.ignore, args.jobs):
+        for line, rule, message in problems:
+            severity = RULES[rule][0]
+            failed = failed or severity in failing
+            if args.format == 'json':
+                out.write(json.dumps({'file': path, 'line': line, 'severity': severity,
+                                      'rule': rule, 'message': message}) + '\n')
+            else:
+                out.write(f'{path}:{line}: {severity}: {message} [{rule}]\n')
+    sys.exit(1 if failed else 0)
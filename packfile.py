@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+import json
+import lzma
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+
+from datfile import open_fortune_file
+from fortune_entries import read_entries, replace_file
+
+MAGIC = b'FORTUNE-PACK 1\n'
+
+# Written last: the offset of the index and the length of its metadata
+TRAILER = struct.Struct('>QI')
+
+# Bytes of text per block before it is compressed. With the dictionary,
+# 4 KiB blocks pack within a few percent of 16 KiB ones and decompress
+# in half the time.
+BLOCK_SIZE = 4096
+
+METHODS = ('zlib', 'lzma')
+
+DEFAULT_LEVELS = {'zlib': 9, 'lzma': 6}
+
+# zlib blocks share a preset dictionary of this many bytes sampled from
+# the corpus, which lets small blocks compress nearly as well as large
+# ones. Corpora too small to pay for storing it go without.
+DICTIONARY_SIZE = 32768
+DICTIONARY_SAMPLES = 32
+DICTIONARY_MIN_SIZE = 8 * DICTIONARY_SIZE
+
+def _lzma_filters(level):
+    return [{'id': lzma.FILTER_LZMA2, 'preset': level}]
+
+def _compressor(method, level, zdict=b''):
+    """Return a function compressing one block."""
+    if method == 'zlib':
+        if not zdict:
+            return lambda data: zlib.compress(data, level)
+
+        def compress(data):
+            compressor = zlib.compressobj(level, zdict=zdict)
+            return compressor.compress(data) + compressor.flush()
+        return compress
+    if method == 'lzma':
+        # Raw LZMA2 leaves out the .xz container, which would cost more
+        # than a small block saves
+        filters = _lzma_filters(level)
+        return lambda data: lzma.compress(data, lzma.FORMAT_RAW, filters=filters)
+    raise ValueError(f'method must be one of {METHODS}, not {method!r}')
+
+def _decompressor(method, level, zdict=b''):
+    """Return a function decompressing one block."""
+    if method == 'zlib':
+        if not zdict:
+            return zlib.decompress
+        return lambda data: zlib.decompressobj(zdict=zdict).decompress(data)
+    filters = _lzma_filters(level)
+    return lambda data: lzma.decompress(data, lzma.FORMAT_RAW, filters=filters)
+
+def _sample_dictionary(f, size):
+    """Return DICTIONARY_SIZE bytes sampled evenly from the size bytes of f."""
+    chunk = DICTIONARY_SIZE // DICTIONARY_SAMPLES
+    samples = []
+    for i in range(DICTIONARY_SAMPLES):
+        f.seek((size - chunk) * i // (DICTIONARY_SAMPLES - 1))
+        samples.append(f.read(chunk))
+    f.seek(0)
+    return b''.join(samples)
+
+def pack(corpus_file, pack_file=None, method='zlib', level=None, block_size=BLOCK_SIZE,
+         dictionary=True):
+    """Write corpus_file as a block-compressed pack and return its metadata.
+
+    The text is cut into blocks of about block_size bytes at entry
+    boundaries and each block is compressed on its own, so an entry is
+    read back by decompressing its block alone. The blocks hold the text
+    byte for byte, '%' lines included, so unpack restores the file
+    exactly. Entries get the ids of the tag index: every entry with any
+    lines, in file order. The corpus is read once, one block at a time,
+    after sampling the zlib dictionary (unless dictionary is False).
+    """
+    if pack_file is None:
+        pack_file = f'{corpus_file}.pack'
+    if level is None:
+        level = DEFAULT_LEVELS.get(method)
+    _compressor(method, level)  # fails on an unknown method before any file is made
+    block_offsets = array('Q')
+    block_starts = array('Q')
+    first_ids = array('I')
+    spans = array('I')
+    count = 0
+    directory = os.path.dirname(os.path.abspath(pack_file))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.pack-')
+    try:
+        with open(corpus_file, 'rb') as source, open(fd, 'wb') as out:
+            zdict = b''
+            size = os.fstat(source.fileno()).st_size
+            if method == 'zlib' and dictionary and size >= DICTIONARY_MIN_SIZE:
+                zdict = _sample_dictionary(source, size)
+            compress = _compressor(method, level, zdict)
+            out.write(MAGIC)
+
+            def flush(end):
+                data = source.read(end - block_starts[-1])
+                block_offsets.append(out.tell())
+                out.write(compress(data))
+
+            block_starts.append(0)
+            first_ids.append(0)
+            for entry in read_entries(corpus_file):
+                if entry.start - block_starts[-1] >= block_size:
+                    flush(entry.start)
+                    block_starts.append(entry.start)
+                    first_ids.append(count)
+                if entry.lines:
+                    base = block_starts[-1]
+                    spans.extend((entry.start - base, entry.end - base))
+                    count += 1
+            end = source.seek(0, os.SEEK_END)
+            source.seek(block_starts[-1])
+            flush(end)
+            block_offsets.append(out.tell())
+            block_starts.append(end)
+
+            meta = {'method': method, 'level': level, 'block_size': block_size,
+                    'count': count, 'blocks': len(first_ids), 'size': end,
+                    'dictionary': len(zdict), 'byteorder': sys.byteorder}
+            index_offset = out.tell()
+            meta_data = json.dumps(meta).encode('utf-8')
+            out.write(meta_data)
+            for table in (block_offsets, block_starts, first_ids, spans):
+                out.write(table.tobytes())
+            out.write(zdict)
+            out.write(TRAILER.pack(index_offset, len(meta_data)))
+        replace_file(temp_path, pack_file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    meta['packed_size'] = os.path.getsize(pack_file)
+    return meta
+
+class PackedFortuneFile:
+    """Random access to the entries of a pack written by pack().
+
+    The pack is memory-mapped and its index read once; fetching entry n
+    finds its block with a binary search and decompresses that block
+    only. The last block used is kept, so reading entries in order
+    decompresses each block once.
+    """
+
+    def __init__(self, pack_file):
+        self.pack_file = pack_file
+        with open(pack_file, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self.data
+        if data[:len(MAGIC)] != MAGIC or len(data) < len(MAGIC) + TRAILER.size:
+            raise ValueError(f'{pack_file}: not a fortune pack')
+        index_offset, meta_end = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+        index = data[index_offset:len(data) - TRAILER.size]
+        self.meta = json.loads(index[:meta_end])
+        blocks = self.meta['blocks']
+        self.count = self.meta['count']
+        self.block_offsets = array('Q')
+        self.block_starts = array('Q')
+        self.first_ids = array('I')
+        self.spans = array('I')
+        pos = meta_end
+        for table, length in ((self.block_offsets, blocks + 1), (self.block_starts, blocks + 1),
+                              (self.first_ids, blocks), (self.spans, 2 * self.count)):
+            size = length * table.itemsize
+            table.frombytes(index[pos:pos + size])
+            if self.meta['byteorder'] != sys.byteorder:
+                table.byteswap()
+            pos += size
+        zdict = index[pos:pos + self.meta['dictionary']]
+        self.decompress = _decompressor(self.meta['method'], self.meta['level'], zdict)
+        self.cached_block = None
+        self.cached_data = b''
+
+    def __len__(self):
+        return self.count
+
+    def block(self, b):
+        """Return the decompressed text of block b."""
+        if b != self.cached_block:
+            self.cached_data = self.decompress(
+                self.data[self.block_offsets[b]:self.block_offsets[b + 1]])
+            self.cached_block = b
+        return self.cached_data
+
+    def get_bytes(self, n):
+        """Return the raw bytes of entry n, without its '%' line."""
+        if not 0 <= n < self.count:
+            raise IndexError(f'entry {n} out of range')
+        b = bisect_right(self.first_ids, n) - 1
+        return self.block(b)[self.spans[2 * n]:self.spans[2 * n + 1]]
+
+    def get(self, n):
+        """Return entry n as text, without its trailing line break."""
+        return self.get_bytes(n).decode('utf-8').rstrip('\r\n')
+
+    def blocks(self):
+        """Yield the decompressed blocks in order, which make up the original text."""
+        for b in range(self.meta['blocks']):
+            yield self.decompress(self.data[self.block_offsets[b]:self.block_offsets[b + 1]])
+
+    def close(self):
+        """Unmap the pack."""
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def unpack(pack_file, output_file):
+    """Write the text a pack was made from to output_file ('-' for stdout)."""
+    with PackedFortuneFile(pack_file) as packed:
+        if output_file == '-':
+            for data in packed.blocks():
+                sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+            return
+        directory = os.path.dirname(os.path.abspath(output_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.fortune-')
+        try:
+            with open(fd, 'wb') as out:
+                for data in packed.blocks():
+                    out.write(data)
+            replace_file(temp_path, output_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+def _access_time(f, samples, rng):
+    """Return the mean seconds to fetch a random entry of f as text."""
+    count = len(f)
+    ids = [rng.randrange(count) for _ in range(samples)]
+    get = f.get
+    start = time.perf_counter()
+    for n in ids:
+        get(n)
+    return (time.perf_counter() - start) / samples
+
+def report(corpus_file, methods=METHODS, block_sizes=(BLOCK_SIZE,), samples=2000, seed=0,
+           dictionary=True):
+    """Compare packs of corpus_file with the plain file and its .dat index.
+
+    Returns one row per layout with its size, compression ratio and mean
+    random-access latency in microseconds, the plain .dat path first.
+    Random entries are fetched from a cold block cache each time, as
+    every id is drawn afresh.
+    """
+    size = os.path.getsize(corpus_file)
+    with open_fortune_file(corpus_file) as f:
+        dat_size = os.path.getsize(f.dat_file)
+        rows = [{'layout': 'plain + .dat', 'bytes': size + dat_size, 'ratio': 1.0,
+                 'access_us': round(_access_time(f, samples, random.Random(seed)) * 1e6, 2)}]
+    with tempfile.TemporaryDirectory(prefix='fortune-pack-') as directory:
+        pack_file = os.path.join(directory, 'corpus.pack')
+        for method in methods:
+            for block_size in block_sizes:
+                start = time.perf_counter()
+                meta = pack(corpus_file, pack_file, method, block_size=block_size,
+                            dictionary=dictionary)
+                seconds = time.perf_counter() - start
+                with PackedFortuneFile(pack_file) as packed:
+                    access = _access_time(packed, samples, random.Random(seed))
+                rows.append({'layout': f'{method} {block_size}', 'bytes': meta['packed_size'],
+                             'ratio': round((size + dat_size) / meta['packed_size'], 2),
+                             'access_us': round(access * 1e6, 2),
+                             'pack_s': round(seconds, 3), 'blocks': meta['blocks']})
+    return rows
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Block-compressed fortune files with random access.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = subparsers.add_parser('pack', help='compress a fortune file')
+    pack_parser.add_argument('corpus_file')
+    pack_parser.add_argument('pack_file', nargs='?', help='output (default: corpus_file.pack)')
+    pack_parser.add_argument('--method', '-m', choices=METHODS, default='zlib')
+    pack_parser.add_argument('--level', type=int, help='compression level (default: zlib 9, lzma 6)')
+    pack_parser.add_argument('--block-size', '-b', type=int, default=BLOCK_SIZE,
+                             help=f'bytes of text per block (default: {BLOCK_SIZE})')
+    pack_parser.add_argument('--no-dictionary', dest='dictionary', action='store_false',
+                             help='do not give zlib blocks a dictionary sampled from the corpus')
+
+    unpack_parser = subparsers.add_parser('unpack', help='restore the fortune file of a pack')
+    unpack_parser.add_argument('pack_file')
+    unpack_parser.add_argument('output_file', nargs='?', default='-',
+                               help="output (default: '-', standard output)")
+
+    get_parser = subparsers.add_parser('get', help='print entries by id')
+    get_parser.add_argument('pack_file')
+    get_parser.add_argument('ids', type=int, nargs='+')
+
+    report_parser = subparsers.add_parser('report', help='compare compression ratio and access latency')
+    report_parser.add_argument('corpus_file')
+    report_parser.add_argument('--methods', nargs='+', choices=METHODS, default=list(METHODS))
+    report_parser.add_argument('--block-sizes', type=int, nargs='+',
+                               default=[2048, 4096, 16384, 65536])
+    report_parser.add_argument('--samples', type=int, default=2000,
+                               help='random entries fetched per layout (default: 2000)')
+    report_parser.add_argument('--no-dictionary', dest='dictionary', action='store_false',
+                               help='do not give zlib blocks a dictionary sampled from the corpus')
+    report_parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        meta = pack(args.corpus_file, args.pack_file, args.method, args.level, args.block_size,
+                    args.dictionary)
+        print(f"{meta['count']} entries in {meta['blocks']} blocks: {meta['size']} bytes "
+              f"packed to {meta['packed_size']} ({meta['size'] / max(meta['packed_size'], 1):.2f}x)")
+    elif args.command == 'unpack':
+        unpack(args.pack_file, args.output_file)
+    elif args.command == 'get':
+        with PackedFortuneFile(args.pack_file) as packed:
+            for n in args.ids:
+                print(packed.get(n))
+                print('%')
+    else:
+        rows = report(args.corpus_file, args.methods, args.block_sizes, args.samples,
+                      dictionary=args.dictionary)
+        if args.json:
+            print(json.dumps(rows, indent=1))
+        else:
+            print(f"{'layout':14} {'bytes':>10} {'ratio':>6} {'access us':>10} {'pack s':>7}")
+            for row in rows:
+                pack_s = f"{row['pack_s']:7.3f}" if 'pack_s' in row else f"{'-':>7}"
+                print(f"{row['layout']:14} {row['bytes']:10} {row['ratio']:6.2f} "
+                      f"{row['access_us']:10.2f} {pack_s}")
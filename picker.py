@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import re
+import sys
+
+from datfile import open_fortune_file
+
+# The corpora fortune is pointed at when no files are given
+DEFAULT_CORPORA = ['levonkquotes', 'dadjokes', 'contradiction']
+
+# Longest string in bytes that counts as short, like fortune -n
+SHORT_MAX = 160
+
+PERCENT_RE = re.compile(r'^(\d+(?:\.\d+)?)%$')
+
+class AliasTable:
+    """Draw an index with probability proportional to its weight in O(1).
+
+    Built with Vose's alias method: each slot holds a probability and an
+    alias, so a draw takes one uniform slot and one coin flip.
+    """
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = sum(weights)
+        if count == 0 or total <= 0:
+            raise ValueError('at least one weight must be positive')
+        scaled = [weight * count / total for weight in weights]
+        self.prob = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left is 1.0 up to rounding
+
+    def draw(self, rng):
+        """Return a random index."""
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+def parse_sources(args):
+    """Parse fortune-style arguments like ['30%', 'dadjokes', 'levonkquotes'].
+
+    Returns a list of (corpus_file, percent) with percent None for files
+    without one.
+    """
+    sources = []
+    percent = None
+    for arg in args:
+        match = PERCENT_RE.match(arg)
+        if match:
+            if percent is not None:
+                raise ValueError(f'percentage {arg} does not apply to a file')
+            percent = float(match.group(1))
+        else:
+            sources.append((arg, percent))
+            percent = None
+    if percent is not None:
+        raise ValueError('percentage given without a file')
+    return sources
+
+class FortunePicker:
+    """Pick random fortunes from several corpora without scanning them.
+
+    sources is a list of (corpus_file, percent) as parse_sources returns.
+    As with fortune, files with a percentage get that share of the draws
+    and the other files share the rest by number of entries, or equally
+    if equal is True. Each corpus is opened through its .dat index once,
+    and every draw is O(1): one alias table draw for the file and one
+    uniform draw for the entry. Length filters take the matching entries
+    from each file's .lengths index by binary search, once per filter.
+    With a RotationState, entries are drawn
+    from a rotation per file and length filter instead, so none repeats
+    until all were shown.
+    """
+
+    def __init__(self, sources, equal=False, short_max=SHORT_MAX, rng=None, rotation=None):
+        self.sources = sources
+        self.files = [open_fortune_file(path) for path, _ in sources]
+        self.equal = equal
+        self.short_max = short_max
+        self.rng = rng or random.Random()
+        self.rotation = rotation
+        self.length_indexes = [None] * len(self.files)
+        self.tables = {}
+
+    def _range(self, length):
+        """Return the (metric, low, high) a length filter selects."""
+        if length == 'short':
+            return 'bytes', None, self.short_max
+        if length == 'long':
+            return 'bytes', self.short_max + 1, None
+        if isinstance(length, tuple) and len(length) == 3:
+            return length
+        raise ValueError("length must be 'short', 'long', (metric, low, high) or None, "
+                         f"not {length!r}")
+
+    def _candidates(self, i, length):
+        """Return the entry ids of file i matching length, or None for all."""
+        if length is None:
+            return None
+        metric, low, high = self._range(length)
+        if self.length_indexes[i] is None:
+            from length_index import open_length_index
+            f = self.files[i]
+            self.length_indexes[i] = open_length_index(f.corpus_file, count=len(f))
+        return self.length_indexes[i].select(metric, low, high)
+
+    def _table(self, length):
+        """Return (AliasTable, candidates per file) for a length filter."""
+        if length in self.tables:
+            return self.tables[length]
+
+        candidates = [self._candidates(i, length) for i in range(len(self.files))]
+        counts = [len(f) if c is None else len(c) for f, c in zip(self.files, candidates)]
+        percents = [percent for _, percent in self.sources]
+        fixed = sum(p for p in percents if p is not None)
+        if fixed > 100:
+            raise ValueError(f'probabilities sum to {fixed:g}% > 100%')
+
+        # Files without a percentage share what is left
+        rest = [count for count, p in zip(counts, percents) if p is None and count]
+        rest_total = len(rest) if self.equal else sum(rest)
+        weights = []
+        for count, percent in zip(counts, percents):
+            if not count:
+                weights.append(0)
+            elif percent is not None:
+                weights.append(percent)
+            else:
+                share = 1 if self.equal else count
+                weights.append((100 - fixed) * share / rest_total)
+        if not any(weights):
+            raise ValueError('no fortunes match')
+
+        self.tables[length] = AliasTable(weights), candidates
+        return self.tables[length]
+
+    def _draw(self, length):
+        """Return (file index, entry id) of a random fortune."""
+        table, candidates = self._table(length)
+        i = table.draw(self.rng)
+        ids = candidates[i]
+        count = len(self.files[i]) if ids is None else len(ids)
+        if self.rotation is None:
+            position = self.rng.randrange(count)
+        else:
+            corpus_file = self.files[i].corpus_file
+            name = os.path.abspath(corpus_file)
+            if length is not None:
+                metric, low, high = self._range(length)
+                name = f"{name} {metric}:{'' if low is None else low}-{'' if high is None else high}"
+            # Filtered ids are in length order, where new entries do not go last
+            position = self.rotation.rotation(name, corpus_file, count, ids is None).next()
+        return i, position if ids is None else ids[position]
+
+    def draw(self, length=None):
+        """Return (corpus_file, entry id) of a random fortune.
+
+        length is None, 'short' or 'long', as with fortune -s and -l, or
+        (metric, low, high) for entries whose length by a length_index
+        metric is in that range, either bound None for none.
+        """
+        i, n = self._draw(length)
+        return self.files[i].corpus_file, n
+
+    def fortune(self, length=None):
+        """Return (corpus_file, text) of a random fortune."""
+        i, n = self._draw(length)
+        f = self.files[i]
+        return f.corpus_file, f.get(n)
+
+    def close(self):
+        """Close every corpus."""
+        for f in self.files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Print a random fortune.')
+    parser.add_argument('files', nargs='*', metavar='[N%] file',
+                        help='fortune files, each optionally preceded by a percentage')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-s', dest='length', action='store_const', const='short',
+                       help='short fortunes only')
+    group.add_argument('-l', dest='length', action='store_const', const='long',
+                       help='long fortunes only')
+    group.add_argument('--chars', metavar='RANGE',
+                       help='only fortunes of N-M characters, e.g. 1-160, -160 or 200-')
+    group.add_argument('--words', metavar='RANGE', help='only fortunes of N-M words')
+    group.add_argument('--lines', metavar='RANGE', help='only fortunes of N-M lines, e.g. 2-4')
+    parser.add_argument('-n', type=int, default=SHORT_MAX, metavar='LENGTH',
+                        help=f'longest fortune considered short (default: {SHORT_MAX})')
+    parser.add_argument('-e', action='store_true',
+                        help='give all files without a percentage equal weight')
+    parser.add_argument('-c', action='store_true',
+                        help='show the file each fortune came from')
+    parser.add_argument('--pair', action='store_true',
+                        help='print a random pair of contradicting proverbs from the files '
+                             '(default: contradiction) instead')
+    parser.add_argument('--count', type=int, default=1,
+                        help='number of fortunes to print (default: 1)')
+    parser.add_argument('--rotate', nargs='?', const='', metavar='STATE_FILE',
+                        help='show every fortune once before any repeats, keeping the '
+                             'rotation in STATE_FILE (default: per user, under '
+                             '$XDG_STATE_HOME/fortune)')
+    parser.add_argument('--seed', type=int, help='seed the random generator')
+    args = parser.parse_args()
+
+    from fortune_entries import restore_sigpipe
+    restore_sigpipe()
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        sources = parse_sources(args.files)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.pair:
+        from contradiction_index import ContradictionIndex
+        files = [path for path, _ in sources] or [os.path.join(here, 'contradiction')]
+        index = ContradictionIndex.build(*files)
+        rng = random.Random(args.seed)
+        for _ in range(args.count):
+            proverb, opposite = index.random_pair(rng)
+            print(f'{proverb}\n\tvs.\n{opposite}')
+        sys.exit(0)
+
+    if not sources:
+        sources = [(os.path.join(here, name), None) for name in DEFAULT_CORPORA]
+
+    length = args.length
+    for metric in ('chars', 'words', 'lines'):
+        if getattr(args, metric) is not None:
+            from length_index import parse_range
+            try:
+                length = (metric, *parse_range(getattr(args, metric)))
+            except ValueError as e:
+                parser.error(f'--{metric}: {e}')
+
+    rng = random.Random(args.seed)
+    rotation = None
+    if args.rotate is not None:
+        from rotation import RotationState
+        rotation = RotationState(args.rotate or None, rng)
+    try:
+        with FortunePicker(sources, equal=args.e, short_max=args.n, rng=rng,
+                           rotation=rotation) as picker:
+            fortunes = [picker.fortune(length) for _ in range(args.count)]
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    # Saved before any output, so a reader that stops early cannot lose the draws
+    if rotation is not None:
+        rotation.save()
+    for corpus_file, text in fortunes:
+        if args.c:
+            print(f'({os.path.basename(corpus_file)})\n%')
+        print(text)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import difflib
+import os
+import re
+import sys
+import tempfile
+
+from fortune_entries import (AUTHOR_RE, TAG_LINE_RE, is_regular_file, read_entries,
+                             replace_file, restore_sigpipe)
+
+# Inline tags worth moving by default: '#' and a letter, so '#1' stays put
+DEFAULT_PATTERN = r'#[^\W\d_]\S*'
+
+# A run of '#tags' at the end of a line
+INLINE_TAGS_RE = re.compile(r'(?:\s+#\S+)+$')
+
+def split_inline_tags(line, pattern):
+    """Split the trailing tags matching pattern off a line.
+
+    Returns (line, moved tags). Trailing tags that do not fully match the
+    compiled pattern stay on the line, in order.
+    """
+    if '#' not in line:
+        return line, []
+    match = INLINE_TAGS_RE.search(line)
+    if not match:
+        return line, []
+    kept = []
+    moved = []
+    for tag in match.group().split():
+        (moved if pattern.fullmatch(tag) else kept).append(tag)
+    if not moved:
+        return line, []
+    return ' '.join([line[:match.start()]] + kept), moved
+
+def relocate_entry(lines, pattern):
+    r"""Return the lines of an entry with its inline tags on a tag line, or None.
+
+    Tags matching pattern at the end of content and author lines are
+    removed from them and added to the entry's last tag line, leaving out
+    tags the entry already has on a tag line. An entry without a tag line
+    gets a new tab-indented one after its author line (or after the last
+    line the tags came from if there is no author line). None means
+    nothing moved.
+
+    >>> relocate_entry(['Be brief. #wit #short', '\t- Anon', '\t#quote #wit'],
+    ...                re.compile('#wit|#short'))
+    ['Be brief.', '\t- Anon', '\t#quote #wit #short']
+    >>> relocate_entry(['Be brief. #wit', '\t- Anon'], re.compile('#wit'))
+    ['Be brief.', '\t- Anon', '\t#wit']
+    """
+    result = []
+    moved = []
+    anchor = None
+    tag_line = None
+    for line in lines:
+        if TAG_LINE_RE.match(line):
+            tag_line = len(result)
+        else:
+            line, tags = split_inline_tags(line, pattern)
+            if tags:
+                moved.extend(tag for tag in tags if tag not in moved)
+                anchor = len(result)
+            if AUTHOR_RE.match(line):
+                anchor = len(result)
+        result.append(line)
+    if not moved:
+        return None
+
+    present = {tag for line in result if TAG_LINE_RE.match(line) for tag in line.split()}
+    new_tags = [tag for tag in moved if tag not in present]
+    if tag_line is not None:
+        if new_tags:
+            result[tag_line] = ' '.join([result[tag_line]] + new_tags)
+    else:
+        result.insert(anchor + 1, '\t' + ' '.join(new_tags))
+    return result
+
+class _RawLines:
+    """The lines of a binary file, holding on to their bytes until taken.
+
+    read_entries() reads through this, so the bytes of each record are at
+    hand when it is yielded and a file or pipe is read only once.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.pending = bytearray()
+
+    def __iter__(self):
+        for raw in self.f:
+            self.pending += raw
+            yield raw
+
+    def take(self, size=None):
+        """Return and forget the first size bytes held, or all of them."""
+        if size is None:
+            size = len(self.pending)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+def _newline(data):
+    """Return the line ending used in data."""
+    return b'\r\n' if data.endswith(b'\r\n') or b'\r\n' in data else b'\n'
+
+def rewrite_tags(input_file, output_file=None, pattern=DEFAULT_PATTERN):
+    """Move inline tags in input_file, writing the result to output_file.
+
+    output_file defaults to input_file, which is replaced atomically and
+    flushed to disk; '-' is stdin or stdout. The input is read once, an
+    entry at a time, and each entry is written as soon as it is read, so
+    this works as a stage of a pipeline. Entries without tags to move are
+    copied byte for byte. Returns the number of entries changed.
+    """
+    if output_file is None:
+        output_file = input_file
+    pattern = re.compile(pattern)
+    temp_path = None
+    if output_file == '-':
+        out = sys.stdout.buffer
+        flush = not is_regular_file(out)
+    else:
+        directory = os.path.dirname(os.path.abspath(output_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.fortune-')
+        out = open(fd, 'wb')
+        flush = False
+    source = sys.stdin.buffer if input_file == '-' else None
+    changed = 0
+    try:
+        if source is None:
+            source = open(input_file, 'rb')
+        raw = _RawLines(source)
+        for entry in read_entries(raw):
+            original = raw.take(entry.end - entry.start)
+            lines = relocate_entry(entry.lines, pattern)
+            if lines is None:
+                out.write(original)
+            else:
+                newline = _newline(original)
+                out.write(newline.join(line.encode('utf-8') for line in lines))
+                if original.endswith(b'\n'):
+                    out.write(newline)
+                changed += 1
+            # The '%' line after the entry
+            out.write(raw.take())
+            if flush:
+                out.flush()
+        out.write(raw.take())
+        if temp_path is None:
+            out.flush()
+        else:
+            out.close()
+            replace_file(temp_path, output_file, sync=True)
+    except BaseException:
+        if temp_path is not None:
+            out.close()
+            os.unlink(temp_path)
+        raise
+    finally:
+        if source is not None and source is not sys.stdin.buffer:
+            source.close()
+    return changed
+
+def diff_tags(input_file, pattern=DEFAULT_PATTERN):
+    """Yield the lines of a unified diff of what rewrite_tags would change.
+
+    Nothing is yielded if nothing would change. input_file may be '-'.
+    """
+    pattern = re.compile(pattern)
+    first = True
+    line_number = 1
+    delta = 0
+    for entry in read_entries(input_file):
+        old = entry.lines
+        lines = relocate_entry(old, pattern)
+        if lines is not None:
+            if first:
+                yield f'--- {input_file}'
+                yield f'+++ {input_file}'
+                first = False
+            yield (f'@@ -{line_number},{len(old)} '
+                   f'+{line_number + delta},{len(lines)} @@')
+            # Entries are short, so each hunk is the whole entry
+            matcher = difflib.SequenceMatcher(None, old, lines, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal':
+                    yield from (f' {line}' for line in old[i1:i2])
+                else:
+                    yield from (f'-{line}' for line in old[i1:i2])
+                    yield from (f'+{line}' for line in lines[j1:j2])
+            delta += len(lines) - len(old)
+        line_number += len(old) + entry.terminated
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Move inline #tags onto their own tag line in a fortune file.')
+    parser.add_argument('input_file', nargs='?', default='levonkquotes',
+                        help="fortune file, or '-' for standard input (default: levonkquotes)")
+    parser.add_argument('--pattern', '-p', default=DEFAULT_PATTERN,
+                        help="regular expression a tag must match to move, "
+                             "e.g. '#model|#think|#modelthink' (default: any #word)")
+    parser.add_argument('--output', '-o', metavar='FILE',
+                        help="write here instead of replacing input_file; '-' for standard "
+                             "output, the default when input_file is '-'")
+    parser.add_argument('--dry-run', '-n', action='store_true',
+                        help='print a diff of the changes instead of making them')
+    args = parser.parse_args()
+
+    try:
+        re.compile(args.pattern)
+    except re.error as e:
+        parser.error(f'bad --pattern: {e}')
+
+    if args.dry_run:
+        restore_sigpipe()
+        changed = False
+        for line in diff_tags(args.input_file, args.pattern):
+            changed = True
+            sys.stdout.write(line + '\n')
+        sys.exit(1 if changed else 0)
+
+    output = args.output or args.input_file
+    if output == '-':
+        restore_sigpipe()
+    count = rewrite_tags(args.input_file, output, args.pattern)
+    # With the fortunes on stdout, the count goes to stderr
+    print(f'Moved tags in {count} entries.', file=sys.stderr if output == '-' else sys.stdout)
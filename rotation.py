@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import random
+
+from fortune_entries import replace_file, source_state
+
+# Version of the state file layout
+STATE_FORMAT = 1
+
+# Feistel rounds; four make a keyed permutation that looks random
+ROUNDS = 4
+
+MASK64 = (1 << 64) - 1
+
+def default_state_file():
+    """Return the per-user rotation state file, under $XDG_STATE_HOME."""
+    base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'fortune', 'rotation.json')
+
+def _mix(x):
+    """Return a 64-bit hash of x (the splitmix64 finalizer)."""
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & MASK64
+    return x ^ (x >> 31)
+
+class FeistelPermutation:
+    """A keyed permutation of range(size), computed one position at a time.
+
+    A balanced Feistel network permutes the smallest domain of 4**h
+    numbers holding size; positions it maps outside range(size) are
+    mapped again until they land inside (cycle walking). The domain is
+    less than four times size, so a position takes a few rounds on
+    average and nothing is stored but size and key.
+    """
+
+    def __init__(self, size, key):
+        self.size = size
+        self.key = key
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.size:
+            raise IndexError(f'position {i} out of range')
+        bits, mask, key = self.half_bits, self.half_mask, self.key
+        while True:
+            left, right = i >> bits, i & mask
+            for r in range(ROUNDS):
+                left, right = right, left ^ (_mix(key ^ (r << 56) ^ right) & mask)
+            i = left << bits | right
+            if i < self.size:
+                return i
+
+class Rotation:
+    """Every item of range(count) once, in shuffled order, then again.
+
+    The order is a list of segments (base, size, key, drawn): positions
+    drawn so far of a Feistel permutation of base..base + size - 1. A
+    cycle starts as one segment over all items; items added during a
+    cycle get a segment of their own, drawn from alongside what is left
+    of the others, so they show up in this cycle without anything
+    repeating. Each draw picks a segment with chance proportional to the
+    items it has left. State is a handful of integers per segment.
+    """
+
+    def __init__(self, count=0, segments=None, rng=None):
+        self.count = count
+        self.segments = segments if segments is not None else []
+        self.rng = rng or random.Random()
+
+    def _start_cycle(self):
+        self.segments = [[0, self.count, self.rng.getrandbits(64), 0]]
+
+    def extend(self, count):
+        """Add the items count of them now make; they join the current cycle."""
+        if count > self.count:
+            self.segments.append([self.count, count - self.count, self.rng.getrandbits(64), 0])
+            self.count = count
+
+    def remaining(self):
+        """Return the number of items not yet drawn in this cycle."""
+        return sum(size - drawn for _, size, _, drawn in self.segments)
+
+    def next(self):
+        """Return the next item, starting a new cycle when all were drawn."""
+        if not self.count:
+            raise ValueError('nothing to rotate through')
+        left = self.remaining()
+        if not left:
+            self._start_cycle()
+            left = self.count
+        pick = self.rng.randrange(left)
+        for segment in self.segments:
+            base, size, key, drawn = segment
+            if pick < size - drawn:
+                segment[3] += 1
+                return base + FeistelPermutation(size, key)[drawn]
+            pick -= size - drawn
+
+    def as_dict(self):
+        """Return the state of the rotation as JSON-ready data."""
+        # Finished segments are dropped; they only matter until the cycle ends
+        segments = [segment for segment in self.segments if segment[3] < segment[1]]
+        return {'count': self.count, 'segments': segments}
+
+    @classmethod
+    def from_dict(cls, data, rng=None):
+        """Return the rotation as_dict() saved."""
+        return cls(data['count'], [list(segment) for segment in data['segments']], rng)
+
+class RotationState:
+    """The rotations of one user, kept in a JSON file.
+
+    Each rotation is named, e.g. by corpus path and length filter, and
+    remembers the state of its corpus. A corpus that only grew extends
+    its rotation; any other change starts it over. Nothing is written
+    until save().
+    """
+
+    def __init__(self, path=None, rng=None):
+        self.path = path or default_state_file()
+        self.rng = rng or random.Random()
+        self.rotations = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == STATE_FORMAT:
+                self.rotations = data['rotations']
+        except (OSError, ValueError, KeyError):
+            pass
+        self.open = {}
+
+    def rotation(self, name, corpus_file, count, extend=True):
+        """Return the rotation called name over count items of corpus_file.
+
+        With extend False, a corpus that grew starts the rotation over as
+        well, for items whose positions move when entries are added.
+        """
+        if name in self.open:
+            return self.open[name][0]
+        saved = self.rotations.get(name)
+        try:
+            status, source = source_state(corpus_file, saved and saved['source'])
+            rotation = Rotation.from_dict(saved['rotation'], self.rng) if saved else None
+        except (KeyError, TypeError, ValueError):
+            status, source = source_state(corpus_file)
+            rotation = None
+        if rotation is None or status == 'changed' or count < rotation.count or \
+                (not extend and count != rotation.count):
+            rotation = Rotation(count, rng=self.rng)
+        else:
+            rotation.extend(count)
+        self.open[name] = rotation, source
+        return rotation
+
+    def save(self):
+        """Write the rotations to the state file, replacing it atomically."""
+        import tempfile
+        for name, (rotation, source) in self.open.items():
+            self.rotations[name] = {'source': source, 'rotation': rotation.as_dict()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.rotation-')
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump({'format': STATE_FORMAT, 'rotations': self.rotations}, f,
+                          indent=1, sort_keys=True)
+            replace_file(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import heapq
+import json
+import math
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from collections import Counter
+
+from fortune_entries import read_entries, replace_file, source_state
+
+MAGIC = b'FORTUNE-SEARCH 1\n'
+LENGTH = struct.Struct('>I')
+
+TOKEN_RE = re.compile(r'\w+')
+
+# BM25 term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+def tokenize(text):
+    """Return the lowercase word tokens of text."""
+    return TOKEN_RE.findall(text.lower())
+
+def _encode(numbers, out):
+    """Append numbers to the bytearray out as varints."""
+    for n in numbers:
+        while n >= 0x80:
+            out.append(n & 0x7f | 0x80)
+            n >>= 7
+        out.append(n)
+
+def _decode(data):
+    """Yield the varints stored in data."""
+    n = shift = 0
+    for byte in data:
+        n |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield n
+            n = shift = 0
+
+class SearchIndex:
+    """BM25 full-text index over the bodies and authors of a fortune file.
+
+    Entries are tokenized once, with the parser the taggers use, and get
+    the same entry ids as the tag index. Each term's postings are stored
+    as varint-encoded (entry id gap, term frequency) pairs, so a query
+    decodes only the postings of its own terms and never reads the corpus.
+    """
+
+    def __init__(self):
+        self.terms = {}
+        self.postings = bytearray()
+        self.lengths = array('I')
+        self.spans = array('Q')
+        self.author_ids = array('I')
+        self.authors = []
+        self.total_length = 0
+        self.state = None
+
+    @property
+    def count(self):
+        return len(self.lengths)
+
+    @classmethod
+    def build(cls, corpus_file):
+        """Return a new index of corpus_file."""
+        index = cls()
+        # Take the state first, so edits made while parsing trigger a rebuild
+        index.state = source_state(corpus_file)[1]
+        author_ids = {}
+        # term -> [encoded postings, last entry id, document frequency]
+        building = {}
+        for entry in read_entries(corpus_file):
+            if not entry.lines:
+                continue
+            entry_id = index.count
+            author = entry.author
+            tokens = tokenize(f'{entry.content} {author}')
+            index.lengths.append(len(tokens))
+            index.total_length += len(tokens)
+            index.spans.extend((entry.start, entry.end))
+            if author not in author_ids:
+                author_ids[author] = len(index.authors)
+                index.authors.append(author)
+            index.author_ids.append(author_ids[author])
+            for term, tf in Counter(tokens).items():
+                postings = building.get(term)
+                if postings is None:
+                    postings = building[term] = [bytearray(), 0, 0]
+                _encode((entry_id - postings[1], tf), postings[0])
+                postings[1] = entry_id
+                postings[2] += 1
+
+        for term, (encoded, _, df) in building.items():
+            index.terms[term] = (len(index.postings), len(encoded), df)
+            index.postings += encoded
+        return index
+
+    def save(self, index_file):
+        """Write the index to index_file, replacing it atomically."""
+        meta = json.dumps({'state': self.state, 'count': self.count,
+                           'total_length': self.total_length, 'byteorder': sys.byteorder,
+                           'authors': self.authors, 'terms': self.terms}).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(index_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.searchindex-')
+        try:
+            with open(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(LENGTH.pack(len(meta)))
+                f.write(meta)
+                for values in (self.lengths, self.author_ids, self.spans):
+                    f.write(values.tobytes())
+                f.write(self.postings)
+            replace_file(temp_path, index_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, index_file):
+        """Return the index stored in index_file."""
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f'{index_file}: not a search index')
+        pos = len(MAGIC)
+        (meta_length,) = LENGTH.unpack_from(data, pos)
+        pos += LENGTH.size
+        meta = json.loads(data[pos:pos + meta_length])
+        pos += meta_length
+
+        index = cls()
+        index.state = meta['state']
+        index.authors = meta['authors']
+        index.total_length = meta['total_length']
+        index.terms = {term: tuple(info) for term, info in meta['terms'].items()}
+        count = meta['count']
+        for values, size in ((index.lengths, 4), (index.author_ids, 4), (index.spans, 16)):
+            values.frombytes(data[pos:pos + size * count])
+            if meta['byteorder'] != sys.byteorder:
+                values.byteswap()
+            pos += size * count
+        index.postings = data[pos:]
+        return index
+
+    def _postings(self, term):
+        """Yield (entry id, term frequency) for term."""
+        info = self.terms.get(term)
+        if info is None:
+            return
+        offset, length, _ = info
+        entry_id = 0
+        numbers = _decode(self.postings[offset:offset + length])
+        for gap in numbers:
+            entry_id += gap
+            yield entry_id, next(numbers)
+
+    def search(self, query, k=10, author=None, allowed=None):
+        """Return the top k (score, entry id) pairs for query, best first.
+
+        author keeps only entries whose author contains it, ignoring case.
+        allowed is a set of entry ids, such as the ids of a tag index
+        query, that results must be in.
+        """
+        count = self.count
+        if not count:
+            return []
+        average_length = self.total_length / count or 1
+        allowed_authors = None
+        if author is not None:
+            author = author.lower()
+            allowed_authors = {i for i, name in enumerate(self.authors) if author in name.lower()}
+
+        scores = {}
+        lengths = self.lengths
+        for term in set(tokenize(query)):
+            info = self.terms.get(term)
+            if info is None:
+                continue
+            df = info[2]
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for entry_id, tf in self._postings(term):
+                if allowed is not None and entry_id not in allowed:
+                    continue
+                if allowed_authors is not None and self.author_ids[entry_id] not in allowed_authors:
+                    continue
+                norm = K1 * (1 - B + B * lengths[entry_id] / average_length)
+                scores[entry_id] = scores.get(entry_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, ((score, entry_id) for entry_id, score in scores.items()))
+
+    def span(self, entry_id):
+        """Return the (start, end) byte offsets of an entry."""
+        return self.spans[2 * entry_id], self.spans[2 * entry_id + 1]
+
+def open_search_index(corpus_file, index_file=None):
+    """Return the search index of corpus_file, rebuilding its saved copy if stale."""
+    if index_file is None:
+        index_file = f'{corpus_file}.search'
+    try:
+        index = SearchIndex.load(index_file)
+        status, state = source_state(corpus_file, index.state)
+    except (OSError, ValueError, KeyError):
+        index, status, state = None, 'changed', None
+    if status != 'unchanged':
+        index = SearchIndex.build(corpus_file)
+        index.save(index_file)
+    elif state != index.state:
+        index.state = state
+        index.save(index_file)
+    return index
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Search fortunes by the words of their text and author.')
+    parser.add_argument('corpus_file')
+    parser.add_argument('query')
+    parser.add_argument('-k', type=int, default=10,
+                        help='number of results (default: 10)')
+    parser.add_argument('--author', help='only entries whose author contains this')
+    parser.add_argument('--tags', metavar='QUERY',
+                        help="only entries matching a tag query, e.g. '#entrepreneur NOT #politics'")
+    parser.add_argument('--index', metavar='FILE',
+                        help='index file (default: corpus_file.search)')
+    parser.add_argument('--scores', action='store_true',
+                        help='print the score of each result')
+    args = parser.parse_intermixed_args()
+
+    index = open_search_index(args.corpus_file, args.index)
+    allowed = None
+    if args.tags:
+        from tag_index import open_tag_index
+        try:
+            tag_index = open_tag_index(args.corpus_file)
+            allowed = set(tag_index.ids(tag_index.query(args.tags)))
+        except ValueError as e:
+            parser.error(str(e))
+
+    with open(args.corpus_file, 'rb') as f:
+        for score, entry_id in index.search(args.query, args.k, args.author, allowed):
+            start, end = index.span(entry_id)
+            f.seek(start)
+            if args.scores:
+                print(f'[{score:.3f}]')
+            print(f.read(end - start).decode('utf-8').rstrip('\r\n'))
+            print('%')
@@ -1,75 +1,55 @@
 #!/usr/bin/env python3
 
-import re
+from fortune_entries import add_tagger_arguments, message_stream, rewrite_file
+from tag_rules import load_profile
+from tag_stats import TagStats
+
+# Compiled from rules/simple_tag_adder.json
+RULES = load_profile('simple_tag_adder')
 
 def get_tags(content, author):
     """Generate simple tags based on content and author."""
-    tags = set()
-    content_lower = content.lower()
-    
-    # Simple topic detection
-    topics = {
-        'leadership': ['lead', 'leader', 'manage', 'team', 'vision', 'inspire'],
-        'business': ['company', 'startup', 'entrepreneur', 'market', 'customer'],
-        'wisdom': ['learn', 'knowledge', 'understand', 'insight', 'wise'],
-        'work': ['effort', 'work', 'dedication', 'persevere', 'discipline'],
-        'success': ['succeed', 'achieve', 'accomplish', 'excellence', 'greatness'],
-        'life': ['live', 'experience', 'journey', 'purpose', 'meaning']
-    }
-    
-    for topic, keywords in topics.items():
-        if any(keyword in content_lower for keyword in keywords):
-            tags.add(f'#{topic}')
-    
-    if not tags:
-        tags.add('#quote')
-    
-    return ' '.join(sorted(tags))
+    return RULES.tags(content, author)
 
-def process_file(input_file, output_file):
-    """Process the input file and write tagged output to output file."""
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    output = []
-    current_entry = []
-    
-    for line in lines:
-        line = line.rstrip()
-        current_entry.append(line)
+def tag_entry(entry):
+    """Return the output lines for an entry, tagged if it is complete."""
+    # Lines after the last % are dropped
+    if not entry.terminated:
+        return []
+    
+    output_entry = entry.lines + ['%']
+    if entry.lines:
+        parts = entry.parts
+        author = parts.author
+        content = ' '.join(parts.content_lines)
         
-        if line == '%':
-            # Process the completed entry
-            if len(current_entry) > 1:  # Not just a single %
-                # Find author line (last line that starts with \t- )
-                author_line = next((l for l in reversed(current_entry[:-1]) if l.startswith('\t- ')), '')
-                author = author_line[3:] if author_line else ''
-                
-                # Get content (all lines except author and %)
-                content_lines = [l for l in current_entry if l != '%' and not l.startswith('\t- ')]
-                content = ' '.join(content_lines)
-                
-                # Only add tags if we have both content and author
-                if content.strip() and author:
-                    tags = get_tags(content, author)
-                    # Insert tags before the closing %
-                    current_entry.insert(-1, f'\t{tags}')
-            
-            # Add all lines of the entry to output
-            output.append('\n'.join(current_entry))
-            current_entry = []
+        # Only add tags if we have both content and author
+        if content.strip() and author:
+            tags = get_tags(content, author)
+            # Insert tags before the closing %
+            output_entry.insert(-1, f'\t{tags}')
     
-    # Write the output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(output))
+    return output_entry
+
+def process_file(input_file, output_file, jobs=1, stats=None):
+    """Process the input file and write tagged output to output file.
+    
+    With a TagStats, rule hits and phase timings are recorded in it.
+    """
+    with RULES.collect_stats(stats):
+        rewrite_file(input_file, output_file, tag_entry, jobs, stats)
 
 if __name__ == '__main__':
+    import argparse
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python simple_tag_adder.py input_file output_file")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Add simple topic tags to the complete entries of a fortune file.')
+    add_tagger_arguments(parser)
+    args = parser.parse_args()
+    
+    out = message_stream(args.output_file)
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    process_file(input_file, output_file)
-    print(f"Simple tags added successfully to {output_file}")
+    stats = TagStats() if args.stats else None
+    process_file(args.input_file, args.output_file, jobs=args.jobs, stats=stats)
+    print(f"Simple tags added successfully to {args.output_file}", file=out)
+    if stats is not None:
+        print(stats.report(args.stats_format), file=sys.stderr)
@@ -1,80 +1,59 @@
 #!/usr/bin/env python3
 
-def should_add_tags(entry_lines):
+from fortune_entries import add_tagger_arguments, message_stream, rewrite_file
+from tag_rules import load_profile
+from tag_stats import TagStats
+
+# Compiled from rules/strict_tag_adder.json
+RULES = load_profile('strict_tag_adder')
+
+def should_add_tags(entry):
     """Check if we should add tags to this entry."""
-    has_author = any(line.startswith('\t- ') for line in entry_lines)
-    has_content = any(not line.startswith('\t') and line.strip() and line != '%' 
-                     for line in entry_lines)
-    return has_author and has_content
+    parts = entry.parts
+    return bool(parts.author_line) and parts.has_content
 
 def get_simple_tag(content, author):
     """Return a simple tag based on content."""
-    content_lower = content.lower()
-    
-    if any(word in content_lower for word in ['lead', 'leader', 'manage', 'team']):
-        return '#leadership'
-    if any(word in content_lower for word in ['business', 'company', 'market']):
-        return '#business'
-    if any(word in content_lower for word in ['learn', 'knowledge', 'wisdom']):
-        return '#wisdom'
-    if any(word in content_lower for word in ['work', 'effort', 'hard work']):
-        return '#work'
-    if any(word in content_lower for word in ['dream', 'vision', 'goal']):
-        return '#goals'
-    if any(word in content_lower for word in ['science', 'technology', 'computer']):
-        return '#tech'
-    if any(word in content_lower for word in ['art', 'create', 'imagine']):
-        return '#creativity'
-    
-    return '#quote'
+    return RULES.tags(content, author)
 
-def process_file(input_file, output_file):
-    """Process the input file and write tagged output to output file."""
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    output = []
-    current_entry = []
+def tag_entry(entry):
+    """Return the output lines for an entry, tagged if it is complete."""
+    # Lines after the last % are dropped
+    if not entry.terminated:
+        return []
     
-    for line in lines:
-        line = line.rstrip()
-        current_entry.append(line)
+    output_entry = entry.lines + ['%']
+    if should_add_tags(entry):
+        # Get content (all non-author, non-empty lines)
+        content = ' '.join(l for l in entry.parts.content_lines if l.strip())
         
-        if line == '%':
-            # Process the completed entry
-            if should_add_tags(current_entry):
-                # Get content (all non-author, non-empty lines)
-                content_lines = [l for l in current_entry 
-                               if not l.startswith('\t- ') 
-                               and l.strip() 
-                               and l != '%']
-                content = ' '.join(content_lines)
-                
-                # Get author (last line that starts with \t- )
-                author_line = next((l for l in reversed(current_entry) 
-                                  if l.startswith('\t- ')), '')
-                
-                # Get simple tag
-                tag = get_simple_tag(content, author_line)
-                
-                # Insert tag before the closing %
-                current_entry.insert(-1, f'\t{tag}')
-            
-            # Add all lines of the entry to output
-            output.append('\n'.join(current_entry))
-            current_entry = []
+        # Get simple tag
+        tag = get_simple_tag(content, entry.parts.author_line)
+        
+        # Insert tag before the closing %
+        output_entry.insert(-1, f'\t{tag}')
+    
+    return output_entry
+
+def process_file(input_file, output_file, jobs=1, stats=None):
+    """Process the input file and write tagged output to output file.
     
-    # Write the output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(output))
+    With a TagStats, rule hits and phase timings are recorded in it.
+    """
+    with RULES.collect_stats(stats):
+        rewrite_file(input_file, output_file, tag_entry, jobs, stats)
 
 if __name__ == '__main__':
+    import argparse
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python strict_tag_adder.py input_file output_file")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Add one tag to each complete entry of a fortune file.')
+    add_tagger_arguments(parser)
+    args = parser.parse_args()
+    
+    out = message_stream(args.output_file)
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    process_file(input_file, output_file)
-    print(f"Strict tags added successfully to {output_file}")
+    stats = TagStats() if args.stats else None
+    process_file(args.input_file, args.output_file, jobs=args.jobs, stats=stats)
+    print(f"Strict tags added successfully to {args.output_file}", file=out)
+    if stats is not None:
+        print(stats.report(args.stats_format), file=sys.stderr)
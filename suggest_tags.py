@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import heapq
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections import Counter
+
+from fortune_entries import read_entries, replace_file, source_state
+from search_index import tokenize
+
+MAGIC = b'FORTUNE-SUGGEST 1\n'
+LENGTH = struct.Struct('>I')
+
+# Queries scored together; their score tables are what a batch holds in memory
+BATCH_SIZE = 256
+
+def _weights(tokens, idf):
+    """Return the unit-length TF-IDF vector {term: weight} of tokens.
+
+    Term frequency is damped as 1 + log(tf); terms missing from idf are
+    dropped.
+    """
+    vector = {term: (1 + math.log(tf)) * idf[term]
+              for term, tf in Counter(tokens).items() if term in idf}
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    return {term: w / norm for term, w in vector.items()} if norm else {}
+
+def entry_tokens(entry):
+    """Return the tokens an entry is compared by: its content and author."""
+    return tokenize(f'{entry.content} {entry.author}')
+
+class TagSuggester:
+    """Suggest tags for entries from the tags of the entries most like them.
+
+    Each tagged entry of a corpus is a unit-length TF-IDF vector, stored
+    by term: a term's postings are the ids of the entries holding it and
+    their weights. Scoring a batch of queries walks the postings of each
+    query term once for the whole batch, which is the sparse product of
+    the query matrix with the transposed entry matrix. The k entries with
+    the highest cosine similarity vote for their tags, each vote weighted
+    by the similarity; a tag's confidence is its share of the votes.
+    """
+
+    def __init__(self):
+        self.terms = {}
+        self.idf = {}
+        self.docs = array('I')
+        self.weights = array('f')
+        self.tags = []
+        self.tag_offsets = array('I', [0])
+        self.tag_ids = array('I')
+        self.state = None
+
+    @property
+    def count(self):
+        return len(self.tag_offsets) - 1
+
+    @classmethod
+    def build(cls, corpus_file):
+        """Return a new suggester trained on the tagged entries of corpus_file."""
+        suggester = cls()
+        suggester.state = source_state(corpus_file)[1]
+        tag_ids = {}
+        documents = []
+        df = Counter()
+        for entry in read_entries(corpus_file):
+            tags = entry.tags
+            if not tags:
+                continue
+            # Tags differing only in case are one tag, spelled as first seen
+            for tag in dict.fromkeys(tag.lower() for tag in tags):
+                if tag not in tag_ids:
+                    tag_ids[tag] = len(suggester.tags)
+                    suggester.tags.append(next(t for t in tags if t.lower() == tag))
+                suggester.tag_ids.append(tag_ids[tag])
+            suggester.tag_offsets.append(len(suggester.tag_ids))
+            tokens = entry_tokens(entry)
+            documents.append(tokens)
+            df.update(set(tokens))
+
+        count = len(documents)
+        suggester.idf = {term: math.log((1 + count) / (1 + n)) + 1 for term, n in df.items()}
+        postings = {}
+        for doc, tokens in enumerate(documents):
+            for term, weight in _weights(tokens, suggester.idf).items():
+                postings.setdefault(term, []).append((doc, weight))
+        for term, pairs in postings.items():
+            suggester.terms[term] = (len(suggester.docs), len(pairs))
+            for doc, weight in pairs:
+                suggester.docs.append(doc)
+                suggester.weights.append(weight)
+        return suggester
+
+    def save(self, model_file):
+        """Write the suggester to model_file, replacing it atomically."""
+        meta = json.dumps({'state': self.state, 'count': self.count, 'byteorder': sys.byteorder,
+                           'postings': len(self.docs), 'tag_ids': len(self.tag_ids),
+                           'tags': self.tags, 'idf': self.idf,
+                           'terms': self.terms}).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(model_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.suggest-')
+        try:
+            with open(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(LENGTH.pack(len(meta)))
+                f.write(meta)
+                for values in (self.tag_offsets, self.tag_ids, self.docs, self.weights):
+                    f.write(values.tobytes())
+            replace_file(temp_path, model_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, model_file):
+        """Return the suggester stored in model_file."""
+        with open(model_file, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f'{model_file}: not a tag suggester')
+        pos = len(MAGIC)
+        (meta_length,) = LENGTH.unpack_from(data, pos)
+        pos += LENGTH.size
+        meta = json.loads(data[pos:pos + meta_length])
+        pos += meta_length
+
+        suggester = cls()
+        suggester.state = meta['state']
+        suggester.tags = meta['tags']
+        suggester.idf = meta['idf']
+        suggester.terms = {term: tuple(info) for term, info in meta['terms'].items()}
+        suggester.tag_offsets = array('I')
+        for values, length in ((suggester.tag_offsets, meta['count'] + 1),
+                               (suggester.tag_ids, meta['tag_ids']),
+                               (suggester.docs, meta['postings']),
+                               (suggester.weights, meta['postings'])):
+            size = values.itemsize * length
+            values.frombytes(data[pos:pos + size])
+            if meta['byteorder'] != sys.byteorder:
+                values.byteswap()
+            pos += size
+        return suggester
+
+    def neighbours(self, vectors, k=10):
+        """Return the k most similar tagged entries of each query vector.
+
+        vectors is a list of {term: weight} as made by _weights(); the
+        result is a list with a [(similarity, entry id)] per vector, most
+        similar first. Every posting list is read once per batch.
+        """
+        by_term = {}
+        for query, vector in enumerate(vectors):
+            for term, weight in vector.items():
+                by_term.setdefault(term, []).append((query, weight))
+        scores = [{} for _ in vectors]
+        docs, weights = self.docs, self.weights
+        for term, queries in by_term.items():
+            offset, length = self.terms[term]
+            postings = list(zip(docs[offset:offset + length], weights[offset:offset + length]))
+            for query, query_weight in queries:
+                table = scores[query]
+                get = table.get
+                for doc, weight in postings:
+                    table[doc] = get(doc, 0.0) + query_weight * weight
+        return [heapq.nlargest(k, ((score, doc) for doc, score in table.items()))
+                for table in scores]
+
+    def vote(self, neighbours, limit=3, min_confidence=0.3, exclude=()):
+        """Return up to limit (tag, confidence) for a list of neighbours, best first."""
+        total = sum(score for score, _ in neighbours)
+        if not total:
+            return []
+        votes = {}
+        for score, doc in neighbours:
+            for tag in self.tag_ids[self.tag_offsets[doc]:self.tag_offsets[doc + 1]]:
+                votes[tag] = votes.get(tag, 0.0) + score
+        ranked = sorted(((votes[tag] / total, self.tags[tag]) for tag in votes), reverse=True)
+        return [(tag, confidence) for confidence, tag in ranked
+                if confidence >= min_confidence and tag.lower() not in exclude][:limit]
+
+    def suggest(self, entries, k=10, limit=3, min_confidence=0.3, exclude=(),
+                batch_size=BATCH_SIZE):
+        """Yield (entry, [(tag, confidence)]) for each of entries, in order.
+
+        exclude holds lowercase tags never to suggest, such as a tag
+        every entry has. Entries are scored batch_size at a time.
+        """
+        exclude = {tag.lower() for tag in exclude}
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) == batch_size:
+                yield from self._suggest_batch(batch, k, limit, min_confidence, exclude)
+                batch = []
+        if batch:
+            yield from self._suggest_batch(batch, k, limit, min_confidence, exclude)
+
+    def _suggest_batch(self, batch, k, limit, min_confidence, exclude):
+        vectors = [_weights(entry_tokens(entry), self.idf) for entry in batch]
+        for entry, neighbours in zip(batch, self.neighbours(vectors, k)):
+            yield entry, self.vote(neighbours, limit, min_confidence, exclude)
+
+def open_suggester(corpus_file, model_file=None):
+    """Return the tag suggester of corpus_file, retraining its saved copy if stale."""
+    if model_file is None:
+        model_file = f'{corpus_file}.suggest'
+    try:
+        suggester = TagSuggester.load(model_file)
+        status, state = source_state(corpus_file, suggester.state)
+    except (OSError, ValueError, KeyError):
+        suggester, status, state = None, 'changed', None
+    if status != 'unchanged':
+        suggester = TagSuggester.build(corpus_file)
+        suggester.save(model_file)
+    elif state != suggester.state:
+        suggester.state = state
+        suggester.save(model_file)
+    return suggester
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Suggest tags for untagged fortunes from the tags of the most similar tagged ones.')
+    parser.add_argument('corpus_file', help='fortune file whose tagged entries teach the tags')
+    parser.add_argument('input_file', nargs='?',
+                        help="fortune file to suggest tags for, or '-' for standard input "
+                             "(default: corpus_file)")
+    parser.add_argument('-k', type=int, default=10,
+                        help='similar entries that vote on the tags (default: 10)')
+    parser.add_argument('--limit', type=int, default=3,
+                        help='most tags to suggest per entry (default: 3)')
+    parser.add_argument('--min-confidence', type=float, default=0.3,
+                        help='least share of the votes a tag needs (default: 0.3)')
+    parser.add_argument('--exclude', action='append', default=[], metavar='TAG',
+                        help="a tag never to suggest, e.g. '#quote'; may be repeated")
+    parser.add_argument('--model', metavar='FILE',
+                        help='saved model file (default: corpus_file.suggest)')
+    parser.add_argument('--json', action='store_true',
+                        help='print one JSON object per entry')
+    args = parser.parse_args()
+
+    suggester = open_suggester(args.corpus_file, args.model)
+    entries = (entry for entry in read_entries(args.input_file or args.corpus_file)
+               if entry.content and not entry.tags)
+    for entry, tags in suggester.suggest(entries, args.k, args.limit, args.min_confidence,
+                                         args.exclude):
+        if args.json:
+            print(json.dumps({'start': entry.start, 'end': entry.end, 'content': entry.content,
+                              'tags': [[tag, round(confidence, 3)] for tag, confidence in tags]}))
+        elif tags:
+            print(entry.content[:72])
+            print('\t' + ' '.join(f'{tag} ({confidence:.2f})' for tag, confidence in tags))
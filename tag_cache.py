@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import deque
+from functools import partial
+
+from fortune_entries import EntryWriter, map_entries, read_entries, replace_file
+
+# Version of the cache file layout, not of the tagging rules
+CACHE_FORMAT = 2
+
+def rules_version(*paths):
+    """Return a version string for tagging rules defined in the given files.
+
+    Any edit to the files changes the version, so tags cached by older
+    rules are never reused.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+class TagCache:
+    """On-disk cache of tag lines keyed by a hash of content and author.
+
+    Keys also include the rule-set version, so changing the rules misses
+    every entry. A file holds a section per tagging mode, such as
+    substring or whole-word matching, and a run only reads and writes the
+    section of its own mode. Keys of that section that are not looked up
+    during a run are evicted when the cache is saved, which keeps the file
+    in step with the corpus.
+    """
+
+    def __init__(self, path, version, mode='default'):
+        self.path = path
+        self.version = version
+        self.mode = mode
+        self.modes = {}
+        self.tags = {}
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == CACHE_FORMAT:
+                self.modes = data['modes']
+                self.tags = self.modes.get(mode, {})
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def key(self, content, author):
+        """Return the cache key for an entry's content and author."""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (self.version, content, author):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def lookup(self, content, author):
+        """Return (key, tags), with tags None on a miss."""
+        key = self.key(content, author)
+        tags = self.used.get(key)
+        if tags is None:
+            tags = self.tags.get(key)
+        if tags is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used[key] = tags
+        return key, tags
+
+    def store(self, key, tags):
+        """Remember the tags computed for key."""
+        self.used[key] = tags
+
+    def save(self):
+        """Write the keys used in this run to disk, dropping the others of its mode."""
+        self.evicted = len(self.tags.keys() - self.used.keys())
+        self.modes[self.mode] = self.used
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tagcache-')
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump({'format': CACHE_FORMAT, 'modes': self.modes}, f,
+                          separators=(',', ':'))
+            replace_file(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.tags = self.used
+        self.used = {}
+
+    def report(self):
+        """Return a one-line summary of cache hits and misses."""
+        return f'Tag cache: {self.hits} hits, {self.misses} misses, {self.evicted} evicted'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.save()
+
+def _resolve_tags(get_tags, item):
+    """Return the cached tags of item, computing them on a miss."""
+    content, author, tags = item
+    return tags if tags is not None else get_tags(content, author)
+
+def rewrite_file_cached(input_file, output_file, cache, split_entry, get_tags,
+                        tag_entry, jobs=1, stats=None):
+    """Tag input_file into output_file, reusing tags from cache.
+
+    split_entry(entry) returns the (content, author) that get_tags is called
+    with, or None for entries that are not tagged. tag_entry(entry, tags)
+    returns the output lines for an entry given its tags (None for
+    untagged entries). Only cache misses run get_tags, in jobs worker
+    processes if jobs > 1; get_tags must then be picklable. With a
+    TagStats, each phase is timed into it and jobs is ignored.
+    """
+    pending = deque()
+    entries = read_entries(input_file)
+    lookup = cache.lookup
+    if stats is not None:
+        jobs = 1
+        entries = stats.timed_iter('parse', entries)
+        split_entry = stats.timed('split', split_entry)
+        lookup = stats.timed('cache', lookup)
+        get_tags = stats.timed('tag', get_tags)
+        tag_entry = stats.timed('format', tag_entry)
+
+    def items():
+        for entry in entries:
+            parts = split_entry(entry)
+            if parts is None:
+                # Nothing to compute, but keep the results in step
+                pending.append((entry, None))
+                yield None, None, ''
+                continue
+            key, tags = lookup(*parts)
+            pending.append((entry, key))
+            yield parts[0], parts[1], tags
+
+    with EntryWriter(output_file) as writer:
+        write = writer.write if stats is None else stats.timed('write', writer.write)
+        for tags in map_entries(partial(_resolve_tags, get_tags), items(), jobs):
+            entry, key = pending.popleft()
+            if key is None:
+                write(tag_entry(entry, None))
+            else:
+                cache.store(key, tags)
+                write(tag_entry(entry, tags))
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+
+from fortune_entries import read_entries, replace_file, source_state
+
+MAGIC = b'FORTUNE-TAGS 1\n'
+LENGTH = struct.Struct('>I')
+
+QUERY_TOKEN_RE = re.compile(r'\(|\)|[^\s()]+')
+OPERATORS = {'and', 'or', 'not'}
+
+def normalize_tag(tag):
+    """Return the indexed form of a tag: lowercase with a leading '#'."""
+    tag = tag.lower()
+    return tag if tag.startswith('#') else f'#{tag}'
+
+def _bitmap_from_ids(ids, count):
+    """Return an int with the bits of ids set."""
+    bits = bytearray((count + 7) // 8)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+def _ids_from_bitmap(bitmap):
+    """Return the positions of the set bits of bitmap, in order."""
+    ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        if byte:
+            base = i << 3
+            ids.extend(base + bit for bit in range(8) if byte >> bit & 1)
+    return ids
+
+class TagIndex:
+    """Inverted index from tags to the entries of a fortune file.
+
+    Each tag is interned to an integer id, and each entry with any lines
+    gets an entry id in file order along with its byte span. The entries
+    of a tag are kept as a sorted posting list while the tag is rare and
+    as a bitmap once that is smaller, and queries combine bitmaps with
+    integer bit operations, so they cost a few word operations per 64
+    entries rather than a pass over the corpus.
+    """
+
+    def __init__(self):
+        self.tag_ids = {}
+        self.tags = []
+        self.postings = []
+        self.spans = array('Q')
+        self.count = 0
+        self.tail = 0
+        self.state = None
+        self.bitmaps = {}
+
+    def _add(self, entry):
+        """Index one entry."""
+        if not entry.lines:
+            return
+        entry_id = self.count
+        self.count += 1
+        self.spans.extend((entry.start, entry.end))
+        for tag in set(normalize_tag(tag) for tag in entry.tags):
+            tag_id = self.tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = self.tag_ids[tag] = len(self.tags)
+                self.tags.append(tag)
+                self.postings.append(array('I'))
+            postings = self.postings[tag_id]
+            if isinstance(postings, int):
+                self.postings[tag_id] = postings | 1 << entry_id
+            else:
+                postings.append(entry_id)
+
+    def _truncate(self, count):
+        """Drop the entries with ids from count on."""
+        for tag_id, postings in enumerate(self.postings):
+            if isinstance(postings, int):
+                self.postings[tag_id] = postings & ((1 << count) - 1)
+            else:
+                while postings and postings[-1] >= count:
+                    postings.pop()
+        del self.spans[2 * count:]
+        self.count = count
+
+    def update(self, corpus_file):
+        """Bring the index up to date with corpus_file.
+
+        Nothing is parsed if the file is unchanged, only the new part is
+        parsed if the file was appended to, and the index is rebuilt
+        otherwise. Returns the status from source_state.
+        """
+        status, state = source_state(corpus_file, self.state)
+        if status == 'changed':
+            self.__init__()
+        if status != 'unchanged':
+            # The last entry may have grown, so parse again from its start
+            start = self.tail
+            while self.count and self.spans[2 * self.count - 2] >= start:
+                self._truncate(self.count - 1)
+            for entry in read_entries(corpus_file, start):
+                self.tail = entry.start
+                self._add(entry)
+        self.state = state
+        self.bitmaps = {}
+        return status
+
+    @classmethod
+    def build(cls, corpus_file):
+        """Return a new index of corpus_file."""
+        index = cls()
+        index.update(corpus_file)
+        return index
+
+    def save(self, index_file):
+        """Write the index to index_file, replacing it atomically."""
+        payloads = []
+        tags = []
+        for tag, postings in zip(self.tags, self.postings):
+            # Store whichever of posting list and bitmap is smaller
+            if not isinstance(postings, int) and len(postings) * 4 > (self.count + 7) // 8:
+                postings = _bitmap_from_ids(postings, self.count)
+            if isinstance(postings, int):
+                payload = postings.to_bytes((self.count + 7) // 8, 'little')
+                tags.append([tag, 'bitmap', len(payload)])
+            else:
+                payload = postings.tobytes()
+                tags.append([tag, 'postings', len(payload)])
+            payloads.append(payload)
+
+        meta = json.dumps({'state': self.state, 'count': self.count, 'tail': self.tail,
+                           'byteorder': sys.byteorder, 'tags': tags}).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(index_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tagindex-')
+        try:
+            with open(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(LENGTH.pack(len(meta)))
+                f.write(meta)
+                f.write(self.spans.tobytes())
+                for payload in payloads:
+                    f.write(payload)
+            replace_file(temp_path, index_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, index_file):
+        """Return the index stored in index_file."""
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f'{index_file}: not a tag index')
+        pos = len(MAGIC)
+        (meta_length,) = LENGTH.unpack_from(data, pos)
+        pos += LENGTH.size
+        meta = json.loads(data[pos:pos + meta_length])
+        pos += meta_length
+        swap = meta['byteorder'] != sys.byteorder
+
+        index = cls()
+        index.state = meta['state']
+        index.count = meta['count']
+        index.tail = meta['tail']
+        index.spans.frombytes(data[pos:pos + 16 * index.count])
+        if swap:
+            index.spans.byteswap()
+        pos += 16 * index.count
+        for tag, kind, length in meta['tags']:
+            payload = data[pos:pos + length]
+            pos += length
+            if kind == 'bitmap':
+                postings = int.from_bytes(payload, 'little')
+            else:
+                postings = array('I')
+                postings.frombytes(payload)
+                if swap:
+                    postings.byteswap()
+            index.tag_ids[tag] = len(index.tags)
+            index.tags.append(tag)
+            index.postings.append(postings)
+        return index
+
+    def bitmap(self, tag):
+        """Return the bitmap of the entries tagged with tag."""
+        tag = normalize_tag(tag)
+        bitmap = self.bitmaps.get(tag)
+        if bitmap is None:
+            tag_id = self.tag_ids.get(tag)
+            if tag_id is None:
+                bitmap = 0
+            else:
+                postings = self.postings[tag_id]
+                if isinstance(postings, int):
+                    bitmap = postings
+                else:
+                    bitmap = _bitmap_from_ids(postings, self.count)
+            self.bitmaps[tag] = bitmap
+        return bitmap
+
+    def query(self, expression):
+        """Return the bitmap of the entries matching a boolean tag query.
+
+        Terms are tags, with or without '#', combined with AND, OR, NOT
+        and parentheses; adjacent terms are ANDed and 'a NOT b' means a
+        AND NOT b. NOT binds tighter than AND, which binds tighter than
+        OR. Raises ValueError for malformed queries.
+        """
+        tokens = QUERY_TOKEN_RE.findall(expression)
+        pos = 0
+        everything = (1 << self.count) - 1
+
+        def peek():
+            return tokens[pos].lower() if pos < len(tokens) else None
+
+        def parse_or():
+            nonlocal pos
+            result = parse_and()
+            while peek() == 'or':
+                pos += 1
+                result |= parse_and()
+            return result
+
+        def parse_and():
+            nonlocal pos
+            result = parse_not()
+            while peek() not in (None, 'or', ')'):
+                if peek() == 'and':
+                    pos += 1
+                result &= parse_not()
+            return result
+
+        def parse_not():
+            nonlocal pos
+            if peek() == 'not':
+                pos += 1
+                return everything & ~parse_not()
+            if peek() == '(':
+                pos += 1
+                result = parse_or()
+                if peek() != ')':
+                    raise ValueError(f'missing ) in query {expression!r}')
+                pos += 1
+                return result
+            token = tokens[pos] if pos < len(tokens) else None
+            if token is None or token.lower() in OPERATORS or token == ')':
+                raise ValueError(f'expected a tag at {token!r} in query {expression!r}')
+            pos += 1
+            return self.bitmap(token)
+
+        if not tokens:
+            raise ValueError('empty query')
+        result = parse_or()
+        if pos != len(tokens):
+            raise ValueError(f'unexpected {tokens[pos]!r} in query {expression!r}')
+        return result
+
+    def ids(self, bitmap):
+        """Return the entry ids in bitmap, in file order."""
+        return _ids_from_bitmap(bitmap)
+
+    def span(self, entry_id):
+        """Return the (start, end) byte offsets of an entry."""
+        return self.spans[2 * entry_id], self.spans[2 * entry_id + 1]
+
+    def tag_counts(self):
+        """Return {tag: number of entries} for every tag."""
+        return {tag: bin(postings).count('1') if isinstance(postings, int) else len(postings)
+                for tag, postings in zip(self.tags, self.postings)}
+
+def open_tag_index(corpus_file, index_file=None):
+    """Return the tag index of corpus_file, updating its saved copy if stale."""
+    if index_file is None:
+        index_file = f'{corpus_file}.tags'
+    try:
+        index = TagIndex.load(index_file)
+    except (OSError, ValueError, KeyError):
+        index = TagIndex()
+    known = index.state
+    if index.update(corpus_file) != 'unchanged' or index.state != known:
+        index.save(index_file)
+    return index
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Find fortunes by their tags.')
+    parser.add_argument('corpus_file')
+    parser.add_argument('query', nargs='?',
+                        help="e.g. '#entrepreneur AND #science NOT #politics'")
+    parser.add_argument('--index', metavar='FILE',
+                        help='index file (default: corpus_file.tags)')
+    parser.add_argument('--count', action='store_true',
+                        help='print the number of matching entries only')
+    parser.add_argument('--offsets', action='store_true',
+                        help='print the byte offsets of matching entries')
+    parser.add_argument('--list-tags', action='store_true',
+                        help='print every tag with its number of entries')
+    args = parser.parse_intermixed_args()
+
+    index = open_tag_index(args.corpus_file, args.index)
+    if args.list_tags:
+        for tag, count in sorted(index.tag_counts().items(), key=lambda item: (-item[1], item[0])):
+            print(f'{count}\t{tag}')
+        sys.exit(0)
+    if not args.query:
+        parser.error('a query is required')
+
+    try:
+        ids = index.ids(index.query(args.query))
+    except ValueError as e:
+        parser.error(str(e))
+    if args.count:
+        print(len(ids))
+    elif args.offsets:
+        for entry_id in ids:
+            print('%d\t%d' % index.span(entry_id))
+    else:
+        with open(args.corpus_file, 'rb') as f:
+            for entry_id in ids:
+                start, end = index.span(entry_id)
+                f.seek(start)
+                print(f.read(end - start).decode('utf-8').rstrip('\r\n'))
+                print('%')
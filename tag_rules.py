@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+from fortune_entries import replace_file
+from keyword_matcher import KeywordMatcher
+
+# Rule profiles shipped with the taggers, one per script
+RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+
+# Compiled rule sets are cached here, keyed by rule file and engine source
+CACHE_DIR = os.path.join(RULES_DIR, '__pycache__')
+
+ENGINE_FILES = [os.path.abspath(__file__),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'keyword_matcher.py')]
+
+# The same words as \b\w+\b finds, a little faster
+WORD_RE = re.compile(r'\w+')
+
+COMPARISONS = {
+    'lt': lambda a, b: a < b,
+    'le': lambda a, b: a <= b,
+    'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b,
+    'eq': lambda a, b: a == b,
+}
+
+# Condition keys a rule may have; all of them must hold for it to fire
+CONDITION_KEYS = ('content', 'author', 'raw', 'tokens', 'words', 'tag_count',
+                  'all', 'any', 'not')
+
+class RuleError(ValueError):
+    """A rule profile is malformed."""
+
+class EntryText:
+    """The content and author of an entry as tagging rules see them.
+
+    The lowercased content is made once, and the \\w+ words and the counts
+    are made the first time a rule asks for them, so every rule of a
+    profile shares the same work however many look at the text.
+    """
+
+    __slots__ = ('content', 'author', 'lower', '_words', '_token_count')
+
+    def __init__(self, content, author=''):
+        self.content = content
+        self.author = author
+        self.lower = content.lower()
+        self._words = None
+        self._token_count = None
+
+    @property
+    def words(self):
+        """Return the \\w+ words of the lowercased content."""
+        if self._words is None:
+            self._words = WORD_RE.findall(self.lower)
+        return self._words
+
+    @property
+    def word_count(self):
+        """Return the number of \\w+ words of the lowercased content."""
+        return len(self.words)
+
+    @property
+    def token_count(self):
+        """Return the number of whitespace-separated tokens of the content."""
+        if self._token_count is None:
+            self._token_count = len(self.content.split())
+        return self._token_count
+
+class _LazyGroups:
+    """Keyword groups found in a text, each searched for when first asked about.
+
+    First-match profiles usually stop after a rule or two, so checking
+    groups in rule order with str.__contains__ beats scanning the whole
+    text for every keyword at once.
+    """
+
+    __slots__ = ('groups', 'text', 'known')
+
+    def __init__(self, groups, text):
+        self.groups = groups
+        self.text = text
+        self.known = {}
+
+    def __contains__(self, group_id):
+        found = self.known.get(group_id)
+        if found is None:
+            text = self.text
+            found = self.known[group_id] = any(
+                keyword in text for keyword in self.groups.get(group_id, ()))
+        return found
+
+class RuleSet:
+    """A rule profile compiled for fast evaluation.
+
+    A profile is a JSON object:
+
+        {"description": "...", "match": "all" or "first", "sort": true,
+         "whole_words": false, "rules": [rule, ...], "default": ["#quote"]}
+
+    Each rule has output "tags" and any of these conditions, which must
+    all hold for it to fire:
+
+        "content": [keywords]  a keyword occurs in the lowercased content
+        "author": [keywords]   a keyword occurs in the lowercased author
+        "raw": [strings]       a string occurs in the content as written
+        "tokens", "words", "tag_count": {"lt"|"le"|"gt"|"ge"|"eq": n}
+                               compare the whitespace token count, the \\w+
+                               word count or the number of tags so far
+        "all", "any": [conditions], "not": condition
+
+    A rule may also hold nested "rules" with their own "match", which run
+    when it fires. With "match": "all" every rule that fires adds its tags;
+    with "first" only the first one does. "default" tags are used when no
+    rule fired, and "sort" sorts the output tags. A rule's optional "name"
+    labels it in statistics (see collect_stats).
+
+    Keywords of every "content" condition are compiled into one matcher,
+    so the content is scanned once per entry however many rules there are;
+    only first-match profiles without whole_words check their keyword
+    groups one by one, in rule order, as they stop early. "author" results
+    are looked up by author after the first time. The compiled form is
+    plain data, so it can be pickled and cached.
+    """
+
+    def __init__(self, profile, whole_words=None, path=None, version=None):
+        self.path = path
+        self.version = version
+        if not isinstance(profile, dict) or not isinstance(profile.get('rules'), list):
+            raise RuleError('a profile must be an object with a list of "rules"')
+        self.whole_words = profile.get('whole_words', False) if whole_words is None else whole_words
+        self.sort = profile.get('sort', True)
+        self.default = tuple(profile.get('default', ()))
+        self.content_groups = {}
+        self.author_groups = {}
+        self.labels = set()
+        match = profile.get('match', 'all')
+        self.steps = self._compile_rules(profile['rules'], match)
+        self.first = match == 'first'
+        self.lazy = self.first and not self.whole_words
+        self.word_groups = None
+        self.phrases = None
+        other_groups = self.content_groups
+        if self.whole_words:
+            # A keyword of word characters only matches as a whole word
+            # exactly when it is one of the text's words, so it becomes a
+            # dict lookup; a phrase like 'hard work' can only match if its
+            # first word is one of them, so it is searched for just then
+            word_groups = {}
+            phrases = {}
+            other_groups = {}
+            for group_id, keywords in self.content_groups.items():
+                for keyword in keywords:
+                    first = WORD_RE.match(keyword)
+                    if first is None:
+                        other_groups.setdefault(group_id, []).append(keyword)
+                    elif first.end() == len(keyword):
+                        word_groups.setdefault(keyword, set()).add(group_id)
+                    else:
+                        phrases.setdefault(first.group(), {}).setdefault(keyword, set()).add(group_id)
+            self.word_groups = {word: frozenset(groups) for word, groups in word_groups.items()}
+            self.phrases = {
+                first: [(re.compile(r'\b' + re.escape(keyword) + r'\b'), frozenset(groups))
+                        for keyword, groups in keywords.items()]
+                for first, keywords in phrases.items()}
+        self.content_matcher = KeywordMatcher(other_groups, self.whole_words)
+        self.author_matcher = KeywordMatcher(self.author_groups)
+        self.author_cache = {}
+
+    def _group(self, groups, keywords):
+        """Return the group id of a keyword list, sharing ids between equal lists."""
+        if not isinstance(keywords, list) or not all(isinstance(k, str) for k in keywords):
+            raise RuleError(f'expected a list of keywords, not {keywords!r}')
+        keywords = tuple(keyword.lower() for keyword in keywords)
+        for group_id, existing in groups.items():
+            if existing == keywords:
+                return group_id
+        group_id = len(self.content_groups) + len(self.author_groups)
+        groups[group_id] = keywords
+        return group_id
+
+    def _compile_condition(self, condition):
+        """Return the compiled form of a condition object."""
+        if not isinstance(condition, dict):
+            raise RuleError(f'expected a condition object, not {condition!r}')
+        parts = []
+        for key in CONDITION_KEYS:
+            if key not in condition:
+                continue
+            value = condition[key]
+            if key == 'content':
+                parts.append(('content', self._group(self.content_groups, value)))
+            elif key == 'author':
+                parts.append(('author', self._group(self.author_groups, value)))
+            elif key == 'raw':
+                parts.append(('raw', tuple(value)))
+            elif key in ('tokens', 'words', 'tag_count'):
+                if not isinstance(value, dict) or len(value) != 1 or \
+                        next(iter(value)) not in COMPARISONS:
+                    raise RuleError(f'{key} needs one of {sorted(COMPARISONS)}, not {value!r}')
+                (op, n), = value.items()
+                parts.append((key, op, n))
+            elif key in ('all', 'any'):
+                parts.append((key, tuple(self._compile_condition(c) for c in value)))
+            else:
+                parts.append(('not', self._compile_condition(value)))
+        if len(parts) == 1:
+            return parts[0]
+        # No conditions at all makes an empty 'all', which always holds
+        return ('all', tuple(parts))
+
+    def _compile_rules(self, rules, match):
+        """Return the steps evaluating a list of rules."""
+        if match not in ('all', 'first'):
+            raise RuleError(f'"match" must be "all" or "first", not {match!r}')
+        steps = []
+        for rule in rules:
+            if not isinstance(rule, dict):
+                raise RuleError(f'expected a rule object, not {rule!r}')
+            unknown = set(rule) - set(CONDITION_KEYS) - {'name', 'tags', 'rules', 'match'}
+            if unknown:
+                raise RuleError(f'unknown rule keys {sorted(unknown)}')
+            tags = tuple(rule.get('tags', ()))
+            label = self._label(rule)
+            condition = self._compile_condition({key: rule[key] for key in CONDITION_KEYS
+                                                 if key in rule})
+            nested = None
+            if 'rules' in rule:
+                nested_match = rule.get('match', 'all')
+                nested = (nested_match == 'first',
+                          self._compile_rules(rule['rules'], nested_match))
+            if nested is None and condition[0] in ('content', 'author'):
+                # Plain keyword rules need no condition evaluation: a run of
+                # them is applied straight from the matched groups, in any
+                # order for 'all' and in rule order for 'first'
+                kind = 'keywords' if match == 'all' else 'first_keywords'
+                if steps and steps[-1][0] == kind:
+                    table = steps[-1][1]
+                else:
+                    table = {} if match == 'all' else []
+                    steps.append((kind, table, {}))
+                if match == 'all':
+                    table.setdefault(condition[1], {}).update(dict.fromkeys(tags))
+                    steps[-1][2].setdefault(condition[1], []).append((condition[0], label))
+                else:
+                    field, group_id = condition
+                    groups = self.content_groups if field == 'content' else self.author_groups
+                    table.append((field, group_id, groups[group_id], dict.fromkeys(tags), label))
+            else:
+                steps.append(('rule', condition, dict.fromkeys(tags), nested, label))
+        return steps
+
+    def _label(self, rule):
+        """Return a unique name for a rule in statistics."""
+        label = rule.get('name')
+        if label is None:
+            label = ' '.join(rule.get('tags', ())) or '(block)'
+            conditions = [key for key in CONDITION_KEYS if key in rule]
+            if 'author' in rule:
+                conditions[conditions.index('author')] = 'author ' + '/'.join(rule['author'])
+            label = f"{label} [{', '.join(conditions) or 'always'}]"
+        n = 2
+        unique = label
+        while unique in self.labels:
+            unique = f'{label} ({n})'
+            n += 1
+        self.labels.add(unique)
+        return unique
+
+    def _holds(self, condition, text, found, authors, tags):
+        """Return True if a compiled condition holds."""
+        kind = condition[0]
+        if kind == 'content':
+            return condition[1] in found
+        if kind == 'author':
+            return condition[1] in authors
+        if kind == 'all':
+            for c in condition[1]:
+                if not self._holds(c, text, found, authors, tags):
+                    return False
+            return True
+        if kind == 'any':
+            for c in condition[1]:
+                if self._holds(c, text, found, authors, tags):
+                    return True
+            return False
+        if kind == 'not':
+            return not self._holds(condition[1], text, found, authors, tags)
+        if kind == 'raw':
+            return any(s in text.content for s in condition[1])
+        if kind == 'tokens':
+            value = text.token_count
+        elif kind == 'words':
+            value = text.word_count
+        else:
+            value = len(tags)
+        return COMPARISONS[condition[1]](value, condition[2])
+
+    def _run(self, steps, first, text, found, authors, tags):
+        """Apply steps to an EntryText, adding to tags; return True if any rule fired."""
+        fired = False
+        for step in steps:
+            kind = step[0]
+            if kind == 'keywords':
+                table = step[1]
+                matched = found
+                if isinstance(found, _LazyGroups):
+                    matched = [group_id for group_id in table if group_id in found]
+                for groups in (matched, authors):
+                    for group_id in groups:
+                        group_tags = table.get(group_id)
+                        if group_tags is not None:
+                            tags.update(group_tags)
+                            fired = True
+                continue
+            if kind == 'first_keywords':
+                lazy = self.lazy
+                lower = text.lower
+                for field, group_id, keywords, rule_tags, _ in step[1]:
+                    if field == 'author':
+                        hit = group_id in authors
+                    elif lazy:
+                        # Inline _LazyGroups: each group is tested once here
+                        hit = False
+                        for keyword in keywords:
+                            if keyword in lower:
+                                hit = True
+                                break
+                    else:
+                        hit = group_id in found
+                    if hit:
+                        tags.update(rule_tags)
+                        return True
+                continue
+            _, condition, rule_tags, nested, _ = step
+            if not self._holds(condition, text, found, authors, tags):
+                continue
+            tags.update(rule_tags)
+            if nested is not None:
+                self._run(nested[1], nested[0], text, found, authors, tags)
+            fired = True
+            if first:
+                break
+        return fired
+
+    def _author_groups(self, author):
+        """Return the author groups matching author, remembering the answer."""
+        groups = self.author_cache.get(author)
+        if groups is None:
+            if len(self.author_cache) >= 1 << 16:
+                self.author_cache.clear()
+            groups = self.author_cache[author] = frozenset(
+                self.author_matcher.find(author.lower()))
+        return groups
+
+    def _content_groups(self, text):
+        """Return the content groups with a keyword in an EntryText."""
+        if self.lazy:
+            return _LazyGroups(self.content_groups, text.lower)
+        if self.word_groups is None:
+            return self.content_matcher.find(text.lower)
+        # Whole words are looked up by the words the text was split into
+        found = set()
+        word_groups = self.word_groups
+        words = text.words
+        for word in words:
+            groups = word_groups.get(word)
+            if groups is not None:
+                found |= groups
+        if self.phrases:
+            for first in self.phrases.keys() & set(words):
+                for regex, groups in self.phrases[first]:
+                    if regex.search(text.lower):
+                        found |= groups
+        if self.content_matcher.regex is not None:
+            found |= self.content_matcher.find(text.lower)
+        return found
+
+    def evaluate(self, text):
+        """Return the tag string for an EntryText."""
+        found = self._content_groups(text)
+        authors = self._author_groups(text.author) if self.author_groups else frozenset()
+        # A dict keeps first-added order for profiles that do not sort
+        tags = {}
+        self._run(self.steps, self.first, text, found, authors, tags)
+        if not tags:
+            tags = dict.fromkeys(self.default)
+        return ' '.join(sorted(tags) if self.sort else tags)
+
+    def tags(self, content, author=''):
+        """Return the tag string for an entry's content and author."""
+        return self.evaluate(EntryText(content, author))
+
+    @contextmanager
+    def collect_stats(self, stats):
+        """Record rule hits and timings in a TagStats while in the block.
+
+        evaluate is only swapped for its measuring twin here, so rule sets
+        not collecting statistics run exactly as fast as before. A stats of
+        None collects nothing.
+        """
+        if stats is None:
+            yield self
+            return
+        self.stats = stats
+        self.evaluate = self._evaluate_stats
+        try:
+            yield self
+        finally:
+            del self.evaluate, self.stats
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('evaluate', None)
+        state.pop('stats', None)
+        return state
+
+    def _evaluate_stats(self, text):
+        """evaluate, recording each rule's evaluations, hits and time in self.stats."""
+        stats = self.stats
+        perf_counter = time.perf_counter
+        start = perf_counter()
+        found = self._content_groups(text)
+        middle = perf_counter()
+        authors = self._author_groups(text.author) if self.author_groups else frozenset()
+        end = perf_counter()
+        if not self.lazy:
+            stats.rule('[content scan]', bool(found), middle - start)
+        if self.author_groups:
+            stats.rule('[author lookup]', bool(authors), end - middle)
+        tags = {}
+        self._run_stats(self.steps, self.first, text, found, authors, tags)
+        if not tags:
+            tags = dict.fromkeys(self.default)
+            stats.rule('[default]', True, 0.0)
+        return ' '.join(sorted(tags) if self.sort else tags)
+
+    def _run_stats(self, steps, first, text, found, authors, tags):
+        """_run, timing every rule on its own; return True if any rule fired."""
+        stats = self.stats
+        perf_counter = time.perf_counter
+        fired = False
+        for step in steps:
+            kind = step[0]
+            if kind == 'keywords':
+                for group_id, rules in step[2].items():
+                    start = perf_counter()
+                    hit = group_id in (found if group_id in self.content_groups else authors)
+                    if hit:
+                        tags.update(step[1][group_id])
+                        fired = True
+                    seconds = (perf_counter() - start) / len(rules)
+                    for field, label in rules:
+                        stats.rule(label, hit, seconds)
+                        if hit:
+                            self._record_keywords(label, field, group_id, text)
+                continue
+            if kind == 'first_keywords':
+                for field, group_id, keywords, rule_tags, label in step[1]:
+                    start = perf_counter()
+                    hit = group_id in (authors if field == 'author' else found)
+                    stats.rule(label, hit, perf_counter() - start)
+                    if hit:
+                        self._record_keywords(label, field, group_id, text)
+                        tags.update(rule_tags)
+                        return True
+                continue
+            _, condition, rule_tags, nested, label = step
+            start = perf_counter()
+            hit = self._holds(condition, text, found, authors, tags)
+            stats.rule(label, hit, perf_counter() - start)
+            if not hit:
+                continue
+            if condition[0] in ('content', 'author'):
+                self._record_keywords(label, condition[0], condition[1], text)
+            tags.update(rule_tags)
+            if nested is not None:
+                self._run_stats(nested[1], nested[0], text, found, authors, tags)
+            fired = True
+            if first:
+                break
+        return fired
+
+    def _record_keywords(self, label, field, group_id, text):
+        """Record in self.stats which keywords of a group made the rule label fire."""
+        if field == 'author':
+            target = text.author.lower()
+            keywords = self.author_groups[group_id]
+            whole_words = False
+        else:
+            target = text.lower
+            keywords = self.content_groups[group_id]
+            whole_words = self.whole_words
+        for keyword in keywords:
+            if keyword in target and (not whole_words or re.search(
+                    r'\b' + re.escape(keyword) + r'\b', target)):
+                self.stats.keyword(label, keyword)
+
+def profile_path(name):
+    """Return the rule file of a profile name, or name itself if it is a path."""
+    if os.path.sep in name or name.endswith('.json'):
+        return name
+    return os.path.join(RULES_DIR, f'{name}.json')
+
+def _version(path):
+    """Return a digest of a rule file and the engine that compiles it."""
+    digest = hashlib.blake2b(digest_size=8)
+    for source in [path] + ENGINE_FILES:
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def load_profile(name, whole_words=None, cache=True):
+    """Return the compiled RuleSet of a profile name or rule file.
+
+    With cache, the compiled rule set is kept in rules/__pycache__ and
+    reused until the rule file or the engine changes.
+    """
+    path = profile_path(name)
+    version = _version(path)
+    cache_file = os.path.join(CACHE_DIR, '%s.%s.pickle' % (
+        os.path.basename(path), {None: 'profile', False: 'substring', True: 'words'}[whole_words]))
+    if cache:
+        try:
+            with open(cache_file, 'rb') as f:
+                rules = pickle.load(f)
+            if rules.version == version and rules.path == path:
+                return rules
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            profile = json.load(f)
+        except ValueError as e:
+            raise RuleError(f'{path}: {e}') from None
+    try:
+        rules = RuleSet(profile, whole_words, path, version)
+    except RuleError as e:
+        raise RuleError(f'{path}: {e}') from None
+
+    if cache:
+        # The cache only saves time, so failing to write it is no error
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix='.rules-')
+            try:
+                with open(fd, 'wb') as f:
+                    pickle.dump(rules, f, pickle.HIGHEST_PROTOCOL)
+                replace_file(temp_path, cache_file)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            pass
+    return rules
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Check tag rule profiles or try them on a quote.')
+    parser.add_argument('profiles', nargs='+',
+                        help='profile names (e.g. improved_tags) or rule files')
+    parser.add_argument('--text', help='print the tags each profile gives this content')
+    parser.add_argument('--author', default='', help='author for --text')
+    parser.add_argument('--whole-words', action='store_true',
+                        help="only match whole words, so 'art' does not match 'start'")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.profiles:
+        try:
+            rules = load_profile(name, True if args.whole_words else None)
+        except (OSError, RuleError) as e:
+            print(f'{name}: {e}', file=sys.stderr)
+            failed = True
+            continue
+        if args.text is None:
+            print(f'{name}: {len(rules.content_groups)} content and '
+                  f'{len(rules.author_groups)} author keyword groups')
+        else:
+            print(f'{name}: {rules.tags(args.text, args.author)}')
+    sys.exit(1 if failed else 0)
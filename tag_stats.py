@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import json
+import time
+from collections import Counter
+
+class TagStats:
+    """Hit counts and timings gathered while tagging a file.
+
+    Phases (parse, tag, write, ...) count entries and the time spent on
+    them; rules count how often they were evaluated and fired, the time
+    their evaluation took and which keywords made them fire. Nothing is
+    measured unless a TagStats is passed in, so tagging without one costs
+    nothing extra.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.rules = {}
+        self.keywords = {}
+
+    def timed(self, name, func):
+        """Return func wrapped to add each call to phase name."""
+        phase = self.phases.setdefault(name, [0, 0.0])
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return func(*args)
+            finally:
+                phase[0] += 1
+                phase[1] += perf_counter() - start
+        return wrapper
+
+    def timed_iter(self, name, iterable):
+        """Return an iterator over iterable adding the time to get each item to phase name."""
+        return self._timed_iter(self.phases.setdefault(name, [0, 0.0]), iterable)
+
+    def _timed_iter(self, phase, iterable):
+        perf_counter = time.perf_counter
+        iterator = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                phase[1] += perf_counter() - start
+                return
+            phase[0] += 1
+            phase[1] += perf_counter() - start
+            yield item
+
+    def rule(self, label, fired, seconds):
+        """Record one evaluation of a rule."""
+        counts = self.rules.get(label)
+        if counts is None:
+            counts = self.rules[label] = [0, 0, 0.0]
+        counts[0] += 1
+        counts[1] += fired
+        counts[2] += seconds
+
+    def keyword(self, label, keyword):
+        """Record that keyword made the rule label fire."""
+        counter = self.keywords.get(label)
+        if counter is None:
+            counter = self.keywords[label] = Counter()
+        counter[keyword] += 1
+
+    def as_dict(self):
+        """Return the statistics as plain data, slowest rules first."""
+        return {
+            'phases': {name: {'entries': count, 'seconds': round(seconds, 6),
+                              'entries_per_s': round(count / seconds) if seconds else None}
+                       for name, (count, seconds) in self.phases.items()},
+            'rules': [{'rule': label, 'evaluations': evaluations, 'hits': hits,
+                       'seconds': round(seconds, 6),
+                       'keywords': dict(self.keywords.get(label, Counter()).most_common())}
+                      for label, (evaluations, hits, seconds)
+                      in sorted(self.rules.items(), key=lambda item: (-item[1][2], item[0]))],
+        }
+
+    def table(self):
+        """Return the statistics as lines of text tables."""
+        lines = [f"{'phase':12} {'entries':>9} {'seconds':>9} {'entries/s':>10}"]
+        for name, (count, seconds) in self.phases.items():
+            rate = f'{count / seconds:10.0f}' if seconds else f"{'-':>10}"
+            lines.append(f'{name:12} {count:9} {seconds:9.3f} {rate}')
+        lines.append('')
+        lines.append(f"{'rule':40} {'evals':>8} {'hits':>8} {'seconds':>9} {'us/eval':>8}  keywords")
+        for label, (evaluations, hits, seconds) in sorted(
+                self.rules.items(), key=lambda item: (-item[1][2], item[0])):
+            keywords = ', '.join(f'{keyword} ({count})' for keyword, count
+                                 in self.keywords.get(label, Counter()).most_common(4))
+            per_eval = seconds / evaluations * 1e6 if evaluations else 0
+            lines.append(f'{label[:40]:40} {evaluations:8} {hits:8} {seconds:9.3f} '
+                         f'{per_eval:8.2f}  {keywords}')
+        return lines
+
+    def report(self, format='table'):
+        """Return the statistics as a 'table' or as 'json' text."""
+        if format == 'json':
+            return json.dumps(self.as_dict(), indent=1)
+        return '\n'.join(self.table())